@@ -80,8 +80,8 @@ class EmailedReferral(models.Model):
 
         User = get_user_model()
         region = None
-        dbca = Agency.objects.get(slug="dbca")
-        wapc = Organisation.objects.get(slug="wapc")
+        dbca = Agency.objects.get_cached(slug="dbca")
+        wapc = Organisation.objects.get_cached(slug="wapc")
         attachments = self.emailattachment_set.all()
         self.log = ""
 
@@ -122,8 +122,8 @@ class EmailedReferral(models.Model):
             # Try to parse the referral reference from the email subject (it's normally the first
             # element in the string).
             reference = self.subject.split()[0]
-            if Referral.objects.current().filter(reference__iexact=reference):
-                referral = Referral.objects.current().filter(reference__iexact=reference).order_by("-pk").first()
+            referral = Referral.objects.current().filter(reference__iexact=reference).order_by("-pk").first()
+            if referral:
                 log = f"Referral ref. {reference} is already in database; using existing referral {referral.pk}"
                 LOGGER.info(log)
                 self.log = self.log + f"{log}\n"
@@ -191,7 +191,8 @@ class EmailedReferral(models.Model):
 
             # We parsed a reference number from the subject line.
             reference = m.group(1)
-            if not Referral.objects.current().filter(reference__iexact=reference).exists():
+            referral = Referral.objects.current().filter(reference__iexact=reference).order_by("-pk").first()
+            if not referral:
                 log = f"Skipping harvested decision letter {self.pk} (no existing referral)"
                 LOGGER.info(log)
                 self.log = log
@@ -205,7 +206,6 @@ class EmailedReferral(models.Model):
             LOGGER.info(log)
             self.log = self.log + f"{log}\n"
             actions.append(f"{datetime.now().isoformat()} {log}")
-            referral = Referral.objects.current().filter(reference__iexact=reference).order_by("-pk").first()
 
             # Save the EmailedReferral as a record on the referral.
             if create_records:
@@ -280,13 +280,13 @@ class EmailedReferral(models.Model):
         reference = app["WAPC_APPLICATION_NO"]
 
         # Determine if this is a new or existing referral.
-        if Referral.objects.current().filter(reference__iexact=reference):
+        referral = Referral.objects.current().filter(reference__iexact=reference).order_by("-pk").first()
+        if referral:
             # Note if the the reference no. exists in PRS already.
             log = f"Referral ref. {reference} is already in database; using existing referral"
             LOGGER.info(log)
             self.log = self.log + f"{log}\n"
             actions.append(f"{datetime.now().isoformat()} {log}")
-            referral = Referral.objects.current().filter(reference__iexact=reference).order_by("-pk").first()
             referral_preexists = True
         else:
             # No match with existing references; create a new referral.
@@ -347,20 +347,20 @@ class EmailedReferral(models.Model):
                 # A couple of exceptions for DoP triggers follow (specific -> general trigger).
                 if i.startswith("BUSH FOREVER SITE"):
                     added_trigger = True
-                    referral.dop_triggers.add(DopTrigger.objects.get(name="Bush Forever site"))
+                    referral.dop_triggers.add(DopTrigger.objects.get_cached(name="Bush Forever site"))
                 elif i.startswith("DPW ESTATE"):
                     added_trigger = True
-                    referral.dop_triggers.add(DopTrigger.objects.get(name="Parks and Wildlife estate"))
+                    referral.dop_triggers.add(DopTrigger.objects.get_cached(name="Parks and Wildlife estate"))
                 elif i.find("REGIONAL PARK") > -1:
                     added_trigger = True
-                    referral.dop_triggers.add(DopTrigger.objects.get(name="Regional Park"))
+                    referral.dop_triggers.add(DopTrigger.objects.get_cached(name="Regional Park"))
                 # All other triggers (don't use exists() in case of duplicates).
                 elif DopTrigger.objects.current().filter(name__istartswith=i).count() == 1:
                     added_trigger = True
                     referral.dop_triggers.add(DopTrigger.objects.current().get(name__istartswith=i))
             # If we didn't link any DoP triggers, link the "No Parks and Wildlife trigger" tag.
             if not added_trigger:
-                referral.dop_triggers.add(DopTrigger.objects.get(name="No Parks and Wildlife trigger"))
+                referral.dop_triggers.add(DopTrigger.objects.get_cached(name="No Parks and Wildlife trigger"))
 
         # For new referrals, add locations to the referral (one per polygon in each MP geometry).
         # Obtain location geometry from Landgate SLIP.
@@ -425,12 +425,12 @@ class EmailedReferral(models.Model):
             # Didn't intersect a region? Might be bad geometry in the XML.
             # Likewise if >1 region was intersected, default to Swan Region.
             if len(regions) == 0:
-                region = Region.objects.get(name="Swan")
+                region = Region.objects.get_cached(name="Swan")
                 log = f"No regions were intersected, defaulting to {region}"
                 LOGGER.info(log)
                 self.log = self.log + f"{log}\n"
             elif len(regions) > 1:
-                region = Region.objects.get(name="Swan")
+                region = Region.objects.get_cached(name="Swan")
                 log = f">1 regions were intersected ({regions}), defaulting to {region}"
                 LOGGER.info(log)
                 self.log = self.log + f"{log}\n"
@@ -488,7 +488,7 @@ class EmailedReferral(models.Model):
 
         # New referrals only: create an "Assess a referral" task and assign it to a user.
         if create_tasks and referral_preexists is False:
-            assess_task = TaskType.objects.get(name="Assess a referral")
+            assess_task = TaskType.objects.get_cached(name="Assess a referral")
 
             # If a task assignee has not been specified, try to determine one from the region default.
             if not assignee:
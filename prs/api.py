@@ -1,5 +1,6 @@
 from django.urls import path
 from referral.api_v3 import (
+    ChangesAPIResource,
     ClearanceAPIResource,
     OrganisationAPIResource,
     ReferralAPIResource,
@@ -30,8 +31,10 @@ v3_api = [
     path("user/<int:pk>/", UserAPIResource.as_view(), name="user_api_resource"),
     path("referral/", ReferralAPIResource.as_view(), name="referral_api_resource"),
     path("referral/<int:pk>/", ReferralAPIResource.as_view(), name="referral_api_resource"),
+    path("referral/changes/", ChangesAPIResource.as_view(resource=ReferralAPIResource), name="referral_api_changes"),
     path("task/", TaskAPIResource.as_view(), name="task_api_resource"),
     path("task/<int:pk>/", TaskAPIResource.as_view(), name="task_api_resource"),
+    path("task/changes/", ChangesAPIResource.as_view(resource=TaskAPIResource), name="task_api_changes"),
     path("clearance/", ClearanceAPIResource.as_view(), name="clearance_api_resource"),
     path("clearance/<int:pk>/", ClearanceAPIResource.as_view(), name="clearance_api_resource"),
 ]
@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.urls import reverse
+from referral.utils import get_user_context
 
 
 def template_context(request):
@@ -19,8 +20,10 @@ def template_context(request):
         },
     }
     if request.user.is_authenticated:
-        context["prs_user"] = request.user.userprofile.is_prs_user()
-        context["prs_power_user"] = request.user.userprofile.is_power_user()
-        context["last_referral"] = request.user.userprofile.last_referral()
+        # User capabilities are cached, so that they aren't queried for every template render.
+        user_context = get_user_context(request)
+        context["prs_user"] = user_context["prs_user"]
+        context["prs_power_user"] = user_context["prs_power_user"] or request.user.is_superuser
+        context["last_referral_pk"] = user_context["last_referral_pk"]
     context.update(settings.STATIC_CONTEXT_VARS)
     return context
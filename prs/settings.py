@@ -197,6 +197,26 @@ else:
         }
     }
 API_RESPONSE_CACHE_SECONDS = env("API_RESPONSE_CACHE_SECONDS", 60)
+# API responses for more objects than this are streamed, fetching objects from the database in chunks.
+API_STREAMING_LIMIT = env("API_STREAMING_LIMIT", 500)
+API_STREAMING_CHUNK_SIZE = env("API_STREAMING_CHUNK_SIZE", 200)
+# API change feeds exclude changes more recent than this, to allow concurrent transactions to commit.
+API_CHANGES_SETTLE_SECONDS = env("API_CHANGES_SETTLE_SECONDS", 5)
+USER_CONTEXT_CACHE_SECONDS = env("USER_CONTEXT_CACHE_SECONDS", 300)
+REFERRAL_HISTORY_FLUSH_SECONDS = env("REFERRAL_HISTORY_FLUSH_SECONDS", 60)
+REFERRAL_HISTORY_CACHE_SECONDS = env("REFERRAL_HISTORY_CACHE_SECONDS", 86400)
+CHOICES_CACHE_SECONDS = env("CHOICES_CACHE_SECONDS", 86400)
+# Reports containing more objects than this are generated asynchronously, instead of in the request.
+REPORT_SYNC_MAX_ROWS = env("REPORT_SYNC_MAX_ROWS", 10000)
+REPORT_CHUNK_SIZE = env("REPORT_CHUNK_SIZE", 2000)
+# Report files larger than this (bytes) are spooled to disk before download, rather than held in memory.
+REPORT_SPOOL_MAX_SIZE = env("REPORT_SPOOL_MAX_SIZE", 10 * 1024 * 1024)
+# The summary tables are refreshed incrementally, with a full refresh at least this often.
+REPORT_SUMMARY_FULL_REFRESH_HOURS = env("REPORT_SUMMARY_FULL_REFRESH_HOURS", 24)
+# Encoder for large JSON responses: "orjson" or "stdlib".
+JSON_ENCODER = env("JSON_ENCODER", "orjson")
+# Select lists with more options than this are populated client-side from the API, instead of inline.
+SELECTLIST_INLINE_MAX = env("SELECTLIST_INLINE_MAX", 200)
 
 # Email settings
 EMAIL_HOST = env("EMAIL_HOST", "email.host")
@@ -1,6 +1,14 @@
+from datetime import timedelta
+from functools import partial, wraps
+from hashlib import md5
+
 from django.conf import settings
 from django.contrib.auth.models import Group, User
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db.models import Prefetch, QuerySet
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_control
 from django.views.decorators.vary import vary_on_cookie
@@ -9,7 +17,164 @@ from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.list import MultipleObjectMixin
 from taggit.models import Tag
 
-from .models import Clearance, Organisation, Referral, ReferralType, Region, Task, TaskState, TaskType
+from .models import (
+    Clearance,
+    Condition,
+    DopTrigger,
+    LocalGovernment,
+    Organisation,
+    OrganisationType,
+    Referral,
+    ReferralType,
+    Region,
+    RelatedReferral,
+    Task,
+    TaskState,
+    TaskType,
+)
+from .utils import (
+    FastJsonResponse,
+    encode_cursor,
+    get_cache_versions,
+    get_keyset_fields,
+    get_model_version_key,
+    get_user_context,
+    json_dumps,
+    keyset_paginate,
+    shared_cache_enabled,
+)
+
+
+def get_permission_tier(request):
+    """Returns the permission tier of the request user, used to partition cached API responses."""
+    if not request.user.is_authenticated:
+        return "anonymous"
+    if request.user.is_superuser:
+        return "superuser"
+    user_context = get_user_context(request)
+    if user_context["prs_power_user"]:
+        return "power_user"
+    if user_context["prs_user"]:
+        return "user"
+    return "authenticated"
+
+
+def api_response_cache(*models):
+    """View decorator to cache API responses in the shared cache, keyed on the request path, query parameters
+    and user permission tier, plus the version stamps of the passed-in models (so that a change to any object
+    of those models invalidates the cached responses). Cached responses expire after API_RESPONSE_CACHE_SECONDS
+    at most. Responses include the cache key as an ETag, so that conditional requests can be answered without
+    querying the database.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not shared_cache_enabled() or request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+
+            versions = get_cache_versions([get_model_version_key(model) for model in models])
+            query = sorted(request.GET.lists())
+            digest = md5(f"{request.path}:{query}:{get_permission_tier(request)}:{versions}".encode()).hexdigest()
+            # The cache key digest also serves as the response ETag: return a 304 response if the client's copy is current.
+            etag = f'"{digest}"'
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:  # Not modified, or precondition failed.
+                response["ETag"] = etag
+                return response
+
+            key = f"prs:api_response:{digest}"
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                # Streamed responses are not cached.
+                if not response.streaming:
+                    cache.set(key, (response.content, response["Content-Type"]), settings.API_RESPONSE_CACHE_SECONDS)
+
+            response.headers["ETag"] = etag
+            return response
+
+        return _wrapped_view
+
+    return decorator
+
+
+def get_api_limit(request):
+    """Returns the maximum number of objects requested for an API response. Raises ValueError for an invalid limit."""
+    if "limit" in request.GET and request.GET["limit"]:
+        return int(request.GET["limit"])
+    return 50  # Default to a maximum of 50 objects in the response.
+
+
+def paginate_api_queryset(request, queryset, fields):
+    """Paginate a queryset for an API response, returning a tuple of (count, objects, next_cursor).
+    If a ``cursor`` query parameter is passed in (an empty value requests the first page), use keyset
+    pagination on ``fields`` and only count the filtered results for the first page (a list, of at most
+    API_STREAMING_LIMIT objects). Otherwise, fall back to offset/limit pagination (an un-evaluated queryset).
+    Raises ValueError for an invalid cursor or limit.
+    """
+    limit = get_api_limit(request)
+
+    if "cursor" in request.GET:
+        # Keyset pages are evaluated to a list, so streaming them saves no memory: cap the page size instead
+        # (clients follow next_cursor for the remaining objects).
+        limit = min(limit, settings.API_STREAMING_LIMIT)
+        cursor = request.GET["cursor"]
+        obj_count = None if cursor else queryset.count()
+        objects, next_cursor = keyset_paginate(queryset, fields, cursor, limit)
+        return obj_count, objects, next_cursor
+
+    obj_count = queryset.count()  # Count the filtered results.
+    offset = 0
+    if "offset" in request.GET and request.GET["offset"]:
+        offset = int(request.GET["offset"])
+        # Ignore any offset which is greater than the result count.
+        if offset >= obj_count:
+            offset = 0
+
+    # Django's queryset slicing is smart enough that we don't need to worry about "wrapping around".
+    return obj_count, queryset[offset : offset + limit], None
+
+
+def stream_api_objects(obj_count, objects, serialise):
+    """Generator that yields an offset-paginated API response as JSON, serialising objects one at a time."""
+    yield b'{"count": ' + json_dumps(obj_count) + b', "objects": ['
+    # Fetch objects (and their prefetched relations) in chunks, rather than all at once.
+    objects = objects.iterator(chunk_size=settings.API_STREAMING_CHUNK_SIZE)
+    for i, obj in enumerate(objects):
+        yield (b", " if i else b"") + json_dumps(serialise(obj))
+    yield b"]}"
+
+
+def api_list_response(request, obj_count, objects, next_cursor, serialise):
+    """Returns the JSON response for a paginated API resource list, serialising each object with `serialise`.
+    Responses for a queryset limited to more than API_STREAMING_LIMIT objects are streamed, so that memory use doesn't
+    scale with page size.
+    """
+    if isinstance(objects, QuerySet) and get_api_limit(request) > settings.API_STREAMING_LIMIT:
+        return StreamingHttpResponse(
+            stream_api_objects(obj_count, objects, serialise),
+            content_type="application/json",
+        )
+
+    resp = {
+        "count": obj_count,
+        "objects": [serialise(obj) for obj in objects],
+    }
+    if "cursor" in request.GET:
+        resp["next_cursor"] = next_cursor
+
+    return FastJsonResponse(resp)
+
+
+def current_regions_prefetch(lookup="regions"):
+    """Returns a Prefetch of current regions for the passed-in lookup, into a `current_regions` list."""
+    return Prefetch(lookup, queryset=Region.objects.current(), to_attr="current_regions")
 
 
 class ListApiResource(View, MultipleObjectMixin):
@@ -27,6 +192,7 @@ class ReferralTypeAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(ReferralType, TaskType))
     def get(self, request, *args, **kwargs):
         queryset = ReferralType.objects.current()
 
@@ -51,7 +217,7 @@ class ReferralTypeAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
 
 
 class RegionAPIResource(View):
@@ -61,6 +227,7 @@ class RegionAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(Region))
     def get(self, request, *args, **kwargs):
         queryset = Region.objects.current()
 
@@ -83,7 +250,7 @@ class RegionAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
 
 
 class OrganisationAPIResource(View):
@@ -93,6 +260,7 @@ class OrganisationAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(Organisation, OrganisationType))
     def get(self, request, *args, **kwargs):
         queryset = Organisation.objects.current()
 
@@ -101,10 +269,15 @@ class OrganisationAPIResource(View):
             queryset = queryset.filter(pk=kwargs["pk"])
         if "q" in self.request.GET:  # Allow basic filtering on name.
             queryset = queryset.filter(name__icontains=self.request.GET["q"])
+        if "public" in self.request.GET:  # Public organisations only, as listed in the referral form select list.
+            queryset = queryset.filter(public=True).order_by("list_name")
 
         # Tailor the API response.
         if "selectlist" in request.GET:  # Smaller response, for use in HTML select lists.
-            objects = [{"id": obj.pk, "text": obj.name} for obj in queryset]
+            if "public" in request.GET:
+                objects = [{"id": obj.pk, "text": obj.list_name} for obj in queryset]
+            else:
+                objects = [{"id": obj.pk, "text": obj.name} for obj in queryset]
         else:
             objects = [
                 {
@@ -124,7 +297,7 @@ class OrganisationAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
 
 
 class TaskStateAPIResource(View):
@@ -134,6 +307,7 @@ class TaskStateAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(TaskState, TaskType))
     def get(self, request, *args, **kwargs):
         queryset = TaskState.objects.current()
 
@@ -159,7 +333,7 @@ class TaskStateAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
 
 
 class TaskTypeAPIResource(View):
@@ -169,6 +343,7 @@ class TaskTypeAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(TaskType, TaskState))
     def get(self, request, *args, **kwargs):
         queryset = TaskType.objects.current()
 
@@ -194,7 +369,7 @@ class TaskTypeAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
 
 
 class UserAPIResource(View):
@@ -204,6 +379,7 @@ class UserAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(User))
     def get(self, request, *args, **kwargs):
         # Queryset should only return active users in the "PRS user" group.
         prs_user = Group.objects.get_or_create(name=settings.PRS_USER_GROUP)[0]
@@ -217,7 +393,7 @@ class UserAPIResource(View):
 
         # Tailor the API response.
         if "selectlist" in request.GET:  # Smaller response, for use in HTML select lists.
-            objects = [{"id": obj.pk, "text": obj.get_full_name()} for obj in queryset]
+            objects = [{"id": obj.pk, "text": obj.get_full_name() or obj.username} for obj in queryset]
         else:
             objects = [
                 {
@@ -228,7 +404,7 @@ class UserAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
 
 
 class TagAPIResource(View):
@@ -238,6 +414,7 @@ class TagAPIResource(View):
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(Tag))
     def get(self, request, *args, **kwargs):
         queryset = Tag.objects.all().order_by("name")
 
@@ -260,20 +437,129 @@ class TagAPIResource(View):
                 for obj in queryset
             ]
 
-        return JsonResponse(objects, safe=False)
+        return FastJsonResponse(objects, safe=False)
+
+
+def date_str(value):
+    """Returns a date as a YYYY-MM-DD string (or None)."""
+    return value.strftime("%Y-%m-%d") if value else None
+
+
+class ApiField:
+    """A field in a serialised API response: a function returning the field value for an object, plus the model
+    fields (for only()), related objects (for select_related()) and a function returning the prefetches (for
+    prefetch_related()) which are required to evaluate it.
+    """
+
+    def __init__(self, value, only=(), select=(), prefetch=None):
+        self.value = value
+        self.only = only
+        self.select = select
+        self.prefetch = prefetch
+
 
+class SerialisedAPIResource(View):
+    """Base class for API resources which serialise objects from a dict of ApiField objects.
+    Clients may request a subset of fields with the `fields` query parameter (e.g. ?fields=id,reference), which
+    also trims the database queries, and a batch of objects by PK with the `ids` query parameter (e.g. ?ids=1,2,3).
+    """
 
-class ReferralAPIResource(View):
+    http_method_names = ["get", "options", "head", "trace"]
+    model = None
+    api_fields = {}
+
+    def get_fields(self, request):
+        """Returns the list of field names in the `fields` query parameter, or None for all fields.
+        Raises ValueError for an unknown field name.
+        """
+        if not request.GET.get("fields"):
+            return None
+        fields = [field.strip() for field in request.GET["fields"].split(",") if field.strip()]
+        for field in fields:
+            if field not in self.api_fields:
+                raise ValueError(f"Unknown field: {field}")
+        # Always include the object ID.
+        return ["id"] + [field for field in fields if field != "id"]
+
+    def filter_ids(self, request, queryset):
+        """Filters the queryset by the PKs in the `ids` query parameter. Raises ValueError for an invalid PK."""
+        if request.GET.get("ids"):
+            queryset = queryset.filter(pk__in=[int(pk) for pk in request.GET["ids"].split(",") if pk.strip()])
+        return queryset
+
+    def hydrate(self, queryset, fields=None):
+        """Returns the passed-in queryset, fetching only the data required to serialise the passed-in fields
+        (default: all fields) in a fixed number of queries.
+        """
+        api_fields = [self.api_fields[name] for name in fields or self.api_fields]
+
+        select = sorted({lookup for field in api_fields for lookup in field.select})
+        if select:
+            queryset = queryset.select_related(*select)
+        prefetch = []
+        for field in api_fields:
+            for lookup in field.prefetch() if field.prefetch else []:
+                if lookup not in prefetch:
+                    prefetch.append(lookup)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if fields:
+            # Keyset pagination fields are always required.
+            only = {name for field in api_fields for name in field.only}
+            only.update([name for name in get_keyset_fields(self.model) if name != "pk"])
+            queryset = queryset.only(*sorted(only))
+
+        return queryset
+
+    def serialise(self, obj, fields=None):
+        return {name: self.api_fields[name].value(obj) for name in fields or self.api_fields}
+
+
+class ReferralAPIResource(SerialisedAPIResource):
     """An API view that returns JSON of current, active referrals.
     This API resource is more elaborate than those above, including pagination and filtering.
     """
 
-    http_method_names = ["get", "options", "head", "trace"]
+    model = Referral
+    api_fields = {
+        "id": ApiField(lambda obj: obj.pk),
+        "type": ApiField(lambda obj: obj.type.name, only=("type", "type__name"), select=("type",)),
+        "regions": ApiField(
+            lambda obj: ", ".join([i.name for i in obj.current_regions]),
+            prefetch=lambda: [current_regions_prefetch()],
+        ),
+        "referring_org": ApiField(
+            lambda obj: obj.referring_org.name,
+            only=("referring_org", "referring_org__name"),
+            select=("referring_org",),
+        ),
+        "reference": ApiField(lambda obj: obj.reference, only=("reference",)),
+        "file_no": ApiField(lambda obj: obj.file_no, only=("file_no",)),
+        "description": ApiField(lambda obj: obj.description, only=("description",)),
+        "referral_date": ApiField(lambda obj: date_str(obj.referral_date), only=("referral_date",)),
+        "address": ApiField(lambda obj: obj.address, only=("address",)),
+        "point": ApiField(lambda obj: obj.point.wkt if obj.point else None, only=("point",)),
+        "dop_triggers": ApiField(
+            lambda obj: [i.name for i in obj.current_dop_triggers],
+            prefetch=lambda: [Prefetch("dop_triggers", queryset=DopTrigger.objects.current(), to_attr="current_dop_triggers")],
+        ),
+        "tags": ApiField(lambda obj: [i.name for i in obj.tags.all()], prefetch=lambda: ["tags"]),
+        "related_refs": ApiField(
+            lambda obj: [i.pk for i in obj.current_related_refs],
+            prefetch=lambda: [Prefetch("related_refs", queryset=Referral.objects.current().only("pk"), to_attr="current_related_refs")],
+        ),
+        "lga": ApiField(lambda obj: obj.lga.name if obj.lga else None, only=("lga", "lga__name"), select=("lga",)),
+    }
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(Referral, ReferralType, Region, Organisation, DopTrigger, LocalGovernment, Tag, RelatedReferral))
     def get(self, request, *args, **kwargs):
-        queryset = Referral.objects.current().prefetch_related("type", "regions", "referring_org", "dop_triggers", "tags", "lga")
+        try:
+            fields = self.get_fields(self.request)
+            queryset = self.filter_ids(self.request, self.hydrate(Referral.objects.current(), fields))
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
 
         # Queryset filtering.
         if "pk" in kwargs and kwargs["pk"]:  # Allow filtering by object PK.
@@ -291,60 +577,60 @@ class ReferralAPIResource(View):
         if "tag__id" in self.request.GET and self.request.GET["tag__id"]:
             queryset = queryset.filter(tags__pk__in=[self.request.GET["tag__id"]])
 
-        obj_count = queryset.count()  # Count the filtered results.
-
         # Paginate the queryset.
-        offset = 0
-        if "offset" in self.request.GET and self.request.GET["offset"]:
-            offset = int(self.request.GET["offset"])
-            # Ignore any offset which is greater than the result count.
-            if offset >= obj_count:
-                offset = 0
-
-        # Django's queryset slicing is smart enough that we don't need to worry about "wrapping around".
-        if "limit" in self.request.GET and self.request.GET["limit"]:
-            limit = offset + int(self.request.GET["limit"])
-        else:
-            limit = offset + 50  # Default to a maximum of 50 objects in the response.
-
-        queryset = queryset[offset:limit]
-        resp = {
-            "count": obj_count,
-            "objects": [
-                {
-                    "id": obj.pk,
-                    "type": obj.type.name,
-                    "regions": ", ".join([i.name for i in obj.regions.current()]),
-                    "referring_org": obj.referring_org.name,
-                    "reference": obj.reference,
-                    "file_no": obj.file_no,
-                    "description": obj.description,
-                    "referral_date": obj.referral_date.strftime("%Y-%m-%d"),
-                    "address": obj.address,
-                    "point": obj.point.wkt if obj.point else None,
-                    "dop_triggers": [i.name for i in obj.dop_triggers.current()],
-                    "tags": [i.name for i in obj.tags.all()],
-                    "related_refs": [i.pk for i in obj.related_refs.current()],
-                    "lga": obj.lga.name if obj.lga else None,
-                }
-                for obj in queryset
-            ],
-        }
+        try:
+            obj_count, queryset, next_cursor = paginate_api_queryset(self.request, queryset, get_keyset_fields(Referral))
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
 
-        return JsonResponse(resp)
+        return api_list_response(self.request, obj_count, queryset, next_cursor, partial(self.serialise, fields=fields))
 
 
-class TaskAPIResource(View):
+class TaskAPIResource(SerialisedAPIResource):
     """An API view that returns JSON of current, active tasks.
     This API resource is more elaborate than those above, including pagination and filtering.
     """
 
-    http_method_names = ["get", "options", "head", "trace"]
+    model = Task
+    api_fields = {
+        "id": ApiField(lambda obj: obj.pk),
+        "referral_id": ApiField(lambda obj: obj.referral_id, only=("referral",)),
+        "referral_reference": ApiField(
+            lambda obj: obj.referral.reference,
+            only=("referral", "referral__reference"),
+            select=("referral",),
+        ),
+        "regions": ApiField(
+            lambda obj: ", ".join([i.name for i in obj.referral.current_regions]),
+            only=("referral", "referral__id"),
+            select=("referral",),
+            prefetch=lambda: [current_regions_prefetch("referral__regions")],
+        ),
+        "assigned_user": ApiField(
+            lambda obj: obj.assigned_user.get_full_name(),
+            only=("assigned_user", "assigned_user__first_name", "assigned_user__last_name"),
+            select=("assigned_user",),
+        ),
+        "type": ApiField(lambda obj: obj.type.name, only=("type", "type__name"), select=("type",)),
+        "description": ApiField(lambda obj: obj.description, only=("description",)),
+        "state": ApiField(lambda obj: obj.state.name, only=("state", "state__name"), select=("state",)),
+        "start_date": ApiField(lambda obj: date_str(obj.start_date), only=("start_date",)),
+        "due_date": ApiField(lambda obj: date_str(obj.due_date), only=("due_date",)),
+        "complete_date": ApiField(lambda obj: date_str(obj.complete_date), only=("complete_date",)),
+        "stop_date": ApiField(lambda obj: date_str(obj.stop_date), only=("stop_date",)),
+        "restart_date": ApiField(lambda obj: date_str(obj.restart_date), only=("restart_date",)),
+        "stop_time": ApiField(lambda obj: obj.stop_time, only=("stop_time",)),
+    }
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(Task, Referral, Region, TaskType, TaskState, User))
     def get(self, request, *args, **kwargs):
-        queryset = Task.objects.current().prefetch_related("type", "referral", "assigned_user", "state")
+        try:
+            fields = self.get_fields(self.request)
+            queryset = self.filter_ids(self.request, self.hydrate(Task.objects.current(), fields))
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
 
         # Queryset filtering.
         if "pk" in kwargs and kwargs["pk"]:  # Allow filtering by object PK.
@@ -362,60 +648,73 @@ class TaskAPIResource(View):
         if "start_date__lte" in self.request.GET and self.request.GET["start_date__lte"]:
             queryset = queryset.filter(start_date__lte=self.request.GET["start_date__lte"])
 
-        obj_count = queryset.count()  # Count the filtered results.
-
         # Paginate the queryset.
-        offset = 0
-        if "offset" in self.request.GET and self.request.GET["offset"]:
-            offset = int(self.request.GET["offset"])
-            # Ignore any offset which is greater than the result count.
-            if offset >= obj_count:
-                offset = 0
-
-        # Django's queryset slicing is smart enough that we don't need to worry about "wrapping around".
-        if "limit" in self.request.GET and self.request.GET["limit"]:
-            limit = offset + int(self.request.GET["limit"])
-        else:
-            limit = offset + 50  # Default to a maximum of 50 objects in the response.
+        try:
+            obj_count, queryset, next_cursor = paginate_api_queryset(self.request, queryset, get_keyset_fields(Task))
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
 
-        queryset = queryset[offset:limit]
-        resp = {
-            "count": obj_count,
-            "objects": [
-                {
-                    "id": obj.pk,
-                    "referral_id": obj.referral.pk,
-                    "referral_reference": obj.referral.reference,
-                    "regions": ", ".join([i.name for i in obj.referral.regions.current()]),
-                    "assigned_user": obj.assigned_user.get_full_name(),
-                    "type": obj.type.name,
-                    "description": obj.description,
-                    "state": obj.state.name,
-                    "start_date": obj.start_date.strftime("%Y-%m-%d") if obj.start_date else None,
-                    "due_date": obj.due_date.strftime("%Y-%m-%d") if obj.due_date else None,
-                    "complete_date": obj.complete_date.strftime("%Y-%m-%d") if obj.complete_date else None,
-                    "stop_date": obj.stop_date.strftime("%Y-%m-%d") if obj.stop_date else None,
-                    "restart_date": obj.restart_date.strftime("%Y-%m-%d") if obj.restart_date else None,
-                    "stop_time": obj.stop_time,
-                }
-                for obj in queryset
-            ],
-        }
+        return api_list_response(self.request, obj_count, queryset, next_cursor, partial(self.serialise, fields=fields))
 
-        return JsonResponse(resp)
 
-
-class ClearanceAPIResource(View):
+class ClearanceAPIResource(SerialisedAPIResource):
     """An API view that returns JSON of current, active clearance requests.
     This API resource is more elaborate than those above, including pagination and filtering.
     """
 
-    http_method_names = ["get", "options", "head", "trace"]
+    model = Clearance
+    api_fields = {
+        "id": ApiField(lambda obj: obj.pk),
+        "referral_id": ApiField(lambda obj: obj.task.referral_id, only=("task", "task__referral"), select=("task",)),
+        "task_id": ApiField(lambda obj: obj.task_id, only=("task",)),
+        "condition_id": ApiField(lambda obj: obj.condition_id, only=("condition",)),
+        "condition": ApiField(
+            lambda obj: obj.condition.condition,
+            only=("condition", "condition__condition"),
+            select=("condition",),
+        ),
+        "identifier": ApiField(
+            lambda obj: obj.condition.identifier,
+            only=("condition", "condition__identifier"),
+            select=("condition",),
+        ),
+        "category": ApiField(
+            lambda obj: getattr(obj.condition.get_category_tag(), "name", None),
+            only=("condition", "condition__id"),
+            select=("condition",),
+            prefetch=lambda: ["condition__tags"],
+        ),
+        "regions": ApiField(
+            lambda obj: ", ".join([i.name for i in obj.task.referral.current_regions]),
+            only=("task", "task__referral", "task__referral__id"),
+            select=("task__referral",),
+            prefetch=lambda: [current_regions_prefetch("task__referral__regions")],
+        ),
+        "assigned_user": ApiField(
+            lambda obj: obj.task.assigned_user.get_full_name(),
+            only=("task", "task__assigned_user", "task__assigned_user__first_name", "task__assigned_user__last_name"),
+            select=("task__assigned_user",),
+        ),
+        "description": ApiField(lambda obj: obj.task.description, only=("task", "task__description"), select=("task",)),
+        "state": ApiField(lambda obj: obj.task.state.name, only=("task", "task__state", "task__state__name"), select=("task__state",)),
+        "start_date": ApiField(lambda obj: date_str(obj.task.start_date), only=("task", "task__start_date"), select=("task",)),
+        "due_date": ApiField(lambda obj: date_str(obj.task.due_date), only=("task", "task__due_date"), select=("task",)),
+        "complete_date": ApiField(lambda obj: date_str(obj.task.complete_date), only=("task", "task__complete_date"), select=("task",)),
+        "stop_date": ApiField(lambda obj: date_str(obj.task.stop_date), only=("task", "task__stop_date"), select=("task",)),
+        "restart_date": ApiField(lambda obj: date_str(obj.task.restart_date), only=("task", "task__restart_date"), select=("task",)),
+        "stop_time": ApiField(lambda obj: obj.task.stop_time, only=("task", "task__stop_time"), select=("task",)),
+        "deposited_plan": ApiField(lambda obj: obj.deposited_plan, only=("deposited_plan",)),
+    }
 
     @method_decorator(cache_control(max_age=settings.API_RESPONSE_CACHE_SECONDS, private=True))
     @method_decorator(vary_on_cookie)
+    @method_decorator(api_response_cache(Clearance, Task, Referral, Condition, Region, TaskState, User, Tag))
     def get(self, request, *args, **kwargs):
-        queryset = Clearance.objects.current().prefetch_related("task", "condition")
+        try:
+            fields = self.get_fields(self.request)
+            queryset = self.filter_ids(self.request, self.hydrate(Clearance.objects.current(), fields))
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
 
         # Queryset filtering.
         if "pk" in kwargs and kwargs["pk"]:  # Allow filtering by object PK.
@@ -431,48 +730,59 @@ class ClearanceAPIResource(View):
         if "start_date__lte" in self.request.GET and self.request.GET["start_date__lte"]:
             queryset = queryset.filter(task__start_date__lte=self.request.GET["start_date__lte"])
 
-        obj_count = queryset.count()  # Count the filtered results.
-
         # Paginate the queryset.
-        offset = 0
-        if "offset" in self.request.GET and self.request.GET["offset"]:
-            offset = int(self.request.GET["offset"])
-            # Ignore any offset which is greater than the result count.
-            if offset >= obj_count:
-                offset = 0
-
-        # Django's queryset slicing is smart enough that we don't need to worry about "wrapping around".
-        if "limit" in self.request.GET and self.request.GET["limit"]:
-            limit = offset + int(self.request.GET["limit"])
-        else:
-            limit = offset + 50  # Default to a maximum of 50 objects in the response.
+        try:
+            obj_count, queryset, next_cursor = paginate_api_queryset(self.request, queryset, get_keyset_fields(Clearance))
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
+
+        return api_list_response(self.request, obj_count, queryset, next_cursor, partial(self.serialise, fields=fields))
+
+
+class ChangesAPIResource(View):
+    """An API view that returns JSON of the objects of a resource changed since a cursor, for incremental
+    synchronisation by downstream systems. Objects are ordered by (modified, pk), and deleted objects are
+    returned as tombstones. Pass an empty cursor to start from the beginning, then the returned next_cursor
+    in each following request.
+    """
+
+    http_method_names = ["get", "options", "head", "trace"]
+    # The API resource class for the model, providing its hydrate() and serialise() methods.
+    resource = None
+    fields = ("modified", "pk")
+
+    def get(self, request, *args, **kwargs):
+        resource = self.resource()
+        model = resource.model
+        cursor = request.GET.get("cursor", "")
+        # Exclude very recent changes, which may yet be followed by a concurrent transaction committing a change
+        # with an earlier modified timestamp (which a client would then skip).
+        settled = timezone.now() - timedelta(seconds=settings.API_CHANGES_SETTLE_SECONDS)
+        queryset = resource.hydrate(model.objects.filter(modified__lt=settled))
+
+        try:
+            objects, more_cursor = keyset_paginate(queryset, self.fields, cursor, get_api_limit(request), descending=False)
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
 
-        queryset = queryset[offset:limit]
         resp = {
-            "count": obj_count,
-            "objects": [
-                {
-                    "id": obj.pk,
-                    "referral_id": obj.task.referral.pk,
-                    "task_id": obj.task.pk,
-                    "condition_id": obj.condition.pk,
-                    "condition": obj.condition.condition,
-                    "identifier": obj.condition.identifier,
-                    "category": obj.condition.tags.first().name if obj.condition.tags.exists() else None,
-                    "regions": ", ".join([i.name for i in obj.task.referral.regions.current()]),
-                    "assigned_user": obj.task.assigned_user.get_full_name(),
-                    "description": obj.task.description,
-                    "state": obj.task.state.name,
-                    "start_date": obj.task.start_date.strftime("%Y-%m-%d") if obj.task.start_date else None,
-                    "due_date": obj.task.due_date.strftime("%Y-%m-%d") if obj.task.due_date else None,
-                    "complete_date": obj.task.complete_date.strftime("%Y-%m-%d") if obj.task.complete_date else None,
-                    "stop_date": obj.task.stop_date.strftime("%Y-%m-%d") if obj.task.stop_date else None,
-                    "restart_date": obj.task.restart_date.strftime("%Y-%m-%d") if obj.task.restart_date else None,
-                    "stop_time": obj.task.stop_time,
-                    "deposited_plan": obj.deposited_plan,
-                }
-                for obj in queryset
-            ],
+            "objects": [self.serialise(resource, obj) for obj in objects],
+            # Always return a cursor, so that clients can poll for subsequent changes.
+            "next_cursor": encode_cursor(objects[-1], self.fields) if objects else cursor,
+            "more": more_cursor is not None,
+        }
+        return FastJsonResponse(resp)
+
+    def serialise(self, resource, obj):
+        if obj.is_deleted():
+            return {
+                "id": obj.pk,
+                "deleted": True,
+                "modified": obj.modified,
+                "effective_to": obj.effective_to,
+            }
+        return {
+            **resource.serialise(obj),
+            "deleted": False,
+            "modified": obj.modified,
         }
-
-        return JsonResponse(resp)
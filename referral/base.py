@@ -1,12 +1,19 @@
+from copy import copy
+
 import magic
 from crum import get_current_user
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models import GeometryField
 from django.core.exceptions import ValidationError
 from django.db.models import FileField
 from django.urls import reverse
 from django.utils import timezone
+from referral.utils import bump_cache_version, get_cache_version, shared_cache_enabled
+
+# Process-local cache of lookup table objects, keyed by model label.
+LOOKUP_CACHE = {}
 
 
 class ActiveModelManager(models.Manager):
@@ -19,6 +26,55 @@ class ActiveModelManager(models.Manager):
         return self.filter(effective_to__isnull=False)
 
 
+class ReferralLookupManager(ActiveModelManager):
+    """Manager for lookup tables, adding a process-local cache of each (small, near-static) table."""
+
+    def get_cache_version_key(self):
+        return f"prs:lookup_version:{self.model._meta.label_lower}"
+
+    def invalidate_cache(self):
+        """Invalidate the cached lookup table in every process, by bumping its version in the shared cache."""
+        bump_cache_version(self.get_cache_version_key())
+        LOOKUP_CACHE.pop(self.model._meta.label_lower, None)
+
+    def get_cached(self, **kwargs):
+        """Returns a single object matching the passed-in exact field values (e.g. pk, name or slug), like get().
+        Objects are read from a process-local copy of the whole table, loaded lazily and reloaded whenever the
+        table's version in the shared cache changes. Current objects take precedence over deleted ones.
+        """
+        if not shared_cache_enabled():  # Without a shared cache, we can't invalidate other processes.
+            return self.get(**kwargs)
+
+        version = get_cache_version(self.get_cache_version_key())
+        label = self.model._meta.label_lower
+        table = LOOKUP_CACHE.get(label)
+        if not table or table["version"] != version:
+            # Don't hold geometry fields in memory.
+            geometry_fields = [f.name for f in self.model._meta.fields if isinstance(f, GeometryField)]
+            # Order deleted objects first, so that current objects overwrite them in the indexes below.
+            objects = list(self.defer(*geometry_fields).order_by(models.F("effective_to").desc(nulls_last=True), "pk"))
+            table = {
+                "version": version,
+                "objects": objects,
+                "pk": {obj.pk: obj for obj in objects},
+                "name": {obj.name: obj for obj in objects},
+                "slug": {obj.slug: obj for obj in objects},
+            }
+            LOOKUP_CACHE[label] = table
+
+        if len(kwargs) == 1 and list(kwargs)[0] in ("pk", "id", "name", "slug"):
+            field, value = list(kwargs.items())[0]
+            obj = table["pk" if field == "id" else field].get(value)
+        else:
+            matches = [obj for obj in table["objects"] if all(getattr(obj, k) == v for k, v in kwargs.items())]
+            obj = matches[-1] if matches else None
+
+        if obj is None:
+            raise self.model.DoesNotExist(f"{self.model._meta.object_name} matching query does not exist.")
+        # Return a copy, so that callers can't modify the cached object.
+        return copy(obj)
+
+
 class Audit(models.Model):
     class Meta:
         abstract = True
@@ -1,12 +1,15 @@
 from datetime import datetime
+from hashlib import md5
 
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import HTML, Div, Layout, Submit
 from django import forms
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db.models import Q
+from django.forms.models import ModelChoiceIterator
 from django.urls import reverse
 from referral.models import (
     Bookmark,
@@ -25,16 +28,80 @@ from referral.models import (
     TaskState,
     TaskType,
 )
+from referral.utils import get_cache_version, get_model_version_key, shared_cache_enabled
 from taggit.models import Tag
 
 
+class CachedModelChoiceIterator(ModelChoiceIterator):
+    """ModelChoiceIterator that reads the (value, label) choices from the shared cache, instead of querying
+    the database on every form render. Choices are keyed on the field queryset and invalidated by the
+    version stamp of the queryset model.
+    """
+
+    def get_choices(self):
+        if hasattr(self, "_choices"):
+            return self._choices
+
+        if shared_cache_enabled():
+            digest = md5(f"{self.field.__class__.__name__}:{self.queryset.query}".encode()).hexdigest()
+            key = f"prs:choices:{digest}:{get_cache_version(get_model_version_key(self.queryset.model))}"
+            choices = cache.get(key)
+            if choices is None:
+                choices = [(self.field.prepare_value(obj), self.field.label_from_instance(obj)) for obj in self.queryset]
+                cache.set(key, choices, settings.CHOICES_CACHE_SECONDS)
+        else:
+            choices = [(self.field.prepare_value(obj), self.field.label_from_instance(obj)) for obj in self.queryset]
+
+        self._choices = choices
+        return choices
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        yield from self.get_choices()
+
+    def __len__(self):
+        return len(self.get_choices()) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.get_choices())
+
+
+class SelectListSelect(forms.Select):
+    """Select widget for large option sets: if there are more than SELECTLIST_INLINE_MAX options, only the
+    selected option is rendered and the select list is populated client-side from an API selectlist endpoint.
+    """
+
+    def __init__(self, url_name, query="", *args, **kwargs):
+        self.url_name = url_name
+        self.query = query
+        super().__init__(*args, **kwargs)
+
+    def get_context(self, name, value, attrs):
+        if len(self.choices) <= settings.SELECTLIST_INLINE_MAX:
+            return super().get_context(name, value, attrs)
+
+        url = reverse(self.url_name)
+        attrs = {**(attrs or {}), "data-selectlist-url": f"{url}?{self.query}" if self.query else url}
+        selected = {str(v) for v in self.format_value(value)}
+        choices = self.choices
+        self.choices = [choice for choice in choices if choice[0] == "" or str(choice[0]) in selected]
+        try:
+            return super().get_context(name, value, attrs)
+        finally:
+            self.choices = choices
+
+
 class OrganisationChoiceField(forms.ModelChoiceField):
     """
     ModelChoiceField that renders using each Organisation's list_name.
     """
 
+    iterator = CachedModelChoiceIterator
+
     def __init__(self, *args, **kwargs):
         kwargs["queryset"] = Organisation.objects.current().filter(public=True).order_by("list_name")
+        kwargs["widget"] = SelectListSelect("api:organisation_api_resource", "public")
         kwargs["help_text"] = "The referring organisation or individual."
         kwargs["label"] = "Referrer"
         kwargs["required"] = True
@@ -62,6 +129,8 @@ class RecordChoiceField(forms.ModelMultipleChoiceField):
 
 
 class RegionMultipleChoiceField(forms.ModelMultipleChoiceField):
+    iterator = CachedModelChoiceIterator
+
     def __init__(self, *args, **kwargs):
         kwargs["queryset"] = Region.objects.current()
         kwargs["label"] = "Region(s)"
@@ -70,6 +139,8 @@ class RegionMultipleChoiceField(forms.ModelMultipleChoiceField):
 
 
 class DopTriggerMultipleChoiceField(forms.ModelMultipleChoiceField):
+    iterator = CachedModelChoiceIterator
+
     def __init__(self, *args, **kwargs):
         qs = DopTrigger.objects.current().order_by("name")
         kwargs["queryset"] = qs
@@ -79,6 +150,8 @@ class DopTriggerMultipleChoiceField(forms.ModelMultipleChoiceField):
 
 
 class TaskTypeChoiceField(forms.ModelChoiceField):
+    iterator = CachedModelChoiceIterator
+
     def __init__(self, *args, **kwargs):
         kwargs["label"] = "Task type"
         kwargs["queryset"] = TaskType.objects.current().filter(public=True)
@@ -88,8 +161,11 @@ class TaskTypeChoiceField(forms.ModelChoiceField):
 class PRSUserChoiceField(forms.ModelChoiceField):
     """Returns a ModelChoiceField of all current users in the PRS user group."""
 
+    iterator = CachedModelChoiceIterator
+
     def __init__(self, *args, **kwargs):
-        kwargs["queryset"] = User.objects.filter(groups__name__in=["PRS user"], is_active=True).order_by("email")
+        kwargs["queryset"] = User.objects.filter(groups__name__in=[settings.PRS_USER_GROUP], is_active=True).order_by("email")
+        kwargs["widget"] = SelectListSelect("api:user_api_resource")
         super().__init__(*args, **kwargs)
 
     def label_from_instance(self, obj):
@@ -497,6 +573,8 @@ class RecordAddExistingForm(BaseForm):
 
 
 class TagMultipleChoiceField(forms.ModelMultipleChoiceField):
+    iterator = CachedModelChoiceIterator
+
     def __init__(self, *args, **kwargs):
         kwargs["queryset"] = Tag.objects.all().order_by("name")
         super().__init__(*args, **kwargs)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from referral.models import Record
+
+
+class Command(BaseCommand):
+    help = "Captures the uploaded file metadata (size, hash, MIME type, page count, message date) of records not having any"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            dest="all",
+            help="Recapture the metadata of all records, rather than only those not having any",
+        )
+
+    def handle(self, *args, **options):
+        records = Record.objects.exclude(uploaded_file="").filter(uploaded_file__isnull=False).order_by("pk")
+        if not options["all"]:
+            records = records.filter(file_size__isnull=True)
+
+        count = 0
+        for record in records.only("pk", "uploaded_file").iterator(chunk_size=500):
+            record.set_file_metadata()
+            if record.file_size is None:  # The file couldn't be read.
+                continue
+            # Use update() rather than save(), to skip re-indexing the record.
+            Record.objects.filter(pk=record.pk).update(
+                file_size=record.file_size,
+                file_hash=record.file_hash,
+                mime_type=record.mime_type,
+                page_count=record.page_count,
+                message_date=record.message_date,
+            )
+            count += 1
+        self.stdout.write(f"Captured file metadata for {count} record(s)")
@@ -0,0 +1,51 @@
+import json
+from timeit import timeit
+
+from django.core.management.base import BaseCommand
+from referral.api_v3 import ReferralAPIResource
+from referral.models import Location, Referral
+from referral.utils import json_dumps, polygon_feature
+
+
+class Command(BaseCommand):
+    help = "Compares the time taken to encode API and GeoJSON payloads using the orjson and stdlib JSON encoders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            action="store",
+            default=1000,
+            type=int,
+            dest="count",
+            help="Number of referrals/locations in each payload",
+        )
+        parser.add_argument(
+            "--repeat",
+            action="store",
+            default=10,
+            type=int,
+            dest="repeat",
+            help="Number of times to encode each payload",
+        )
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        repeat = options["repeat"]
+
+        resource = ReferralAPIResource()
+        referrals = resource.hydrate(Referral.objects.current())[:count]
+        locations = Location.objects.current().filter(poly__isnull=False)[:count]
+        payloads = {
+            "API": {"count": len(referrals), "objects": [resource.serialise(obj) for obj in referrals]},
+            "GeoJSON": {
+                "type": "FeatureCollection",
+                "features": [polygon_feature(loc.poly, {"referral": loc.referral_id}) for loc in locations],
+            },
+        }
+
+        for name, payload in payloads.items():
+            if json.loads(json_dumps(payload, "orjson")) != json.loads(json_dumps(payload, "stdlib")):
+                self.stdout.write(f"{name}: encoder outputs differ")
+            stdlib = timeit(lambda: json_dumps(payload, "stdlib"), number=repeat) / repeat
+            fast = timeit(lambda: json_dumps(payload, "orjson"), number=repeat) / repeat
+            self.stdout.write(f"{name}: stdlib {stdlib * 1000:.1f} ms, orjson {fast * 1000:.1f} ms ({stdlib / fast:.1f}x faster)")
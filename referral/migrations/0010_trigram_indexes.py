@@ -0,0 +1,39 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0009_record_uploaded_file_content'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='referral',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('reference'), name='gin_trgm_ops'), name='idx_referral_reference_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='referral',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('file_no'), name='gin_trgm_ops'), name='idx_referral_file_no_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='referral',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('address'), name='gin_trgm_ops'), name='idx_referral_address_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='referral',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('description'), name='gin_trgm_ops'), name='idx_referral_description_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(django.db.models.functions.text.Upper('reference'), name='idx_referral_reference_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('address_string'), name='gin_trgm_ops'), name='idx_location_address_trgm'),
+        ),
+    ]
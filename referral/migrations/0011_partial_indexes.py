@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0010_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['assigned_user', 'state'], name='idx_task_user_state_current'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['referral'], name='idx_task_referral_current'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['referral', 'order_date'], name='idx_record_referral_current'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['referral', 'order_date'], name='idx_note_referral_current'),
+        ),
+        migrations.AddIndex(
+            model_name='condition',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['referral'], name='idx_condition_referral_current'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['referral'], name='idx_location_referral_current'),
+        ),
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(condition=models.Q(('effective_to__isnull', True)), fields=['referral', 'user'], name='idx_bookmark_ref_user_current'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0012_modified_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='file_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 hash of the file.', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='mime_type',
+            field=models.CharField(blank=True, editable=False, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='message_date',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Sent date of a MSG file.', null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import logging
 import os
+import time
 from copy import copy
 from datetime import date
 from tempfile import TemporaryDirectory
@@ -9,29 +10,37 @@ from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import GeometryCollection
 from django.contrib.postgres.fields import ArrayField
-from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache as django_cache
 from django.core.mail import EmailMultiAlternatives
 from django.core.validators import MaxLengthValidator
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Index, Q
+from django.db.models.functions import Upper
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.html import SafeString, escape, format_html
 from django.utils.safestring import mark_safe
-from extract_msg import Message
-from fudgeo import Field, GeoPackage
-from fudgeo.constant import SHAPE, WGS84
-from fudgeo.enumeration import GeometryType, SQLFieldType
-from fudgeo.geometry import Polygon
-from geojson import Feature, FeatureCollection
-from geojson import Polygon as PolygonGeoJSON
-from geojson import dumps
 from indexer.utils import get_typesense_client
 from lxml.html import fromstring
 from lxml_html_clean import clean_html
-from referral.base import ActiveModel, Audit
-from referral.tasks import index_object, index_record
-from referral.utils import as_row_subtract_referral_cell, dewordify_text, get_srs_wgs84, search_document_normalise, smart_truncate
+from referral.base import ActiveModel, Audit, ReferralLookupManager
+from referral.tasks import flush_referral_history, index_object, index_record
+from referral.utils import (
+    LOCATION_EXPORT_FIELDS,
+    as_row_subtract_referral_cell,
+    bump_user_context_version,
+    dewordify_text,
+    get_file_metadata,
+    get_location_export_rows,
+    json_dumps,
+    polygon_feature,
+    search_document_normalise,
+    shared_cache_enabled,
+    smart_truncate,
+    write_locations_gpkg,
+)
 from taggit.managers import TaggableManager
 from typesense.exceptions import ObjectNotFound
 from unidecode import unidecode
@@ -58,6 +67,8 @@ class ReferralLookup(ActiveModel, Audit):
     slug = models.SlugField(unique=True, help_text="Must be unique. Automatically generated from name.")
     public = models.BooleanField(default=True, help_text="Is this lookup selection available to all users?")
 
+    objects = ReferralLookupManager()
+
     class Meta:
         abstract = True
         ordering = ["name"]
@@ -435,10 +446,23 @@ class Referral(ReferralBaseModel):
     )
     search_document = models.TextField(blank=True, null=True, editable=False)
     search_vector = SearchVectorField(null=True, editable=False)
+    # Child objects whose changes are included in the last modified timestamp of the referral detail page.
+    last_modified_relations = ("task", "note", "record", "condition", "location", "bookmark")
 
     class Meta:
         ordering = ["-created"]
-        indexes = [GinIndex(fields=["search_vector"], name="idx_referral_search_vector")]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="idx_referral_search_vector"),
+            # Case-folded trigram indexes, used by icontains lookups (UPPER(col) LIKE UPPER('%term%')).
+            GinIndex(OpClass(Upper("reference"), name="gin_trgm_ops"), name="idx_referral_reference_trgm"),
+            GinIndex(OpClass(Upper("file_no"), name="gin_trgm_ops"), name="idx_referral_file_no_trgm"),
+            GinIndex(OpClass(Upper("address"), name="gin_trgm_ops"), name="idx_referral_address_trgm"),
+            GinIndex(OpClass(Upper("description"), name="gin_trgm_ops"), name="idx_referral_description_trgm"),
+            # Case-folded B-tree index, used by iexact lookups (UPPER(col) = UPPER('term')).
+            Index(Upper("reference"), name="idx_referral_reference_upper"),
+            # Change feed ordering.
+            Index(fields=["modified", "id"], name="idx_referral_modified"),
+        ]
 
     @classmethod
     def get_headers(cls):
@@ -625,72 +649,22 @@ class Referral(ReferralBaseModel):
 
     def generate_gpkg(self, source_url: str = "") -> bytes | None:
         """Generates and returns a Geopackage object as a byte stream."""
-        if not self.location_set.current().filter(poly__isnull=False).exists():
+        rows = list(get_location_export_rows(self.location_set.current(), source_url))
+        if not rows:
             return None
-        tmpdir = TemporaryDirectory()
-        # Create a new GeoPackage.
-        gpkg_path = os.path.join(tmpdir.name, f"referral_{self.pk}.gpkg")
-        gpkg = GeoPackage.create(gpkg_path, flavor="EPSG")
-
-        # Create a feature class (layer) for referral locations.
-        gpkg.create_feature_class(
-            name="prs_locations",
-            srs=get_srs_wgs84(),
-            shape_type=GeometryType.polygon,
-            fields=[
-                Field("referral_id", SQLFieldType.integer),
-                Field("referral_type", SQLFieldType.text),
-                Field("referral_reference", SQLFieldType.text),
-                Field("referring_org", SQLFieldType.text),
-                Field("source_url", SQLFieldType.text),
-            ],
-            geom_name=SHAPE,
-            spatial_index=True,
-            overwrite=True,
-        )
-        sql = """INSERT INTO prs_locations (SHAPE, referral_id, referral_type, referral_reference, referring_org, source_url)
-        VALUES (?, ?, ?, ?, ?, ?)"""
-        rows = []
-        for loc in self.location_set.current().filter(poly__isnull=False):
-            poly = Polygon(coordinates=loc.poly.coords, srs_id=WGS84)
-            rows.append(
-                (
-                    poly,
-                    loc.referral_id,
-                    loc.referral.type.name,
-                    loc.referral.reference,
-                    loc.referral.referring_org.name,
-                    source_url,
-                )
-            )
-
-        conn = gpkg.connection
-        conn.executemany(sql, rows)
-        conn.commit()
-        conn.close()
-
-        resp = open(gpkg_path, "rb").read()
-        return resp  # Return the gpkg content.
+        with TemporaryDirectory() as tmpdir:
+            gpkg_path = os.path.join(tmpdir, f"referral_{self.pk}.gpkg")
+            write_locations_gpkg(gpkg_path, rows)
+            with open(gpkg_path, "rb") as f:
+                return f.read()  # Return the gpkg content.
 
     def generate_geojson(self, source_url: str = "") -> str | None:
         """Generates and returns GeoJSON as a string."""
-        if not self.location_set.current().filter(poly__isnull=False).exists():
+        rows = list(get_location_export_rows(self.location_set.current(), source_url))
+        if not rows:
             return None
-        features = []
-        for loc in self.location_set.current().filter(poly__isnull=False):
-            features.append(
-                Feature(
-                    geometry=PolygonGeoJSON(loc.poly.coords),
-                    properties={
-                        "referral": loc.referral.pk,
-                        "referral_type": loc.referral.type.name,
-                        "referral_reference": loc.referral.reference,
-                        "referring_org": loc.referral.referring_org.name,
-                        "source_url": source_url,
-                    },
-                )
-            )
-        return dumps(FeatureCollection(features))
+        features = [polygon_feature(poly, dict(zip(LOCATION_EXPORT_FIELDS, values))) for poly, *values in rows]
+        return json_dumps({"type": "FeatureCollection", "features": features}).decode()
 
 
 class RelatedReferral(models.Model):
@@ -749,10 +723,19 @@ class Task(ReferralBaseModel):
     notes = models.ManyToManyField("Note", blank=True)
     search_document = models.TextField(blank=True, null=True, editable=False)
     search_vector = SearchVectorField(null=True, editable=False)
+    # Child objects whose changes are included in the last modified timestamp of the task detail page.
+    last_modified_relations = ("records", "notes")
 
     class Meta:
         ordering = ["-pk", "due_date"]
-        indexes = [GinIndex(fields=["search_vector"], name="idx_task_search_vector")]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="idx_task_search_vector"),
+            # Partial indexes for current tasks, by assigned user (site home) and by referral (referral detail).
+            Index(fields=["assigned_user", "state"], condition=Q(effective_to__isnull=True), name="idx_task_user_state_current"),
+            Index(fields=["referral"], condition=Q(effective_to__isnull=True), name="idx_task_referral_current"),
+            # Change feed ordering.
+            Index(fields=["modified", "id"], name="idx_task_modified"),
+        ]
 
     @classmethod
     def get_headers(cls):
@@ -900,6 +883,8 @@ class Task(ReferralBaseModel):
     def as_row_for_site_home(self):
         """Similar to as_row_with_actions(), but this returns a different set
         of values as a row for the site home view.
+        NOTE: querysets should use select_related("type", "state", "referral__referring_org")
+        to avoid queries for each row.
         """
         template = "<td>{type}</td>"
         if self.referral.address:  # If the referral has an address, include it in the description field.
@@ -929,7 +914,7 @@ class Task(ReferralBaseModel):
         else:
             d["description"] = ""
         d["referral_url"] = self.referral.get_absolute_url()
-        d["referral_pk"] = self.referral.pk
+        d["referral_pk"] = self.referral_id
         d["referring_org"] = self.referral.referring_org
         d["reference"] = self.referral.reference
         if self.referral.address:
@@ -942,11 +927,8 @@ class Task(ReferralBaseModel):
         else:
             d["due_date"] = ""
             d["due_date_ts"] = ""
-        d["start_url"] = reverse("task_action", kwargs={"pk": self.pk, "action": "start"})
-        d["complete_url"] = reverse("task_action", kwargs={"pk": self.pk, "action": "complete"})
-        d["reassign_url"] = reverse("task_action", kwargs={"pk": self.pk, "action": "reassign"})
-        d["stop_url"] = reverse("task_action", kwargs={"pk": self.pk, "action": "stop"})
-        d["cancel_url"] = reverse("task_action", kwargs={"pk": self.pk, "action": "cancel"})
+        for action in ["start", "complete", "reassign", "stop", "cancel"]:
+            d[f"{action}_url"] = reverse("task_action", kwargs={"pk": self.pk, "action": action})
         return format_html(template, **d)
 
     def as_row_for_index_print(self):
@@ -1093,12 +1075,22 @@ class Record(ReferralBaseModel):
     )
     notes = models.ManyToManyField("Note", blank=True)
     uploaded_file_content = models.TextField(blank=True, null=True, editable=False)
+    # Uploaded file metadata, captured once when the file is uploaded (or by the backfill_record_metadata
+    # management command), so that rendering and saving records doesn't touch storage.
+    file_size = models.PositiveBigIntegerField(blank=True, null=True, editable=False)
+    file_hash = models.CharField(max_length=64, blank=True, null=True, editable=False, help_text="SHA-256 hash of the file.")
+    mime_type = models.CharField(max_length=128, blank=True, null=True, editable=False)
+    page_count = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    message_date = models.DateTimeField(blank=True, null=True, editable=False, help_text="Sent date of a MSG file.")
     search_document = models.TextField(blank=True, null=True, editable=False)
     search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ["-created"]
-        indexes = [GinIndex(fields=["search_vector"], name="idx_record_search_vector")]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="idx_record_search_vector"),
+            Index(fields=["referral", "order_date"], condition=Q(effective_to__isnull=True), name="idx_record_referral_current"),
+        ]
 
     def __str__(self):
         return f"Record {self.pk} ({smart_truncate(self.name, length=256)})"
@@ -1112,11 +1104,15 @@ class Record(ReferralBaseModel):
         """Overide save() to cleanse text input fields and populate the search_document field."""
         self.name = unidecode(self.name).replace("\r\n", "").strip()
 
+        # Capture the metadata of a newly-uploaded file, unless already done. Metadata of files already in storage
+        # is captured by the backfill_record_metadata management command.
+        if self.uploaded_file and not self.uploaded_file._committed:
+            if getattr(self, "_file_metadata_name", None) != self.uploaded_file.name:
+                self.set_file_metadata()
+
         # If the file is a .MSG we take the sent date of the email and use it for order_date.
-        if self.extension == "MSG":
-            msg = Message(self.uploaded_file)
-            if msg.date and not self.order_date:  # Don't override any existing order_date.
-                self.order_date = msg.date
+        if self.message_date and not self.order_date:  # Don't override any existing order_date.
+            self.order_date = self.message_date.date()
 
         self.search_document = f"{self.name} {self.infobase_id or ''} {self.uploaded_file_content or ''} {self.description or ''}"
         self.search_document = search_document_normalise(self.search_document)
@@ -1147,19 +1143,31 @@ class Record(ReferralBaseModel):
             # The uploaded file may not be indexed.
             return None
 
+    def set_file_metadata(self):
+        """Reads the uploaded file and sets the file metadata fields (the record is not saved).
+        A file which can't be read leaves the metadata fields unset.
+        """
+        self._file_metadata_name = self.uploaded_file.name
+        # Clear any metadata of a replaced file, in case reading this one fails.
+        for field in ("file_size", "file_hash", "mime_type", "page_count", "message_date"):
+            setattr(self, field, None)
+        try:
+            for field, value in get_file_metadata(self.uploaded_file).items():
+                setattr(self, field, value)
+        except Exception:
+            LOGGER.exception(f"Error reading file metadata for {self}")
+
+    def get_download_url(self):
+        """Returns the URL of the view which streams the uploaded file from storage."""
+        return reverse("record_download", kwargs={"pk": self.pk})
+
     @property
     def filename(self):
         """Metadata: returns the filename of the uploaded file"""
-        if settings.LOCAL_MEDIA_STORAGE:
-            if self.uploaded_file and os.path.exists(self.uploaded_file.path):
-                return self.uploaded_file.name.rsplit("/", 1)[-1]
-            else:
-                return ""
+        if self.uploaded_file:
+            return self.uploaded_file.name.rsplit("/", 1)[-1]
         else:
-            if self.uploaded_file:
-                return self.uploaded_file.name.rsplit("/", 1)[-1]
-            else:
-                return ""
+            return ""
 
     @property
     def extension(self):
@@ -1177,8 +1185,8 @@ class Record(ReferralBaseModel):
     def filesize_str(self):
         """Metadata: returns a human-friendly file size of the uploaded file"""
         try:
-            if self.uploaded_file:
-                num = self.uploaded_file.size
+            if self.uploaded_file and self.file_size is not None:
+                num = self.file_size
                 for x in ["b", "Kb", "Mb", "Gb"]:
                     if num < 1024.0:
                         return f"{num:3.1f} {x}"
@@ -1217,7 +1225,7 @@ class Record(ReferralBaseModel):
             d["infobase_url"] = ""
             d["infobase_id"] = ""
         if self.uploaded_file:
-            d["download_url"] = mark_safe(f"<a href='{self.uploaded_file.url}'><i class='fa-solid fa-download'></i> {self.extension}</a>")
+            d["download_url"] = mark_safe(f"<a href='{self.get_download_url()}'><i class='fa-solid fa-download'></i> {self.extension}</a>")
             d["filesize"] = self.filesize_str
         else:
             d["download_url"] = ""
@@ -1266,7 +1274,7 @@ class Record(ReferralBaseModel):
             d["infobase_id"] = ""
         d["description"] = self.description or ""
         if self.uploaded_file:
-            d["download_url"] = mark_safe(f"<a href='{self.uploaded_file.url}'><i class='fa-solid fa-download'></i> {self.extension}</a>")
+            d["download_url"] = mark_safe(f"<a href='{self.get_download_url()}'><i class='fa-solid fa-download'></i> {self.extension}</a>")
             d["filesize"] = self.filesize_str
         else:
             d["download_url"] = ""
@@ -1309,7 +1317,10 @@ class Note(ReferralBaseModel):
 
     class Meta:
         ordering = ["order_date"]
-        indexes = [GinIndex(fields=["search_vector"], name="idx_note_search_vector")]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="idx_note_search_vector"),
+            Index(fields=["referral", "order_date"], condition=Q(effective_to__isnull=True), name="idx_note_referral_current"),
+        ]
 
     def __str__(self):
         return self.short_note
@@ -1497,7 +1508,10 @@ class Condition(ReferralBaseModel):
 
     class Meta:
         ordering = ["-created"]
-        indexes = [GinIndex(fields=["search_vector"], name="idx_condition_search_vector")]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="idx_condition_search_vector"),
+            Index(fields=["referral"], condition=Q(effective_to__isnull=True), name="idx_condition_referral_current"),
+        ]
 
     @classmethod
     def get_headers(cls):
@@ -1544,6 +1558,13 @@ class Condition(ReferralBaseModel):
             except Exception:
                 LOGGER.exception(f"Error during indexing condition {self}")
 
+    def get_category_tag(self):
+        """Returns the optional condition "category" tag (the first tag, by PK), or None.
+        Tags are read using all(), so that querysets may use prefetch_related("tags").
+        """
+        tags = sorted(self.tags.all(), key=lambda tag: tag.pk)
+        return tags[0] if tags else None
+
     def as_row(self):
         """
         Returns a string of HTML that renders the object details as table row cells.
@@ -1667,6 +1688,9 @@ class Clearance(models.Model):
     date_created = models.DateField(auto_now_add=True)
     deposited_plan = models.CharField(max_length=200, null=True, blank=True, validators=[MaxLengthValidator(200)])
     objects = ClearanceManager()
+    # Related objects used by as_row(), fetched by list views in a fixed number of queries.
+    list_select_related = ("condition", "task__type", "task__referral")
+    list_prefetch_related = ("condition__tags",)
 
     class Meta:
         ordering = ["-pk"]
@@ -1707,10 +1731,8 @@ class Clearance(models.Model):
         d["identifier"] = self.condition.identifier or ""
         d["condition"] = smart_truncate(self.condition.condition, length=400)
         # Condition "category" is actually an optional single tag.
-        if self.condition.tags.exists():
-            d["category"] = self.condition.tags.first().name
-        else:
-            d["category"] = ""
+        category = self.condition.get_category_tag()
+        d["category"] = category.name if category else ""
         if self.task.description:
             d["task"] = smart_truncate(unidecode(self.task.description), length=400)
         else:
@@ -1782,6 +1804,13 @@ class Location(ReferralBaseModel):
     poly = models.PolygonField(srid=4283, null=True, blank=True, help_text="Optional.")
     address_string = models.TextField(null=True, blank=True, editable=True)
 
+    class Meta:
+        ordering = ["-created"]
+        indexes = [
+            GinIndex(OpClass(Upper("address_string"), name="gin_trgm_ops"), name="idx_location_address_trgm"),
+            Index(fields=["referral"], condition=Q(effective_to__isnull=True), name="idx_location_referral_current"),
+        ]
+
     @classmethod
     def get_headers(cls):
         """Return a list of string values as headers for any list view."""
@@ -1909,6 +1938,12 @@ class Bookmark(ReferralBaseModel):
         validators=[MaxLengthValidator(200)],
     )
 
+    class Meta:
+        ordering = ["-created"]
+        indexes = [
+            Index(fields=["referral", "user"], condition=Q(effective_to__isnull=True), name="idx_bookmark_ref_user_current"),
+        ]
+
     @classmethod
     def get_headers(cls):
         """Return a list of string values as headers for any list view."""
@@ -1964,30 +1999,74 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.username
 
+    @property
+    def referral_history_cache_key(self):
+        return f"prs:referral_history:{self.user_id}"
+
+    def get_referral_history(self):
+        """Return the user's referral history, including any buffered updates not yet flushed to the database.
+        Buffered history older than the flush period should already have been flushed; in case the flush task was
+        lost, it is written to the database now.
+        """
+        buffered = django_cache.get(self.referral_history_cache_key)
+        if buffered is None:
+            return self.referral_history_array
+        history, updated = buffered
+        if time.time() - updated > settings.REFERRAL_HISTORY_FLUSH_SECONDS * 2 and history != self.referral_history_array:
+            UserProfile.objects.filter(pk=self.pk).update(referral_history_array=history)
+            self.referral_history_array = history
+        return history
+
     def last_referral(self):
         """Return the referral that the user most-recently opened, or None.
-        The last referral opened is the final item on the referral_history_array list in the user's profile.
+        The last referral opened is the final item on the referral history list in the user's profile.
         """
-        if not self.referral_history_array:
+        history = self.get_referral_history()
+        if not history:
             return None
 
-        for pk in reversed(self.referral_history_array):
-            if Referral.objects.current().filter(pk=pk).exists():
+        # Query the current referrals in the history at once, then return the most-recent of them.
+        current_pks = set(Referral.objects.current().filter(pk__in=history).values_list("pk", flat=True))
+        for pk in reversed(history):
+            if pk in current_pks:
                 return Referral.objects.get(pk=pk)
 
         return None
 
     def update_referral_history(self, referral, history_limit: int = 20):
-        """Updates the referral_history_array field with the passed-in referral, limiting the length of history to the defined value.
-        History is a simple list of referral object primary key integers."""
-        history = [pk for pk in self.referral_history_array if pk != referral.pk]
+        """Updates the user's referral history with the passed-in referral, limiting the length of history to the defined value.
+        History is a simple list of referral object primary key integers.
+        Updates are buffered in the cache and written to the database by the flush_referral_history task, unless no
+        cache is configured (in which case the profile is saved immediately).
+        """
+        current_history = self.get_referral_history()
+        history = [pk for pk in current_history if pk != referral.pk]
         history.append(referral.pk)
-        if len(history) > history_limit:
-            self.referral_history_array = history[-history_limit:]
-        else:
-            self.referral_history_array = history
-
-        self.save()
+        history = history[-history_limit:]
+        self.referral_history_array = history
+        if history == current_history:  # Re-opening the last referral changes nothing.
+            return
+
+        if not shared_cache_enabled():
+            self.save()
+            return
+
+        django_cache.set(self.referral_history_cache_key, (history, time.time()), settings.REFERRAL_HISTORY_CACHE_SECONDS)
+        bump_user_context_version(self.user_id)
+        # Schedule a single flush of buffered history per user for each flush period.
+        flush_lock_key = f"{self.referral_history_cache_key}:flush"
+        if django_cache.add(flush_lock_key, True, settings.REFERRAL_HISTORY_FLUSH_SECONDS):
+
+            def schedule_flush():
+                try:
+                    flush_referral_history.apply_async(args=[self.pk], countdown=settings.REFERRAL_HISTORY_FLUSH_SECONDS)
+                except Exception:
+                    # The task couldn't be queued: write the history through to the database instead.
+                    LOGGER.exception(f"Error scheduling referral history flush for {self}")
+                    django_cache.delete(flush_lock_key)
+                    UserProfile.objects.filter(pk=self.pk).update(referral_history_array=history)
+
+            transaction.on_commit(schedule_flush)
 
     def is_prs_user(self):
         """Returns group membership of the PRS user group."""
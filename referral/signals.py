@@ -1,9 +1,98 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
-from referral.models import UserProfile
+from django.utils import timezone
+from referral.models import Referral, ReferralBaseModel, ReferralLookup, RelatedReferral, UserProfile
+from referral.utils import bump_cache_version, bump_user_context_version, get_model_version_key
+
+User = get_user_model()
 
 
 @receiver(user_logged_in)
 def user_create_userprofile(sender, **kwargs):
     # Ensure that a UserProfile object exists for a user.
     UserProfile.objects.get_or_create(user=kwargs["user"])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def user_context_invalidate(sender, instance, **kwargs):
+    # Changes to a user (e.g. superuser status) or their profile (e.g. referral history) invalidate their cached context.
+    bump_user_context_version(instance.pk if sender is User else instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_invalidate(sender, instance, action, reverse, pk_set, **kwargs):
+    # Group membership changes invalidate the cached context of the affected user(s).
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        bump_user_context_version(instance.pk)
+    elif pk_set:
+        for pk in pk_set:
+            bump_user_context_version(pk)
+    else:  # A group was cleared of all members.
+        bump_user_context_version()
+
+
+@receiver(post_save, sender=Referral)
+def referral_deleted_invalidate(sender, instance, **kwargs):
+    # Deleting a referral may invalidate the last referral of any user.
+    if instance.effective_to:
+        bump_user_context_version()
+
+
+# Apps whose models have a version stamp, invalidating cached select list choices and API responses.
+VERSIONED_APP_LABELS = ("referral", "auth", "taggit")
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def model_version_invalidate(sender, instance, update_fields=None, **kwargs):
+    # Saving (or deleting) any lookup object invalidates the cached lookup table in every process.
+    # A login only saves the user's last_login timestamp, which no cached output includes.
+    if sender is User and update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    if isinstance(instance, ReferralLookup):
+        sender.objects.invalidate_cache()
+    elif sender._meta.app_label in VERSIONED_APP_LABELS:
+        bump_cache_version(get_model_version_key(sender))
+
+
+@receiver(m2m_changed)
+def m2m_version_invalidate(sender, instance, action, model, **kwargs):
+    # Changes to many-to-many relations (e.g. regions, tags or group membership) invalidate both related models.
+    if not action.startswith("post_"):
+        return
+    for related_model in (instance.__class__, model):
+        if related_model._meta.app_label in VERSIONED_APP_LABELS:
+            bump_cache_version(get_model_version_key(related_model))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_version_invalidate(sender, **kwargs):
+    # Group changes invalidate cached user select list choices, which are filtered by group name.
+    bump_cache_version(get_model_version_key(User))
+
+
+@receiver(m2m_changed)
+def m2m_modified_update(sender, instance, action, model, pk_set, **kwargs):
+    # Many-to-many changes (e.g. tags or task records) don't save either object, so update their modified
+    # timestamps (used to validate conditional requests for detail pages).
+    if not action.startswith("post_"):
+        return
+    now = timezone.now()
+    if isinstance(instance, ReferralBaseModel):
+        instance.__class__.objects.filter(pk=instance.pk).update(modified=now)
+    if issubclass(model, ReferralBaseModel) and pk_set:
+        model.objects.filter(pk__in=pk_set).update(modified=now)
+
+
+@receiver(post_save, sender=RelatedReferral)
+@receiver(post_delete, sender=RelatedReferral)
+def related_referral_modified_update(sender, instance, **kwargs):
+    # Relating or unrelating referrals updates the modified timestamp of both referrals.
+    Referral.objects.filter(pk__in=[instance.from_referral_id, instance.to_referral_id]).update(modified=timezone.now())
@@ -0,0 +1,24 @@
+// Populate select lists that are rendered with only their selected option (large option sets),
+// by querying the API selectlist endpoint in each element's data-selectlist-url attribute.
+$(function () {
+    $("select[data-selectlist-url]").each(function () {
+        var select = this;
+        var selected = [].concat($(select).val() || []);
+        select.disabled = true;
+        $.ajax({
+            url: $(select).data("selectlist-url"),
+            data: {selectlist: ""},
+            success: function (data) {
+                $(select).find("option[value!='']").remove();
+                for (var i in data) {
+                    var value = String(data[i].id);
+                    var isSelected = selected.indexOf(value) > -1;
+                    select.options.add(new Option(data[i].text, value, isSelected, isSelected));
+                }
+            },
+            complete: function () {
+                select.disabled = false;
+            }
+        });
+    });
+});
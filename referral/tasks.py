@@ -1,6 +1,7 @@
 import logging
 
 from celery import shared_task
+from django.core.cache import cache
 from indexer.utils import (
     get_typesense_client,
     typesense_index_condition,
@@ -34,6 +35,25 @@ def index_record(pk):
         raise
 
 
+@shared_task
+def flush_referral_history(pk):
+    """Write a user's buffered referral history (see UserProfile.update_referral_history) to the database."""
+    from referral.models import UserProfile
+
+    profile = UserProfile.objects.get(pk=pk)
+    # Clear the flush lock first, so that any later update schedules another flush.
+    cache.delete(f"{profile.referral_history_cache_key}:flush")
+    buffered = cache.get(profile.referral_history_cache_key)
+    if buffered is None:
+        return
+    history, _ = buffered
+    if history == profile.referral_history_array:
+        return
+    # Use update() rather than save(), to skip the post_save signal (the buffered history is already current).
+    UserProfile.objects.filter(pk=pk).update(referral_history_array=history)
+    return f"Flushed referral history for {profile}"
+
+
 @shared_task(default_retry_delay=10, max_retries=1)
 def index_object(pk, model, client=None):
     """Index a single PRS referral app object."""
@@ -1,4 +1,10 @@
+import json
+from base64 import urlsafe_b64encode
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from referral.models import Referral, Task
 from referral.test_models import PrsTestCase
 
 API_MODELS_LOOKUP = [
@@ -68,3 +74,149 @@ class PrsAPITest(PrsTestCase):
             self.client.logout()
             response = self.client.get(url)  # Anonymous user
             self.assertEqual(response.status_code, 200)
+
+    def test_pagination_cursor(self):
+        """Test keyset pagination of resource lists"""
+        self.client.login(username="normaluser", password="pass")
+        for model in API_MODELS:
+            url = reverse(f"api:{model}_api_resource")
+            response = self.client.get(url, {"cursor": "", "limit": 1})
+            self.assertEqual(response.status_code, 200)
+            res = response.json()
+            self.assertEqual(len(res["objects"]), 1)
+            self.assertTrue(res["count"])
+            self.assertTrue(res["next_cursor"])
+            response = self.client.get(url, {"cursor": res["next_cursor"], "limit": 1})
+            self.assertEqual(response.status_code, 200)
+            next_res = response.json()
+            self.assertNotEqual(res["objects"][0]["id"], next_res["objects"][0]["id"])
+            self.assertIsNone(next_res["count"])
+            # Invalid cursors return a 400 response.
+            response = self.client.get(url, {"cursor": "foo"})
+            self.assertEqual(response.status_code, 400)
+            # Well-formed cursors having invalid values also return a 400 response.
+            for values in [["x", 1], ["2025-01-01T00:00:00+00:00", "x"], [None, 1], ["x"]]:
+                cursor = urlsafe_b64encode(json.dumps(values).encode()).decode()
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_query_count(self):
+        """Test that the number of queries for a page of resources doesn't scale with the page size"""
+        self.client.login(username="normaluser", password="pass")
+        for model in API_MODELS:
+            url = reverse(f"api:{model}_api_resource")
+            with CaptureQueriesContext(connection) as small_page:
+                self.client.get(url, {"limit": 1})
+            with CaptureQueriesContext(connection) as large_page:
+                self.client.get(url, {"limit": 50})
+            self.assertEqual(len(small_page), len(large_page))
+
+    @override_settings(API_STREAMING_LIMIT=1)
+    def test_streaming(self):
+        """Test that responses for a large limit are streamed"""
+        self.client.login(username="normaluser", password="pass")
+        for model in API_MODELS:
+            url = reverse(f"api:{model}_api_resource")
+            response = self.client.get(url, {"limit": 2})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            res = json.loads(b"".join(response.streaming_content))
+            self.assertEqual(len(res["objects"]), 2)
+            # Keyset pages aren't streamed, but are capped at API_STREAMING_LIMIT objects.
+            response = self.client.get(url, {"cursor": "", "limit": 2})
+            self.assertFalse(response.streaming)
+            res = response.json()
+            self.assertEqual(len(res["objects"]), 1)
+            self.assertTrue(res["next_cursor"])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_response_cache(self):
+        """Test that API responses are cached, and invalidated when an object is changed"""
+        self.client.login(username="normaluser", password="pass")
+        url = reverse("api:referral_api_resource")
+        with CaptureQueriesContext(connection) as uncached:
+            response = self.client.get(url, {"limit": 1})
+        with CaptureQueriesContext(connection) as cached:
+            cached_response = self.client.get(url, {"limit": 1})
+        self.assertEqual(response.content, cached_response.content)
+        self.assertLess(len(cached), len(uncached))
+        # Responses are cached per set of query parameters.
+        response = self.client.get(url, {"limit": 2})
+        self.assertEqual(len(response.json()["objects"]), 2)
+        # Saving a referral invalidates cached responses.
+        ref = Referral.objects.get(pk=cached_response.json()["objects"][0]["id"])
+        ref.description = "Updated description"
+        ref.save()
+        response = self.client.get(url, {"limit": 1})
+        self.assertEqual(response.json()["objects"][0]["description"], "Updated description")
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_conditional_get(self):
+        """Test that API resources return a 304 response if unchanged"""
+        self.client.login(username="normaluser", password="pass")
+        for model in API_MODELS_LOOKUP + API_MODELS:
+            url = reverse(f"api:{model}_api_resource")
+            response = self.client.get(url)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+
+    @override_settings(API_CHANGES_SETTLE_SECONDS=0)
+    def test_changes(self):
+        """Test the change feeds return changed objects since a cursor, including deleted objects"""
+        self.client.login(username="normaluser", password="pass")
+        for model in [Referral, Task]:
+            url = reverse(f"api:{model._meta.model_name}_api_changes")
+            response = self.client.get(url, {"cursor": "", "limit": 1})
+            self.assertEqual(response.status_code, 200)
+            res = response.json()
+            self.assertEqual(len(res["objects"]), 1)
+            self.assertTrue(res["more"])
+            # Page through all changes.
+            response = self.client.get(url, {"cursor": res["next_cursor"], "limit": 1000})
+            res = response.json()
+            self.assertFalse(res["more"])
+            cursor = res["next_cursor"]
+            # No changes since the last cursor.
+            res = self.client.get(url, {"cursor": cursor}).json()
+            self.assertFalse(res["objects"])
+            self.assertEqual(res["next_cursor"], cursor)
+            # Deleted objects are returned as tombstones.
+            obj = model.objects.current().first()
+            obj.delete()
+            res = self.client.get(url, {"cursor": cursor}).json()
+            tombstones = [i for i in res["objects"] if i["id"] == obj.pk]
+            self.assertEqual(len(tombstones), 1)
+            self.assertTrue(tombstones[0]["deleted"])
+            # Invalid cursors return a 400 response.
+            response = self.client.get(url, {"cursor": "foo"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_fields(self):
+        """Test that resource lists can return a subset of fields, using fewer queries"""
+        self.client.login(username="normaluser", password="pass")
+        for model in API_MODELS:
+            url = reverse(f"api:{model}_api_resource")
+            with CaptureQueriesContext(connection) as all_fields:
+                self.client.get(url, {"limit": 10})
+            with CaptureQueriesContext(connection) as some_fields:
+                response = self.client.get(url, {"limit": 10, "fields": "description"})
+            self.assertEqual(response.status_code, 200)
+            for obj in response.json()["objects"]:
+                self.assertEqual(set(obj.keys()), {"id", "description"})
+            self.assertLess(len(some_fields), len(all_fields))
+            # Unknown fields return a 400 response.
+            response = self.client.get(url, {"fields": "foo"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_ids(self):
+        """Test that resource lists can return a batch of objects by ID"""
+        self.client.login(username="normaluser", password="pass")
+        for model in API_MODELS:
+            url = reverse(f"api:{model}_api_resource")
+            ids = sorted([obj["id"] for obj in self.client.get(url, {"limit": 3}).json()["objects"]])[:2]
+            response = self.client.get(url, {"ids": ",".join([str(i) for i in ids])})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sorted([obj["id"] for obj in response.json()["objects"]]), ids)
+            # Invalid IDs return a 400 response.
+            response = self.client.get(url, {"ids": "foo"})
+            self.assertEqual(response.status_code, 400)
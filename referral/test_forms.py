@@ -2,7 +2,8 @@ from datetime import date
 from tempfile import NamedTemporaryFile
 
 from django.core.files.uploadedfile import SimpleUploadedFile
-from referral.forms import OrganisationForm, RecordCreateForm, RecordForm, ReferralForm
+from django.test.utils import override_settings
+from referral.forms import OrganisationForm, RecordCreateForm, RecordForm, ReferralCreateForm, ReferralForm
 from referral.models import DopTrigger, Organisation, ReferralType, Region
 from referral.test_models import PrsTestCase
 
@@ -41,6 +42,36 @@ class ReferralFormTest(PrsTestCase):
         self.assertTrue(form.is_valid())
 
 
+class ReferralCreateFormTest(PrsTestCase):
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_cached_choices(self):
+        """Test that select list choices are cached, and invalidated when a lookup object is changed"""
+        fields = ["referring_org", "regions", "dop_triggers", "task_type", "assigned_user"]
+        form = ReferralCreateForm()
+        for field in fields:
+            list(form.fields[field].choices)
+        # Subsequent forms read the choice lists from the cache.
+        form = ReferralCreateForm()
+        with self.assertNumQueries(0):
+            for field in fields:
+                list(form.fields[field].choices)
+        org = Organisation.objects.current().filter(public=True).first()
+        org.list_name = "Test organisation"
+        org.save()
+        form = ReferralCreateForm()
+        self.assertIn((org.pk, "Test organisation"), list(form.fields["referring_org"].choices))
+
+    @override_settings(SELECTLIST_INLINE_MAX=1)
+    def test_selectlist_choices(self):
+        """Test that large select lists only render the selected option, plus the API endpoint to load the others"""
+        org = Organisation.objects.current().filter(public=True).first()
+        form = ReferralCreateForm(initial={"referring_org": org.pk})
+        html = str(form["referring_org"])
+        self.assertIn("data-selectlist-url", html)
+        self.assertIn(f'value="{org.pk}" selected', html)
+        self.assertEqual(html.count("<option"), 2)  # Empty option plus the selected option.
+
+
 class OrganisationFormTest(PrsTestCase):
     def setUp(self):
         super(OrganisationFormTest, self).setUp()
@@ -1,4 +1,6 @@
+import hashlib
 import os
+import time
 from datetime import date, timedelta
 from tempfile import NamedTemporaryFile
 
@@ -6,7 +8,10 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Polygon
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from mixer.backend.django import mixer
 from referral.models import (
@@ -33,6 +38,8 @@ from referral.models import (
     TaskType,
     UserProfile,
 )
+from referral.tasks import flush_referral_history
+from referral.utils import get_query
 from taggit.models import Tag
 
 User = get_user_model()
@@ -157,6 +164,22 @@ class ReferralLookupModelTest(PrsTestCase):
         self.assertTrue(obj_del.pk in del_pks)
         self.assertFalse(self.obj.pk in del_pks)
 
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_get_cached(self):
+        """Test the ReferralLookup manager get_cached() method."""
+        self.assertEqual(DopTrigger.objects.get_cached(pk=self.obj.pk), self.obj)
+        # Lookups are served from the cache.
+        with self.assertNumQueries(0):
+            self.assertEqual(DopTrigger.objects.get_cached(name=self.obj.name), self.obj)
+            self.assertEqual(DopTrigger.objects.get_cached(slug=self.obj.slug), self.obj)
+            self.assertEqual(DopTrigger.objects.get_cached(name=self.obj.name, public=self.obj.public), self.obj)
+        # Saving an object invalidates the cache.
+        self.obj.name = "Changed name"
+        self.obj.save()
+        self.assertEqual(DopTrigger.objects.get_cached(name="Changed name"), self.obj)
+        with self.assertRaises(DopTrigger.DoesNotExist):
+            DopTrigger.objects.get_cached(name="Nonexistent name")
+
 
 class ReferralBaseModelTest(PrsTestCase):
     """Unit tests for the abstract base model class in the referral app.
@@ -491,13 +514,26 @@ class RecordTest(PrsTestCase):
         """Test the Record model filesize_str property."""
         self.assertTrue(hasattr(self.r, "extension"))
         self.assertFalse(self.r.filesize_str)  # No file assigned yet.
-        self.tmp_f = open(settings.MEDIA_ROOT + "/test.txt", "w")
-        self.tmp_f.write("x" * 1024 * 10)  # Write 10k of junk in the file.
-        self.tmp_f.close()
-        self.r.uploaded_file = self.tmp_f.name
+        self.r.uploaded_file = SimpleUploadedFile("test.txt", b"x" * 1024 * 10)  # Upload 10k of junk.
         self.r.save()
         self.assertEqual(self.r.filesize_str, "10.0 Kb")
 
+    def test_file_metadata(self):
+        """Test that the Record model captures the uploaded file metadata on save."""
+        self.assertIsNone(self.r.file_size)  # No file assigned yet.
+        # A file already in storage is left to the backfill_record_metadata command.
+        self.r.uploaded_file = self.tmp_f.name
+        self.r.save()
+        self.r.refresh_from_db()
+        self.assertIsNone(self.r.file_size)
+        self.r.uploaded_file = SimpleUploadedFile("test.txt", b"Hello, World!")
+        self.r.save()
+        self.r.refresh_from_db()
+        self.assertEqual(self.r.file_size, 13)
+        self.assertEqual(self.r.file_hash, hashlib.sha256(b"Hello, World!").hexdigest())
+        self.assertEqual(self.r.mime_type, "text/plain")
+        self.assertIsNone(self.r.page_count)
+
     def test_as_row(self):
         """Test the Record model as_row() method."""
         # Test that the return string contains record name and
@@ -803,3 +839,96 @@ class UserProfileTest(PrsTestCase):
         # Deleted referrals should not be returned for history.
         ref.delete()
         self.assertFalse(self.n_user.userprofile.last_referral())
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_update_referral_history_buffered(self):
+        profile = self.n_user.userprofile
+        ref = Referral.objects.first()
+        # Updating referral history doesn't query the database.
+        with self.assertNumQueries(0):
+            profile.update_referral_history(ref)
+        self.assertFalse(UserProfile.objects.get(pk=profile.pk).referral_history_array)
+        # Reads include the buffered history.
+        profile = UserProfile.objects.get(pk=profile.pk)
+        self.assertEqual(profile.get_referral_history(), [ref.pk])
+        self.assertEqual(profile.last_referral(), ref)
+        # Flushing writes the buffered history to the database.
+        flush_referral_history(profile.pk)
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).referral_history_array, [ref.pk])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_referral_history_lost_flush(self):
+        profile = self.n_user.userprofile
+        ref = Referral.objects.first()
+        # Buffered history older than the flush period (i.e. whose flush task was lost) is written back on read.
+        cache.set(profile.referral_history_cache_key, ([ref.pk], time.time() - settings.REFERRAL_HISTORY_FLUSH_SECONDS * 3))
+        profile = UserProfile.objects.get(pk=profile.pk)
+        self.assertEqual(profile.get_referral_history(), [ref.pk])
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).referral_history_array, [ref.pk])
+
+
+class QueryPlanTest(PrsTestCase):
+    """Query plan regression tests, to check that common lookups are able to use their database indexes."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        """Assert that the query plan for the passed-in queryset uses the named index.
+        Sequential scans are disabled, as the planner will always prefer them for tiny test tables.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                plan = queryset.explain()
+            finally:
+                cursor.execute("RESET enable_seqscan")
+        self.assertIn(index_name, plan)
+
+    def test_referral_reference_icontains(self):
+        """Test that referral reference substring searches use the trigram index"""
+        qs = Referral.objects.current().filter(reference__icontains="1234")
+        self.assertUsesIndex(qs, "idx_referral_reference_trgm")
+
+    def test_referral_reference_iexact(self):
+        """Test that referral reference exact matches use the case-folded index"""
+        qs = Referral.objects.current().filter(reference__iexact="ABC/1234")
+        self.assertUsesIndex(qs, "idx_referral_reference_upper")
+
+    def test_referral_get_query(self):
+        """Test that list view searches use the trigram indexes"""
+        qs = Referral.objects.current().filter(get_query("1234", ["reference", "file_no", "address", "description"]))
+        for index_name in [
+            "idx_referral_reference_trgm",
+            "idx_referral_file_no_trgm",
+            "idx_referral_address_trgm",
+            "idx_referral_description_trgm",
+        ]:
+            self.assertUsesIndex(qs, index_name)
+
+    def test_location_address_icontains(self):
+        """Test that location address substring searches use the trigram index"""
+        qs = Location.objects.current().filter(address_string__icontains="perth")
+        self.assertUsesIndex(qs, "idx_location_address_trgm")
+
+    def test_site_home_tasks(self):
+        """Test that the site home task queries use the partial index on current tasks"""
+        qs = Task.objects.current().filter(assigned_user=self.n_user, state__is_ongoing=True)
+        self.assertUsesIndex(qs, "idx_task_user_state_current")
+        qs = Task.objects.current().filter(assigned_user=self.n_user, state__name="Stopped")
+        self.assertUsesIndex(qs, "idx_task_user_state_current")
+
+    def test_referral_child_objects(self):
+        """Test that referral child object queries use the partial indexes on current objects"""
+        ref = Referral.objects.first()
+        for model, index_name in [
+            (Task, "idx_task_referral_current"),
+            (Record, "idx_record_referral_current"),
+            (Note, "idx_note_referral_current"),
+            (Condition, "idx_condition_referral_current"),
+            (Location, "idx_location_referral_current"),
+        ]:
+            self.assertUsesIndex(model.objects.current().filter(referral=ref), index_name)
+
+    def test_referral_bookmark(self):
+        """Test that the user bookmark query uses the partial index on current bookmarks"""
+        ref = Referral.objects.first()
+        qs = Bookmark.objects.current().filter(referral=ref, user=self.n_user)
+        self.assertUsesIndex(qs, "idx_bookmark_ref_user_current")
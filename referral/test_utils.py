@@ -1,10 +1,14 @@
+import json
 from datetime import date, timedelta
+from io import BytesIO
 from pathlib import Path
+from zipfile import ZipFile
 
 from django.conf import settings
+from django.contrib.auth.models import Group
 from django.db.models.base import ModelBase
 from django.db.models.query import QuerySet
-from django.test import RequestFactory
+from django.test import RequestFactory, override_settings
 from extract_msg import Message
 
 from referral.models import Record, Referral, Task
@@ -13,9 +17,14 @@ from referral.utils import (
     breadcrumbs_li,
     dewordify_text,
     filter_queryset,
+    get_user_context,
     is_model_or_string,
+    json_dumps,
+    locations_geojson,
+    orjson,
     overdue_task_email,
     smart_truncate,
+    stream_zip,
     update_revision_history,
 )
 
@@ -158,3 +167,71 @@ class UtilsTest(PrsTestCase):
         record.save()
         # Record order_date is no longer empty.
         self.assertTrue(record.order_date)
+
+    def test_json_dumps(self):
+        """Test that the JSON encoders return equivalent output"""
+        obj = {"date": date.today(), "text": "Short test", "numbers": (1, 2.5), 1: None}
+        output = json.loads(json_dumps(obj, "stdlib"))
+        self.assertEqual(output["date"], date.today().isoformat())
+        if orjson:
+            self.assertEqual(json.loads(json_dumps(obj, "orjson")), output)
+
+    def test_locations_geojson(self):
+        """Test that locations_geojson returns a GeoJSON feature collection"""
+        referral = Referral.objects.first()
+        locations = referral.location_set.current()
+        geojson = json.loads(locations_geojson(locations))
+        self.assertEqual(geojson["type"], "FeatureCollection")
+        self.assertEqual(len(geojson["features"]), len([loc for loc in locations if loc.poly]))
+
+    def test_stream_zip(self):
+        """Test that stream_zip yields a valid ZIP archive when a file fails to be read"""
+
+        def failing(fail_first):
+            if not fail_first:
+                yield b"Partial content"
+            raise OSError("Storage error")
+
+        files = [("a.txt", [b"Hello, ", b"World!"]), ("missing.txt", failing(True)), ("partial.txt", failing(False))]
+        with self.assertLogs("prs", level="ERROR"):
+            archive = ZipFile(BytesIO(b"".join(stream_zip(files))))
+        self.assertEqual(archive.namelist(), ["a.txt", "partial.txt"])
+        self.assertEqual(archive.read("a.txt"), b"Hello, World!")
+        self.assertEqual(archive.read("partial.txt"), b"Partial content")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class UserContextTest(PrsTestCase):
+    """Tests for the cached user context utility functions."""
+
+    def get_request(self, user):
+        request = RequestFactory().get("/")
+        request.user = user
+        return request
+
+    def test_get_user_context(self):
+        """Test that the user context is memoised per request and cached between requests"""
+        request = self.get_request(self.n_user)
+        user_context = get_user_context(request)
+        self.assertTrue(user_context["prs_user"])
+        self.assertFalse(user_context["prs_power_user"])
+        self.assertIsNone(user_context["last_referral_pk"])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_context(request), user_context)
+            self.assertEqual(get_user_context(self.get_request(self.n_user)), user_context)
+
+    def test_get_user_context_invalidation(self):
+        """Test that the cached user context is invalidated by changes to the user"""
+        get_user_context(self.get_request(self.n_user))
+        # Referral history changes.
+        ref = Referral.objects.first()
+        self.n_user.userprofile.update_referral_history(ref)
+        self.assertEqual(get_user_context(self.get_request(self.n_user))["last_referral_pk"], ref.pk)
+        # Deleted referrals are removed from the last referral.
+        ref.delete()
+        self.assertIsNone(get_user_context(self.get_request(self.n_user))["last_referral_pk"])
+        # Group membership changes.
+        self.n_user.groups.remove(Group.objects.get(name=settings.PRS_USER_GROUP))
+        self.assertFalse(get_user_context(self.get_request(self.n_user))["prs_user"])
+        Group.objects.get(name=settings.PRS_POWER_USER_GROUP).user_set.add(self.n_user)
+        self.assertTrue(get_user_context(self.get_request(self.n_user))["prs_power_user"])
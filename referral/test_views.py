@@ -1,12 +1,16 @@
 import json
 import os
 import uuid
+import zipfile
 from datetime import date, timedelta
+from io import BytesIO
 
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Polygon
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from mixer.backend.django import mixer
 from taggit.models import Tag
@@ -24,6 +28,7 @@ from referral.models import (
     ReferralType,
     Region,
     Task,
+    TaskState,
     TaskType,
 )
 from referral.test_models import PrsTestCase
@@ -110,6 +115,37 @@ class BaseViewTest(PrsViewsTestCase):
             resp = self.client.get(f"{url}?q=foo+bar")
             self.assertEqual(resp.status_code, 200)
 
+    def test_get_cursor(self):
+        """Test prs_object_list view using keyset pagination"""
+        for i in self.models:
+            url = reverse("prs_object_list", kwargs={"model": i._meta.object_name.lower()})
+            resp = self.client.get(f"{url}?cursor=")
+            self.assertEqual(resp.status_code, 200)
+            first_page = list(resp.context["object_list"])
+            next_cursor = resp.context["next_cursor"]
+            if next_cursor:
+                resp = self.client.get(f"{url}?cursor={next_cursor}")
+                self.assertEqual(resp.status_code, 200)
+                # Pages must not overlap.
+                self.assertFalse(set(first_page) & set(resp.context["object_list"]))
+                # Following pages are not counted.
+                self.assertIsNone(resp.context["object_count"])
+        # An invalid cursor returns a 404 response.
+        url = reverse("prs_object_list", kwargs={"model": "referral"})
+        resp = self.client.get(f"{url}?cursor=foo")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_get_query_count(self):
+        """Test that the number of queries for a page of clearances doesn't scale with the page size"""
+        url = reverse("prs_object_list", kwargs={"model": "clearance"})
+        with CaptureQueriesContext(connection) as full_page:
+            resp = self.client.get(url, {"page": 1})
+        self.assertEqual(len(resp.context["object_list"]), 20)
+        with CaptureQueriesContext(connection) as last_page:
+            resp = self.client.get(url, {"page": 2})
+        self.assertLess(len(resp.context["object_list"]), 20)
+        self.assertEqual(len(full_page), len(last_page))
+
     def test_nonsense_model(self):
         """Test an attempt to reverse the list view for a non-existent model."""
         url = reverse("prs_object_list", kwargs={"model": "foobar"})
@@ -160,6 +196,28 @@ class SiteHomeTest(PrsViewsTestCase):
         self.assertTemplateUsed(resp, "site_home.html")
         self.assertContains(resp, "STOPPED TASKS")
 
+    def test_query_count(self):
+        """Test that the number of queries for the homepage views doesn't scale with the number of tasks"""
+        in_progress = TaskState.objects.get(name="In progress")
+        in_progress.is_ongoing = True
+        in_progress.save()
+        stopped = TaskState.objects.get(name="Stopped")
+        Task.objects.update(assigned_user=self.n_user, state=in_progress)
+        urls = [reverse("site_home"), reverse("site_home_print"), reverse("stopped_tasks_list")]
+        query_counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url)
+            query_counts.append(len(ctx.captured_queries))
+        # Assign a lot more tasks to the user.
+        mixer.cycle(20).blend(
+            Task, type=mixer.SELECT, referral=mixer.SELECT, state=in_progress, assigned_user=self.n_user, search_vector=None
+        )
+        mixer.cycle(20).blend(Task, type=mixer.SELECT, referral=mixer.SELECT, state=stopped, assigned_user=self.n_user, search_vector=None)
+        for url, query_count in zip(urls, query_counts):
+            with self.assertNumQueries(query_count):
+                self.client.get(url)
+
 
 class HelpPageTest(PrsViewsTestCase):
     def test_help_page(self):
@@ -230,6 +288,24 @@ class ReferralDetailTest(PrsViewsTestCase):
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r["content-type"], "application/x-sqlite3")
 
+    def test_referral_records_download(self):
+        """Test that the referral records can be downloaded as a ZIP archive"""
+        upload_url = reverse("referral_record_upload", kwargs={"pk": self.ref.pk})
+        resp = self.client.post(upload_url, {"file": SimpleUploadedFile("file.txt", b"file_content")})
+        record = Record.objects.get(pk=resp.json()["object"]["id"])
+        url = reverse("referral_records_download", kwargs={"pk": self.ref.pk})
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["content-type"], "application/zip")
+        archive = zipfile.ZipFile(BytesIO(b"".join(resp.streaming_content)))
+        name = f"{record.pk}_{os.path.basename(record.uploaded_file.name)}"
+        self.assertEqual(archive.read(name), b"file_content")
+        # Filtering out every record redirects to the referral.
+        resp = self.client.get(url, {"type": "pdf"})
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.get(url, {"order_date__gte": "foo"})
+        self.assertEqual(resp.status_code, 400)
+
     def test_referral_deleted_redirect(self):
         """Test that the detail page for a deleted referral redirects to home"""
         url = self.ref.get_absolute_url()
@@ -248,6 +324,28 @@ class ReferralDetailTest(PrsViewsTestCase):
         resp = self.client.get(url)
         self.assertContains(resp, "Remove bookmark")
 
+    def test_conditional_get(self):
+        """Test that the referral detail page returns a 304 response if unchanged"""
+        task = Task.objects.first()
+        task.referral = self.ref
+        task.save()
+        url = self.ref.get_absolute_url()
+        resp = self.client.get(url)
+        etag = resp["ETag"]
+        self.assertTrue(resp.has_header("Last-Modified"))
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        # Changes to a child object invalidate the ETag.
+        task.description = "Updated description"
+        task.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        # So do changes to the referral tags.
+        etag = resp["ETag"]
+        self.ref.tags.add("Test tag")
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
 
 class ReferralCreateTest(PrsViewsTestCase):
     """Test the customised referral create view."""
@@ -1037,6 +1135,37 @@ class RecordUploadViewTest(PrsViewsTestCase):
         self.assertTrue(Location.objects.current().filter(referral=referral).count() > existing_location_count)
 
 
+class RecordDownloadTest(PrsViewsTestCase):
+    def setUp(self):
+        super(RecordDownloadTest, self).setUp()
+        referral = Referral.objects.first()
+        url = reverse("referral_record_upload", kwargs={"pk": referral.pk})
+        resp = self.client.post(url, {"file": SimpleUploadedFile("file.txt", b"file_content")})
+        self.record = Record.objects.get(pk=resp.json()["object"]["id"])
+        self.url = reverse("record_download", kwargs={"pk": self.record.pk})
+
+    def test_get(self):
+        """Test that a record file is streamed, with validators for conditional requests"""
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b"".join(resp.streaming_content), b"file_content")
+        self.assertEqual(resp["Accept-Ranges"], "bytes")
+        resp = self.client.get(self.url, headers={"If-None-Match": resp["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_get_range(self):
+        """Test that a byte range of a record file can be requested"""
+        resp = self.client.get(self.url, headers={"Range": "bytes=5-"})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp["Content-Range"], "bytes 5-11/12")
+        self.assertEqual(b"".join(resp.streaming_content), b"content")
+        # A range whose If-Range validator doesn't match returns the whole file.
+        resp = self.client.get(self.url, headers={"Range": "bytes=5-", "If-Range": '"foo"'})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get(self.url, headers={"Range": "bytes=100-"})
+        self.assertEqual(resp.status_code, 416)
+
+
 class ShapefileUploadViewTest(PrsViewsTestCase):
     def test_post(self):
         """Test POST response with a valid shapefile"""
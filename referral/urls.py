@@ -18,6 +18,7 @@ urlpatterns = [
     path("referrals/<int:pk>/upload-shapefile/", views.ShapefileUpload.as_view(), name="referral_shapefile_upload"),
     path("referrals/<int:pk>/locations/create/", views.LocationCreate.as_view(), name="referral_location_create"),
     path("referrals/<int:pk>/locations/download/", views.ReferralLocationDownload.as_view(), name="referral_location_download"),
+    path("referrals/<int:pk>/records/download/", views.ReferralRecordsDownload.as_view(), name="referral_records_download"),
     path("referrals/<int:pk>/tag/", PrsObjectTag.as_view(model=Referral), name="referral_tag"),
     path("referrals/<int:pk>/<str:related_model>/", views.ReferralDetail.as_view(), name="referral_detail"),
     path("referrals/<int:pk>/<str:model>/create/", views.ReferralCreateChild.as_view(), name="referral_create_child"),
@@ -41,6 +42,7 @@ urlpatterns += [
     path("tasks/<int:pk>/<str:action>/", views.TaskAction.as_view(), name="task_action"),
     path("conditions/<int:pk>/clearance/", views.ConditionClearanceCreate.as_view(), name="condition_clearance_add"),
     path("records/<int:pk>/infobase/", views.InfobaseShortcut.as_view(), name="infobase_shortcut"),
+    path("records/<int:pk>/download/", views.RecordDownload.as_view(), name="record_download"),
     path("records/<int:pk>/upload/", views.RecordUpload.as_view(), name="record_upload"),
 ]
 
@@ -1,33 +1,56 @@
+import hashlib
 import json
 import logging
+import os
 import re
-from datetime import date
+import time
+import zipfile
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
 from io import BytesIO
+from itertools import batched, chain
 from string import punctuation
-from typing import Any, Dict, List, Optional, Tuple, Union
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import docx2txt
+import magic
+import orjson
 import pyproj
 import requests
+from azure.core.exceptions import ResourceNotFoundError
 from dbca_utils.utils import env
 from django.apps import apps
 from django.conf import settings
 from django.contrib import admin
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.exceptions import ValidationError
 from django.core.mail import EmailMultiAlternatives
-from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Max, OuterRef, Q, Subquery
 from django.db.models.base import ModelBase
-from django.http import HttpRequest
+from django.db.models.functions import Greatest
+from django.http import HttpRequest, HttpResponse
+from django.urls import reverse
 from django.utils.encoding import smart_str
 from django.utils.safestring import mark_safe
 from extract_msg import Message
 from fiona.io import ZipMemoryFile
-from fudgeo.constant import WGS84
+from fudgeo import Field, GeoPackage
+from fudgeo.constant import SHAPE, WGS84
+from fudgeo.enumeration import GeometryType, SQLFieldType
+from fudgeo.geometry import Polygon
 from fudgeo.geopkg import SpatialReferenceSystem
 from pdfminer import high_level
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
 from reversion.models import Version
 from shapely import force_2d
 from shapely.geometry import shape
 from shapely.ops import transform
+from storages.backends.azure_storage import AzureStorage
 from unidecode import unidecode
 
 LOGGER = logging.getLogger("prs")
@@ -172,16 +195,107 @@ def filter_queryset(request: HttpRequest, model: ModelBase, queryset: Any) -> Tu
     return queryset, search_string
 
 
+def shared_cache_enabled() -> bool:
+    """Returns True if a cache server is configured (i.e. the default cache backend isn't a DummyCache)."""
+    return not isinstance(caches["default"], DummyCache)
+
+
+def get_user_context_version(user_pk: int) -> str:
+    """Returns the current version stamp for the cached context of the passed-in user.
+    The stamp combines a global version (bumped when any user's context may be stale) and a per-user version.
+    """
+    keys = ["prs:user_context_version", f"prs:user_context_version:{user_pk}"]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Initialise missing (or evicted) versions with a new value, so that stale cached contexts are never reused.
+            versions[key] = time.time_ns()
+            cache.add(key, versions[key], None)
+    return ".".join([str(versions[key]) for key in keys])
+
+
+def bump_user_context_version(user_pk: Optional[int] = None) -> None:
+    """Invalidate the cached context for the passed-in user, or for all users if no user is passed in."""
+    key = f"prs:user_context_version:{user_pk}" if user_pk else "prs:user_context_version"
+    cache.set(key, time.time_ns(), None)
+
+
+def get_user_context(request: HttpRequest) -> Dict[str, Any]:
+    """Returns a dict of the request user's PRS group capabilities and the PK of their last-opened referral.
+    The dict is memoised on the request and cached between requests, keyed on the user and a version stamp.
+    """
+    if hasattr(request, "_prs_user_context"):
+        return request._prs_user_context
+
+    user = request.user
+    key = f"prs:user_context:{user.pk}:{get_user_context_version(user.pk)}"
+    user_context = cache.get(key)
+    if user_context is None:
+        groups = set(user.groups.values_list("name", flat=True))
+        last_referral = user.userprofile.last_referral()
+        user_context = {
+            "prs_user": settings.PRS_USER_GROUP in groups,
+            "prs_power_user": settings.PRS_POWER_USER_GROUP in groups,
+            "last_referral_pk": last_referral.pk if last_referral else None,
+        }
+        cache.set(key, user_context, settings.USER_CONTEXT_CACHE_SECONDS)
+
+    request._prs_user_context = user_context
+    return user_context
+
+
+def get_cache_versions(keys: List[str]) -> List[int]:
+    """Returns the version stamps stored in the shared cache under the passed-in keys, initialising any missing."""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = time.time_ns()
+            cache.add(key, versions[key], None)
+    return [versions[key] for key in keys]
+
+
+def get_cache_version(key: str) -> int:
+    """Returns the version stamp stored in the shared cache under the passed-in key, initialising it if missing."""
+    return get_cache_versions([key])[0]
+
+
+def bump_cache_version(key: str) -> None:
+    """Invalidate everything cached against the version stamp stored under the passed-in key."""
+    cache.set(key, time.time_ns(), None)
+
+
+def get_model_version_key(model: ModelBase) -> str:
+    """Returns the cache key of the version stamp (generation counter) for the passed-in model, which is bumped
+    whenever an object of that model is changed. Lookup tables share the version stamp of their process-local cache.
+    """
+    manager = model._default_manager
+    if hasattr(manager, "get_cache_version_key"):
+        return manager.get_cache_version_key()
+    return f"prs:model_version:{model._meta.label_lower}"
+
+
+def get_tag_names() -> List[str]:
+    """Returns a sorted list of all tag names, cached until any tag is changed."""
+    from taggit.models import Tag
+
+    queryset = Tag.objects.order_by("name").values_list("name", flat=True)
+    if not shared_cache_enabled():
+        return list(queryset)
+
+    key = f"prs:tag_names:{get_cache_version(get_model_version_key(Tag))}"
+    names = cache.get(key)
+    if names is None:
+        names = list(queryset)
+        cache.set(key, names, settings.CHOICES_CACHE_SECONDS)
+    return names
+
+
 def is_prs_user(request: HttpRequest) -> bool:
-    if "PRS user" not in [group.name for group in request.user.groups.all()]:
-        return False
-    return True
+    return get_user_context(request)["prs_user"]
 
 
 def is_prs_power_user(request: HttpRequest) -> bool:
-    if "PRS power user" not in [group.name for group in request.user.groups.all()]:
-        return False
-    return True
+    return get_user_context(request)["prs_power_user"]
 
 
 def prs_user(request: HttpRequest) -> bool:
@@ -346,6 +460,96 @@ def get_next_pages(page_num: Any, count: int = 5) -> List[int]:
     return next_page_numbers
 
 
+def get_keyset_fields(model: ModelBase) -> Tuple[str, ...]:
+    """Returns the tuple of fields used to keyset-paginate querysets of the passed-in model:
+    (created, pk) for models having a creation timestamp, otherwise just (pk).
+    """
+    if "created" in [f.name for f in model._meta.get_fields()]:
+        return ("created", "pk")
+    return ("pk",)
+
+
+def encode_cursor(obj: Any, fields: Tuple[str, ...]) -> str:
+    """Encode the keyset field values of the passed-in object as an opaque, URL-safe cursor string."""
+    values = [getattr(obj, field) for field in fields]
+    values = [v.isoformat() if hasattr(v, "isoformat") else v for v in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, fields: Tuple[str, ...], model: ModelBase) -> List[Any]:
+    """Decode a cursor string generated by encode_cursor, converting each value to the type of its keyset field
+    on the passed-in model. Raises ValueError for an invalid cursor.
+    """
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    try:
+        values = [
+            (model._meta.pk if field == "pk" else model._meta.get_field(field)).to_python(value) for field, value in zip(fields, values)
+        ]
+    except (TypeError, ValueError, ValidationError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if None in values:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def keyset_paginate(
+    queryset: Any, fields: Tuple[str, ...], cursor: Optional[str] = None, limit: int = 50, descending: bool = True
+) -> Tuple[List[Any], Optional[str]]:
+    """Returns a page of up to `limit` objects from the passed-in queryset, ordered by `fields` (descending by default)
+    and following on from `cursor` (if supplied), plus the cursor for the following page (or None).
+    Unlike offset pagination, the cost of fetching a page doesn't increase with its depth in the results.
+    """
+    prefix, lookup = ("-", "lt") if descending else ("", "gt")
+    queryset = queryset.order_by(*[f"{prefix}{field}" for field in fields])
+
+    if cursor:
+        values = decode_cursor(cursor, fields, queryset.model)
+        # Row-wise comparison (f0, f1, ...) < (v0, v1, ...), expanded to:
+        # f0 < v0 OR (f0 = v0 AND f1 < v1) OR ...
+        # The leading f0 <= v0 condition lets the database use an index range scan.
+        # Ascending pages use the same comparisons, reversed.
+        after = Q()
+        for i, field in enumerate(fields):
+            q = Q(**{f"{field}__{lookup}": values[i]})
+            for prev_field, prev_value in zip(fields[:i], values[:i]):
+                q &= Q(**{prev_field: prev_value})
+            after |= q
+        queryset = queryset.filter(Q(**{f"{fields[0]}__{lookup}e": values[0]}), after)
+
+    # Fetch one extra object to determine if there's a following page.
+    objects = list(queryset[: limit + 1])
+    next_cursor = None
+    if len(objects) > limit:
+        objects = objects[:limit]
+        next_cursor = encode_cursor(objects[-1], fields)
+
+    return objects, next_cursor
+
+
+def annotate_last_modified(queryset: Any, relations: Tuple[str, ...] = ()) -> Any:
+    """Annotates each object in the queryset with `last_modified`: the latest `modified` timestamp of the object and
+    its related objects in each of the passed-in relations. Deleted related objects are included, because deleting
+    an object updates its `modified` timestamp.
+    """
+    expressions = [F("modified")]
+    for name in relations:
+        field = queryset.model._meta.get_field(name)
+        # Reverse relations filter on the related model's field; forward many-to-many relations on their related query name.
+        query_name = field.field.name if field.auto_created else field.related_query_name()
+        latest = field.related_model.objects.filter(**{query_name: OuterRef("pk")}).order_by().values(query_name)
+        expressions.append(Subquery(latest.annotate(latest=Max("modified")).values("latest")))
+
+    if len(expressions) == 1:
+        return queryset.annotate(last_modified=expressions[0])
+    # NOTE: PostgreSQL GREATEST ignores NULL values (objects having no related objects).
+    return queryset.annotate(last_modified=Greatest(*expressions))
+
+
 def get_uploaded_file_content(record: Any) -> Optional[str]:
     """Convenience function that takes in a Record object and returns the uploaded file's text content (for a given set of file types)."""
     if not record.pk or not record.extension or record.extension not in ["PDF", "MSG", "DOCX", "TXT"]:
@@ -679,3 +883,292 @@ SRS_WKT = """GEOGCS["WGS 84",
 
 def get_srs_wgs84() -> SpatialReferenceSystem:
     return SpatialReferenceSystem(name="WGS 84", organization="EPSG", org_coord_sys_id=WGS84, definition=SRS_WKT)
+
+
+def get_json_encoder() -> str:
+    """Returns the name of the JSON encoder in use, as set by the JSON_ENCODER setting: "orjson"
+    (the default) or "stdlib".
+    """
+    if settings.JSON_ENCODER == "orjson":
+        return "orjson"
+    return "stdlib"
+
+
+def json_dumps(obj: Any, encoder: Optional[str] = None) -> bytes:
+    """Serialises the passed-in object to JSON bytes, using the passed-in encoder name (default: the result
+    of get_json_encoder()). Both encoders defer to DjangoJSONEncoder for types that they don't support
+    natively (dates, times, decimals, lazy strings), so that their output is equivalent.
+    """
+    if (encoder or get_json_encoder()) == "orjson":
+        return orjson.dumps(
+            obj,
+            default=DjangoJSONEncoder().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(obj, cls=DjangoJSONEncoder).encode()
+
+
+class FastJsonResponse(HttpResponse):
+    """A drop-in replacement for JsonResponse which encodes the passed-in data using json_dumps().
+    By default only dict objects are allowed to be passed due to a security flaw before ECMAScript 5
+    (the same as JsonResponse); set the ``safe`` parameter to False to allow any object.
+    """
+
+    def __init__(self, data: Any, safe: bool = True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=json_dumps(data), **kwargs)
+
+
+def polygon_feature(poly, properties: Dict[str, Any], id: Optional[int] = None) -> Dict[str, Any]:
+    """Returns a GeoJSON Feature dict for the passed-in polygon geometry and properties."""
+    feature = {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": poly.coords},
+        "properties": properties,
+    }
+    if id is not None:
+        feature["id"] = id
+    return feature
+
+
+def locations_geojson(locations) -> str:
+    """Returns a GeoJSON FeatureCollection string of the passed-in Location objects having a polygon,
+    for display on a map.
+    """
+    features = [
+        polygon_feature(loc.poly, {"referral": loc.referral_id, "address_string": loc.address_string, "pk": str(loc.pk)}, loc.pk)
+        for loc in locations
+        if loc.poly
+    ]
+    return json_dumps(
+        {
+            "type": "FeatureCollection",
+            "crs": {"type": "name", "properties": {"name": "EPSG:4283"}},
+            "features": features,
+        }
+    ).decode()
+
+
+# Attributes of exported referral locations, in the order written to each feature.
+LOCATION_EXPORT_FIELDS = ("referral", "referral_type", "referral_reference", "referring_org", "source_url")
+
+
+def get_location_export_rows(locations, source_url: Optional[str] = None) -> Iterator[Tuple]:
+    """Generator that yields a tuple (polygon, referral ID, referral type, referral reference, referring org,
+    source URL) for each of the passed-in queryset of Locations having a polygon, fetched in chunks from a
+    single query joining the referral attributes. The source URL defaults to the URL of each referral.
+    """
+    urls = {}
+    rows = locations.filter(poly__isnull=False).values_list(
+        "poly",
+        "referral_id",
+        "referral__type__name",
+        "referral__reference",
+        "referral__referring_org__name",
+    )
+    for poly, referral_id, *values in rows.iterator(chunk_size=settings.REPORT_CHUNK_SIZE):
+        if source_url:
+            url = source_url
+        else:
+            if referral_id not in urls:
+                path = reverse("prs_object_detail", kwargs={"model": "referrals", "pk": referral_id})
+                urls[referral_id] = settings.SITE_URL + path
+            url = urls[referral_id]
+        yield (poly, referral_id, *values, url)
+
+
+def write_locations_gpkg(path: str, rows: Iterable[Tuple]) -> int:
+    """Creates a GeoPackage at the passed-in path, writes the passed-in location export rows (as yielded by
+    get_location_export_rows) to a prs_locations layer in batches, and returns the number of features written.
+    """
+    gpkg = GeoPackage.create(path, flavor="EPSG")
+    gpkg.create_feature_class(
+        name="prs_locations",
+        srs=get_srs_wgs84(),
+        shape_type=GeometryType.polygon,
+        fields=[
+            Field("referral_id", SQLFieldType.integer),
+            Field("referral_type", SQLFieldType.text),
+            Field("referral_reference", SQLFieldType.text),
+            Field("referring_org", SQLFieldType.text),
+            Field("source_url", SQLFieldType.text),
+        ],
+        geom_name=SHAPE,
+        spatial_index=True,
+        overwrite=True,
+    )
+    sql = """INSERT INTO prs_locations (SHAPE, referral_id, referral_type, referral_reference, referring_org, source_url)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+    count = 0
+    conn = gpkg.connection
+    for batch in batched(rows, settings.REPORT_CHUNK_SIZE):
+        conn.executemany(sql, [(Polygon(coordinates=poly.coords, srs_id=WGS84), *values) for poly, *values in batch])
+        count += len(batch)
+    conn.commit()
+    conn.close()
+    return count
+
+
+def stream_locations_geojsonl(rows: Iterable[Tuple]) -> Iterator[bytes]:
+    """Generator that yields newline-delimited GeoJSON Features for the passed-in location export rows
+    (as yielded by get_location_export_rows), one feature per line.
+    """
+    for poly, *values in rows:
+        yield json_dumps(polygon_feature(poly, dict(zip(LOCATION_EXPORT_FIELDS, values)))) + b"\n"
+
+
+def iter_stored_file(field_file, chunk_size: int = 1024 * 1024, offset: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+    """Generator that yields the content of the passed-in stored file (e.g. a FieldFile) in chunks,
+    optionally starting from a byte offset and limited to a number of bytes.
+    Azure blobs are downloaded in chunks directly, because opening an Azure storage file downloads the
+    whole blob to a temporary file first.
+    """
+    storage = field_file.storage
+    if isinstance(storage, AzureStorage):
+        stream = storage.client.download_blob(
+            storage._get_valid_path(field_file.name), offset=offset, length=length, timeout=storage.timeout
+        )
+        yield from stream.chunks()
+    else:
+        with storage.open(field_file.name, "rb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+def get_stored_file_properties(field_file) -> Tuple[int, datetime]:
+    """Returns a tuple (size in bytes, last modified datetime) for the passed-in stored file (e.g. a FieldFile),
+    using a single request for Azure blobs.
+    """
+    storage = field_file.storage
+    if isinstance(storage, AzureStorage):
+        try:
+            properties = storage.client.get_blob_client(storage._get_valid_path(field_file.name)).get_blob_properties()
+        except ResourceNotFoundError:
+            raise FileNotFoundError(field_file.name)
+        return properties.size, properties.last_modified
+    return storage.size(field_file.name), storage.get_modified_time(field_file.name)
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parses an HTTP Range request header for a single byte range of a file of the passed-in size, and
+    returns a tuple (first byte, last byte) of the range. Returns None for a missing, invalid or multiple
+    range header (the whole file should be returned). Raises ValueError for an unsatisfiable range.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes of the file.
+        if int(last) == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError("Unsatisfiable range")
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+class ZipStream:
+    """A write-only file-like object which holds the data written to it until it is taken.
+    Used to write a ZIP archive to a streaming response (zipfile supports unseekable output).
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    """Generator that yields a ZIP archive of the passed-in (filename, content chunks) pairs, as each chunk
+    is compressed. Neither the files nor the archive are held in memory or on disk. A file which can't be
+    read is logged and left out of the archive. A file which fails partway through being read is logged,
+    and its entry is closed with the content read so far (the entry header has already been sent), so that
+    the archive remains valid.
+    """
+    output = ZipStream()
+    with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in files:
+            chunks = iter(chunks)
+            # Read the first chunk before writing the file header, so that a missing file can be skipped.
+            try:
+                first = next(chunks, b"")
+            except Exception:
+                LOGGER.exception(f"Error reading {name} for ZIP archive")
+                continue
+            with archive.open(name, mode="w", force_zip64=True) as entry:
+                try:
+                    for chunk in chain([first], chunks):
+                        entry.write(chunk)
+                        yield output.take()
+                except Exception:
+                    LOGGER.exception(f"Error reading {name} for ZIP archive, the archived file is incomplete")
+            yield output.take()
+    yield output.take()
+
+
+def get_file_metadata(field_file) -> Dict[str, Any]:
+    """Reads the passed-in file (e.g. a Record's FieldFile, either a new upload or a stored file) once, and
+    returns a dict of its metadata: file_size, file_hash (SHA-256), mime_type, page_count (PDF files only)
+    and message_date (the sent date of MSG files only). The file content is spooled to a temporary file
+    (held in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE bytes, then on disk) while it is read.
+    """
+    if getattr(field_file, "_committed", True):
+        chunks = iter_stored_file(field_file)
+    else:
+        # A new upload, not yet saved to storage.
+        field_file.open("rb")
+        chunks = field_file.chunks()
+
+    digest = hashlib.sha256()
+    size = 0
+    with SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as tmp:
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            tmp.write(chunk)
+        if not getattr(field_file, "_committed", True):
+            field_file.seek(0)  # Rewind the upload, so that it can be saved to storage.
+
+        tmp.seek(0)
+        metadata = {
+            "file_size": size,
+            "file_hash": digest.hexdigest(),
+            "mime_type": magic.from_buffer(tmp.read(2048), mime=True),
+            "page_count": None,
+            "message_date": None,
+        }
+        extension = os.path.splitext(field_file.name)[1].upper()
+        try:
+            if extension == ".PDF":
+                tmp.seek(0)
+                document = PDFDocument(PDFParser(tmp))
+                metadata["page_count"] = resolve1(document.catalog["Pages"])["Count"]
+            elif extension == ".MSG":
+                tmp.seek(0)
+                metadata["message_date"] = Message(tmp).date
+        except Exception:
+            LOGGER.warning(f"Unable to read the content of {field_file.name}")
+    return metadata
@@ -1,4 +1,6 @@
 import json
+import mimetypes
+import os
 import re
 from copy import copy
 from datetime import date, datetime, timedelta
@@ -11,14 +13,22 @@ from django.contrib.auth.models import Group
 from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Point
 from django.core.mail import EmailMultiAlternatives
 from django.core.paginator import Paginator
-from django.core.serializers import serialize
 from django.db.models import F, Q
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
 from django.utils.safestring import mark_safe
 from django.views.generic import FormView, ListView, TemplateView, View
-from extract_msg import Message
 from indexer.utils import get_typesense_client
 from referral.forms import (
     ClearanceCreateForm,
@@ -53,13 +63,20 @@ from referral.models import (
     TaskType,
 )
 from referral.utils import (
+    FastJsonResponse,
     breadcrumbs_li,
+    get_stored_file_properties,
+    get_tag_names,
     is_model_or_string,
     is_prs_power_user,
+    iter_stored_file,
+    locations_geojson,
+    parse_range_header,
     parse_shapefile,
     prs_user,
     query_geocoder,
     smart_truncate,
+    stream_zip,
     wfs_getfeature,
 )
 from referral.views_base import PrsObjectCreate, PrsObjectDelete, PrsObjectDetail, PrsObjectList, PrsObjectUpdate
@@ -73,7 +90,12 @@ class SiteHome(LoginRequiredMixin, ListView):
     printable = False
 
     def get_queryset(self):
-        qs = Task.objects.current().filter(assigned_user=self.request.user)
+        # Select related objects rendered in each row, so that the query count doesn't scale with the number of tasks.
+        qs = (
+            Task.objects.current()
+            .filter(assigned_user=self.request.user)
+            .select_related("type", "state", "referral__referring_org", "referral__type")
+        )
         if self.stopped_tasks:
             qs = qs.filter(state__name="Stopped").order_by("stop_date")
         else:
@@ -402,7 +424,7 @@ class ReferralCreate(PrsObjectCreate):
         context["title"] = "CREATE A NEW REFERRAL"
         context["page_title"] = "PRS | Referrals | Create"
         # Pass in a serialised list of tag names.
-        context["tags"] = json.dumps([t.name for t in Tag.objects.all().order_by("name")])
+        context["tags"] = json.dumps(get_tag_names())
         return context
 
     def get_initial(self):
@@ -410,8 +432,8 @@ class ReferralCreate(PrsObjectCreate):
         initial["assigned_user"] = self.request.user
         try:
             initial["referring_org"] = Organisation.objects.current().get(name__iexact="western australian planning commission")
-            initial["task_type"] = TaskType.objects.get(name="Assess a referral")
-            initial["agency"] = Agency.objects.get(code="DBCA")
+            initial["task_type"] = TaskType.objects.get_cached(name="Assess a referral")
+            initial["agency"] = Agency.objects.get_cached(code="DBCA")
         except Exception:
             initial["referring_org"] = Organisation.objects.current()[0]
             initial["task_type"] = TaskType.objects.all()[0]
@@ -556,8 +578,9 @@ class ReferralDetail(PrsObjectDetail):
                 context[obj_list] = None
 
         # Add child locations serialised as GeoJSON (if geometry exists).
-        if any([loc.poly for loc in ref.location_set.current()]):
-            context["geojson_locations"] = serialize("geojson", ref.location_set.current(), geometry_field="poly", srid=4283)
+        locations = [loc for loc in ref.location_set.current() if loc.poly]
+        if locations:
+            context["geojson_locations"] = locations_geojson(locations)
 
         context["has_conditions"] = ref.condition_set.exists()
         return context
@@ -802,7 +825,7 @@ class ReferralCreateChild(PrsObjectCreate):
         for i in form.cleaned_data["conditions"]:
             condition = Condition.objects.get(pk=i)
             clearance_task = Task()
-            clearance_task.type = TaskType.objects.get(name="Conditions clearance request")
+            clearance_task.type = TaskType.objects.get_cached(name="Conditions clearance request")
             clearance_task.referral = condition.referral
             clearance_task.assigned_user = form.cleaned_data["assigned_user"]
             clearance_task.start_date = form.cleaned_data["start_date"]
@@ -882,7 +905,7 @@ class ReferralCreateChild(PrsObjectCreate):
         ]:
             obj.due_date = date.today()
             obj.complete_date = date.today()
-            obj.state = TaskState.objects.get(name="Complete")
+            obj.state = TaskState.objects.get_cached(name="Complete")
 
         obj.save()
 
@@ -929,8 +952,9 @@ class LocationCreate(ReferralCreateChild):
         context["title"] = "CREATE LOCATION(S)"
         context["address"] = referral.address
         # Add any existing referral locations serialised as GeoJSON.
-        if any([loc.poly for loc in referral.location_set.current()]):
-            context["geojson_locations"] = serialize("geojson", referral.location_set.current(), geometry_field="poly", srid=4283)
+        locations = [loc for loc in referral.location_set.current() if loc.poly]
+        if locations:
+            context["geojson_locations"] = locations_geojson(locations)
         return context
 
     def get_success_url(self):
@@ -1235,12 +1259,11 @@ class RecordUpload(LoginRequiredMixin, View):
                 creator=request.user,
                 modifier=request.user,
             )
+            new_record.set_file_metadata()
 
             # *.msg files only: set order_date to the sent date of the uploaded email message.
-            if new_record.extension == "MSG":
-                msg = Message(new_record.uploaded_file)
-                if msg.date:
-                    new_record.order_date = msg.date
+            if new_record.message_date:
+                new_record.order_date = new_record.message_date.date()
 
             new_record.save()
             messages.success(self.request, f"Upload processed and saved as {new_record}")
@@ -1255,12 +1278,11 @@ class RecordUpload(LoginRequiredMixin, View):
             record = self.get_parent_object()
             record.uploaded_file = uploaded_file
             record.modifier = request.user
+            record.set_file_metadata()
 
             # *.msg files only: set order_date to the sent date of the uploaded email message.
-            if record.extension == "MSG":
-                msg = Message(record.uploaded_file)
-                if msg.date:
-                    record.order_date = msg.date
+            if record.message_date:
+                record.order_date = record.message_date.date()
 
             record.save()
             messages.success(self.request, f"Upload processed and saved to {record}")
@@ -1381,7 +1403,7 @@ class TaskAction(PrsObjectUpdate):
         context["breadcrumb_trail"] = breadcrumbs_li(links)
         context["title"] = action.upper() + " TASK"
         # Pass in a serialised list of tag names.
-        context["tags"] = json.dumps([t.name for t in Tag.objects.all().order_by("name")])
+        context["tags"] = json.dumps(get_tag_names())
         return context
 
     def get_success_url(self):
@@ -1402,7 +1424,7 @@ class TaskAction(PrsObjectUpdate):
         # This is where custom logic for the different actions takes place (if required).
         if action == "stop":
             obj.stop_date = d["stopped_date"]
-            obj.state = TaskState.objects.all().get(name="Stopped")
+            obj.state = TaskState.objects.get_cached(name="Stopped")
             obj.restart_date = None
         elif action == "start":
             obj.state = obj.type.initial_state
@@ -1410,7 +1432,7 @@ class TaskAction(PrsObjectUpdate):
         elif action == "inherit":
             obj.assigned_user = self.request.user
         elif action == "cancel":
-            obj.state = TaskState.objects.all().get(name="Cancelled")
+            obj.state = TaskState.objects.get_cached(name="Cancelled")
             obj.complete_date = datetime.now()
         elif action == "reassign":
             if self.request.POST.get("email_user"):
@@ -1473,10 +1495,11 @@ class ReferralRecent(PrsObjectList):
     template_name = "referral/referral_recent.html"
 
     def get_queryset(self):
-        if not self.request.user.userprofile.referral_history_array:
+        history = self.request.user.userprofile.get_referral_history()
+        if not history:
             return Referral.objects.none()
 
-        return Referral.objects.current().filter(pk__in=self.request.user.userprofile.referral_history_array)
+        return Referral.objects.current().filter(pk__in=history)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1508,7 +1531,8 @@ class ReferralReferenceSearch(PrsObjectList):
     def get_queryset(self):
         object_count = 0
         q = self.request.GET.get("q")
-        queryset = Referral.objects.current().filter(Q(reference__contains=q))
+        # Case-insensitive match, so that the query can use the reference trigram index.
+        queryset = Referral.objects.current().filter(reference__icontains=q)
         object_count = queryset.count()
         # If we have a lot of results, slice and return the first twenty only.
         if object_count > 20:
@@ -1539,7 +1563,7 @@ class ReferralPointSearch(LoginRequiredMixin, View):
             return HttpResponseBadRequest("Bad request")
 
         locations = Location.objects.current().filter(poly__intersects=Point(x, y)).distinct()
-        referrals = Referral.objects.current().filter(pk__in=[loc.referral.pk for loc in locations]).distinct()
+        referrals = Referral.objects.current().filter(pk__in=[loc.referral_id for loc in locations]).select_related("type").distinct()
         resp = [
             {
                 "id": referral.pk,
@@ -1551,7 +1575,7 @@ class ReferralPointSearch(LoginRequiredMixin, View):
             for referral in referrals
         ]
 
-        return JsonResponse(resp, safe=False)
+        return FastJsonResponse(resp, safe=False)
 
 
 class TagList(PrsObjectList):
@@ -1810,6 +1834,47 @@ class ReferralLocationDownload(LoginRequiredMixin, View):
             return resp
 
 
+class ReferralRecordsDownload(LoginRequiredMixin, View):
+    """Basic view to return a ZIP archive of a referral's current records as a download. The archive is
+    streamed to the client as each file is read from storage in chunks.
+    Records may be filtered by the `type` (file extension), `order_date__gte` and `order_date__lte` request
+    parameters.
+    """
+
+    http_method_names = ["get"]
+
+    def get(self, request, *args, **kwargs):
+        referral = get_object_or_404(Referral, pk=self.kwargs["pk"])
+
+        # Deleted? Redirect home.
+        if referral.is_deleted():
+            messages.warning(self.request, f"Referral {referral.pk} not found.")
+            return HttpResponseRedirect(reverse("site_home"))
+
+        records = referral.record_set.current().exclude(Q(uploaded_file="") | Q(uploaded_file__isnull=True))
+        try:
+            if request.GET.get("type"):
+                records = records.filter(uploaded_file__iendswith=f".{request.GET['type']}")
+            for lookup in ["order_date__gte", "order_date__lte"]:
+                if request.GET.get(lookup):
+                    records = records.filter(**{lookup: date.fromisoformat(request.GET[lookup])})
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
+        records = list(records.order_by("pk").only("pk", "uploaded_file"))
+
+        # No records? Redirect to the referral detail view.
+        if not records:
+            return HttpResponseRedirect(referral.get_absolute_url())
+
+        # Prefix each filename with the record ID, as filenames aren't unique.
+        files = (
+            (f"{record.pk}_{os.path.basename(record.uploaded_file.name)}", iter_stored_file(record.uploaded_file)) for record in records
+        )
+        resp = StreamingHttpResponse(stream_zip(files), content_type="application/zip")
+        resp["Content-Disposition"] = f'attachment; filename="prs_referral_{referral.pk}_records.zip"'
+        return resp
+
+
 class ConditionClearanceCreate(PrsObjectCreate):
     """
     View to add a clearance request to a single condition object.
@@ -1866,7 +1931,7 @@ class ConditionClearanceCreate(PrsObjectCreate):
     def form_valid(self, form):
         obj = self.get_object()
         clearance_task = form.save(commit=False)
-        clearance_task.type = TaskType.objects.get(name="Conditions clearance request")
+        clearance_task.type = TaskType.objects.get_cached(name="Conditions clearance request")
         clearance_task.referral = obj.referral
         clearance_task.state = clearance_task.type.initial_state
         if form.cleaned_data["due_date"]:
@@ -1942,6 +2007,64 @@ class InfobaseShortcut(LoginRequiredMixin, View):
             return HttpResponseRedirect(record.get_absolute_url())
 
 
+class RecordDownload(LoginRequiredMixin, View):
+    """View to return a record's uploaded file, streamed from storage in chunks (rather than linking to
+    storage directly, which for Azure requires a signed URL per link rendered). Supports conditional
+    requests and single HTTP byte ranges, so that large downloads can be resumed.
+    """
+
+    http_method_names = ["get", "head"]
+
+    def get(self, request, *args, **kwargs):
+        record = get_object_or_404(Record.objects.current(), pk=self.kwargs["pk"])
+        if not record.uploaded_file:
+            raise Http404("Record file not found")
+        try:
+            size, modified = get_stored_file_properties(record.uploaded_file)
+        except FileNotFoundError:
+            raise Http404("Record file not found")
+
+        timestamp = int(modified.timestamp())
+        etag = quote_etag(f"{record.pk}-{size}-{timestamp}")
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response:  # Not modified, or precondition failed.
+            response["ETag"] = etag
+            return response
+
+        # Ignore the Range header if an If-Range validator doesn't match the current file.
+        if_range = request.headers.get("If-Range")
+        try:
+            if if_range and if_range not in [etag, http_date(timestamp)]:
+                byte_range = None
+            else:
+                byte_range = parse_range_header(request.headers.get("Range"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        first, last = byte_range or (0, size - 1)
+        length = last - first + 1
+
+        if request.method == "HEAD":
+            content = []
+        else:
+            content = iter_stored_file(record.uploaded_file, offset=first, length=length)
+        filename = os.path.basename(record.uploaded_file.name)
+        response = StreamingHttpResponse(
+            content,
+            status=206 if byte_range else 200,
+            content_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        )
+        response["Content-Length"] = length
+        if byte_range:
+            response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(timestamp)
+        response["Content-Disposition"] = content_disposition_header(False, filename)
+        return response
+
+
 class CadastreQuery(LoginRequiredMixin, View):
     """Basic view endpoint to send a CQL filter query to the Cadastre spatial service."""
 
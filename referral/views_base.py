@@ -1,21 +1,40 @@
 import json
+from hashlib import md5
 from urllib.parse import urlparse
 
+from django.apps import apps
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin import site
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.serializers import serialize
+from django.contrib.auth.models import User
 from django.db.models import F
 from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import redirect
 from django.template.defaultfilters import slugify
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, UpdateView, View
 from referral.forms import FORMS_MAP
-from referral.utils import breadcrumbs_li, get_next_pages, get_previous_pages, get_query, is_model_or_string, prs_user
+from referral.utils import (
+    annotate_last_modified,
+    breadcrumbs_li,
+    get_cache_versions,
+    get_keyset_fields,
+    get_model_version_key,
+    get_next_pages,
+    get_previous_pages,
+    get_query,
+    get_tag_names,
+    get_user_context_version,
+    is_model_or_string,
+    keyset_paginate,
+    locations_geojson,
+    prs_user,
+    shared_cache_enabled,
+)
 from reversion.models import Version
-from taggit.models import Tag
 
 
 class PrsObjectList(LoginRequiredMixin, ListView):
@@ -26,6 +45,8 @@ class PrsObjectList(LoginRequiredMixin, ListView):
     paginate_by = 20
     template_name = "referral/prs_object_list.html"
     http_method_names = ["get", "head", "options"]
+    cursor = None
+    next_cursor = None
 
     def dispatch(self, request, *args, **kwargs):
         # kwargs must include a Model class, or a string.
@@ -36,12 +57,31 @@ class PrsObjectList(LoginRequiredMixin, ListView):
             return HttpResponseBadRequest("Bad request")
         return super().dispatch(request, *args, **kwargs)
 
+    def paginate_queryset(self, queryset, page_size):
+        """If a ``cursor`` query parameter is passed in (an empty value requests the first page),
+        use keyset pagination instead of the default offset pagination.
+        """
+        if "cursor" not in self.request.GET or not hasattr(queryset, "order_by"):
+            return super().paginate_queryset(queryset, page_size)
+
+        self.cursor = self.request.GET["cursor"]
+        try:
+            objects, self.next_cursor = keyset_paginate(queryset, get_keyset_fields(self.model), self.cursor, page_size)
+        except ValueError:
+            raise Http404("Invalid cursor")
+        return (None, None, objects, bool(self.cursor or self.next_cursor))
+
     def get_queryset(self):
         """Define the queryset of objects to return."""
         qs = super().get_queryset()
         # By default, filter out "inactive" objects.
         if "effective_to" in [f.name for f in self.model._meta.get_fields()]:
             qs = qs.filter(effective_to=None)
+        # Fetch any related objects used to render each row.
+        if getattr(self.model, "list_select_related", None):
+            qs = qs.select_related(*self.model.list_select_related)
+        if getattr(self.model, "list_prefetch_related", None):
+            qs = qs.prefetch_related(*self.model.list_prefetch_related)
         # Did we pass in a search string? If so, filter the queryset and return it.
         if "q" in self.request.GET and self.request.GET["q"]:
             query_str = self.request.GET["q"]
@@ -71,7 +111,16 @@ class PrsObjectList(LoginRequiredMixin, ListView):
         context["page_title"] = " | ".join([settings.APPLICATION_ACRONYM, title])
         links = [(reverse("site_home"), "Home"), (None, title)]
         context["breadcrumb_trail"] = breadcrumbs_li(links)
-        context["object_count"] = self.get_queryset().count()
+        if context["paginator"]:
+            # The paginator caches its count, so don't query the database a second time.
+            context["object_count"] = context["paginator"].count
+        elif self.cursor is not None:
+            context["cursor_pagination"] = True
+            context["next_cursor"] = self.next_cursor
+            # Only count results for the first page, so that following pages are constant-time.
+            context["object_count"] = None if self.cursor else self.object_list.count()
+        else:
+            context["object_count"] = len(context["object_list"])
         context["previous_pages"] = get_previous_pages(context["page_obj"])
         context["next_pages"] = get_next_pages(context["page_obj"])
         return context
@@ -180,6 +229,62 @@ class PrsObjectDetail(LoginRequiredMixin, DetailView):
             self.model = is_model_or_string(kwargs["model"])
         return super().dispatch(request, *args, **kwargs)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if any(f.name == "modified" for f in self.model._meta.fields):
+            queryset = annotate_last_modified(queryset, getattr(self.model, "last_modified_relations", ()))
+        return queryset
+
+    def get_object(self, queryset=None):
+        # The object is requested several times per response; only query for it once.
+        if queryset is None and getattr(self, "object", None) is not None:
+            return self.object
+        self.object = super().get_object(queryset)
+        return self.object
+
+    def get_validators(self):
+        """Returns a tuple (ETag, last modified timestamp) for the response, derived from the last modified timestamp
+        of the object and its child objects. Detail pages include user-specific content, so the ETag also includes
+        the request user and the version of their cached context. Detail pages also show lookup names (e.g. type,
+        region) and the names of other users, so the ETag includes the version stamps of those models too.
+        """
+        from referral.models import ReferralLookup
+
+        last_modified = getattr(self.object, "last_modified", None)
+        if last_modified is None:
+            return None, None
+        user = self.request.user
+        if shared_cache_enabled():
+            user_version = get_user_context_version(user.pk)
+            models = [model for model in apps.get_app_config("referral").get_models() if issubclass(model, ReferralLookup)]
+            model_versions = get_cache_versions([get_model_version_key(model) for model in models + [User]])
+        else:
+            user_version, model_versions = "", ""
+        etag = md5(
+            f"{settings.APPLICATION_VERSION_NO}:{self.model._meta.label_lower}:{self.object.pk}:{last_modified.isoformat()}:{user.pk}:{user_version}:{model_versions}".encode()
+        ).hexdigest()
+        return f'"{etag}"', int(last_modified.timestamp())
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        etag, last_modified = self.get_validators()
+
+        # Return a 304 response if the client's copy is current (unless there are pending messages to render).
+        if etag and not len(messages.get_messages(request)):
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+        context = self.get_context_data(object=self.object)
+        response = self.render_to_response(context)
+        if etag:
+            response.headers["ETag"] = etag
+            response.headers["Last-Modified"] = http_date(last_modified)
+            # Clients must revalidate their copy on every request.
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ["Cookie"])
+        return response
+
     def get_context_data(self, **kwargs):
         from referral.models import Location, Note, Record, Task
 
@@ -252,7 +357,7 @@ class PrsObjectDetail(LoginRequiredMixin, DetailView):
         if self.model == Location:
             # Add child locations serialised as GeoJSON (if geometry exists).
             if obj and obj.poly:
-                context["geojson_locations"] = serialize("geojson", [obj], geometry_field="poly", srid=4283)
+                context["geojson_locations"] = locations_geojson([obj])
         return context
 
 
@@ -308,7 +413,7 @@ class PrsObjectUpdate(LoginRequiredMixin, UpdateView):
         )
         # If the model type uses tags, pass in a serialised list of tag names.
         if hasattr(self.model, "tags"):
-            context["tags"] = json.dumps([t.name for t in Tag.objects.all()])
+            context["tags"] = json.dumps(get_tag_names())
         return context
 
     def post(self, request, *args, **kwargs):
@@ -0,0 +1,49 @@
+from django.contrib import admin
+from reports.models import ReferralSummary, Report, ReportDefinition, SummaryRefresh, TaskSummary
+from reports.tasks import generate_report
+
+
+class ReportAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "definition", "model", "status", "row_count", "created", "completed")
+    list_filter = ("model", "status", "definition")
+    raw_id_fields = ("user",)
+    date_hierarchy = "created"
+    search_fields = ("user__username", "user__first_name", "user__last_name")
+
+
+class ReportDefinitionAdmin(admin.ModelAdmin):
+    list_display = ("name", "model", "query", "active")
+    list_filter = ("model", "active")
+    search_fields = ("name",)
+    actions = ["generate_snapshots"]
+
+    @admin.action(description="Generate a snapshot of the selected reports now")
+    def generate_snapshots(self, request, queryset):
+        for definition in queryset:
+            report = Report.objects.create(definition=definition, model=definition.model, query=definition.query)
+            generate_report.delay_on_commit(report.pk)
+        self.message_user(request, f"Queued {queryset.count()} report(s)")
+
+
+class SummaryAdmin(admin.ModelAdmin):
+    list_filter = ("region",)
+    date_hierarchy = "month"
+
+
+class ReferralSummaryAdmin(SummaryAdmin):
+    list_display = ("month", "region", "referral_type", "referral_count")
+
+
+class TaskSummaryAdmin(SummaryAdmin):
+    list_display = ("month", "region", "task_type", "completed_count", "overdue_count", "stop_time_total")
+
+
+class SummaryRefreshAdmin(admin.ModelAdmin):
+    list_display = ("created", "watermark", "full", "months")
+
+
+admin.site.register(Report, ReportAdmin)
+admin.site.register(ReportDefinition, ReportDefinitionAdmin)
+admin.site.register(ReferralSummary, ReferralSummaryAdmin)
+admin.site.register(TaskSummary, TaskSummaryAdmin)
+admin.site.register(SummaryRefresh, SummaryRefreshAdmin)
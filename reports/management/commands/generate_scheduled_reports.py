@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from reports.models import Report, ReportDefinition
+from reports.tasks import generate_report
+
+
+class Command(BaseCommand):
+    help = "Queues a snapshot of each active scheduled report definition to be generated by a Celery task"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--name",
+            action="store",
+            dest="name",
+            help="Name of a single report definition to generate",
+        )
+
+    def handle(self, *args, **options):
+        definitions = ReportDefinition.objects.filter(active=True)
+        if options["name"]:
+            definitions = definitions.filter(name=options["name"])
+            if not definitions:
+                raise CommandError(f"No active report definition named {options['name']}")
+
+        for definition in definitions:
+            report = Report.objects.create(definition=definition, model=definition.model, query=definition.query)
+            generate_report.delay(report.pk)
+            self.stdout.write(f"Queued report {report.pk} ({definition})")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from reports.utils import refresh_summaries
+
+
+class Command(BaseCommand):
+    help = "Refreshes the reporting summary tables (incrementally, by default)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            dest="full",
+            help="Recalculate all months, rather than only those containing modified objects",
+        )
+
+    def handle(self, *args, **options):
+        refresh = refresh_summaries(full=options["full"])
+        self.stdout.write(f"Refreshed {refresh.months} month(s) of summaries")
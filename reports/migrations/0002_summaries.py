@@ -0,0 +1,58 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0012_modified_indexes'),
+        ('reports', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryRefresh',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.DateTimeField(help_text='Objects modified before this time are included in the refresh.')),
+                ('full', models.BooleanField(default=False)),
+                ('months', models.PositiveIntegerField(default=0, help_text='The number of months recalculated.')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferralSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='The first day of the month.')),
+                ('referral_count', models.PositiveIntegerField(default=0)),
+                ('referral_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='referral.referraltype')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='referral.region')),
+            ],
+            options={
+                'verbose_name_plural': 'referral summaries',
+                'ordering': ['month', 'region', 'referral_type'],
+                'indexes': [models.Index(fields=['month', 'region'], name='idx_refsummary_month_region')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TaskSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='The first day of the month.')),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('overdue_count', models.PositiveIntegerField(default=0)),
+                ('stop_time_total', models.IntegerField(default=0)),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='referral.region')),
+                ('task_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='referral.tasktype')),
+            ],
+            options={
+                'verbose_name_plural': 'task summaries',
+                'ordering': ['month', 'region', 'task_type'],
+                'indexes': [models.Index(fields=['month', 'region'], name='idx_tasksummary_month_region')],
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0003_report_definitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='format',
+            field=models.CharField(choices=[('xlsx', 'Spreadsheet (XLSX)'), ('gpkg', 'Referral locations (GeoPackage)')], default='xlsx', max_length=16),
+        ),
+    ]
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.core.exceptions import FieldError, ValidationError
+from django.db import models
+from django.urls import reverse
+from referral.models import ReferralType, Region, TaskType
+from referral.utils import is_model_or_string
+
+REPORT_MODEL_CHOICES = (
+    ("referral", "referrals"),
+    ("task", "tasks"),
+    ("clearance", "clearance requests"),
+)
+
+
+class ReportDefinition(models.Model):
+    """A named report (a model plus filter query parameters, as accepted by DownloadView) which is generated
+    on a schedule by the generate_scheduled_reports management command. The latest complete snapshot is
+    available to all users from the reports page.
+    """
+
+    name = models.CharField(max_length=128, unique=True)
+    model = models.CharField(max_length=32, choices=REPORT_MODEL_CHOICES)
+    query = models.JSONField(default=dict, blank=True, help_text="Report filter query parameters.")
+    active = models.BooleanField(default=True, help_text="Inactive reports are not generated or listed.")
+
+    class Meta:
+        ordering = ["name"]
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        # Avoid a circular import (reports.utils imports this module).
+        from reports.utils import get_report_queryset
+
+        if not isinstance(self.query, dict):
+            raise ValidationError({"query": "Report filter query parameters must be a JSON object."})
+        try:
+            get_report_queryset(is_model_or_string(self.model), dict(self.query))
+        except (FieldError, ValidationError, ValueError):
+            raise ValidationError({"query": "Invalid report filter query parameters."})
+
+
+class Report(models.Model):
+    """A spreadsheet report of PRS objects, generated asynchronously by a Celery task and saved to storage.
+    Reports are either requested by a user, or are scheduled snapshots of a ReportDefinition.
+    """
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETE = "complete"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETE, "Complete"),
+        (STATUS_FAILED, "Failed"),
+    )
+    MODEL_CHOICES = REPORT_MODEL_CHOICES
+    FORMAT_XLSX = "xlsx"
+    FORMAT_GPKG = "gpkg"
+    FORMAT_CHOICES = (
+        (FORMAT_XLSX, "Spreadsheet (XLSX)"),
+        (FORMAT_GPKG, "Referral locations (GeoPackage)"),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="prs_reports", null=True, blank=True)
+    definition = models.ForeignKey(ReportDefinition, on_delete=models.CASCADE, related_name="reports", null=True, blank=True)
+    model = models.CharField(max_length=32, choices=MODEL_CHOICES)
+    query = models.JSONField(default=dict, blank=True, help_text="Report filter query parameters.")
+    format = models.CharField(max_length=16, choices=FORMAT_CHOICES, default=FORMAT_XLSX)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    row_count = models.PositiveIntegerField(null=True, blank=True)
+    file = models.FileField(upload_to="reports", max_length=255, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created"]
+
+    def __str__(self):
+        return f"{self.pk} {self.get_model_display()} report ({self.get_status_display()})"
+
+    def get_absolute_url(self):
+        return reverse("report_detail", kwargs={"pk": self.pk})
+
+    def get_download_url(self):
+        return reverse("report_download", kwargs={"pk": self.pk})
+
+    @property
+    def is_finished(self):
+        return self.status in [self.STATUS_COMPLETE, self.STATUS_FAILED]
+
+
+class ReferralSummary(models.Model):
+    """Monthly count of referrals received (by referral date) per region and referral type.
+    Refreshed by refresh_summaries(); a null region counts referrals having no region.
+    """
+
+    month = models.DateField(help_text="The first day of the month.")
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True)
+    referral_type = models.ForeignKey(ReferralType, on_delete=models.CASCADE)
+    referral_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["month", "region", "referral_type"]
+        verbose_name_plural = "referral summaries"
+        indexes = [
+            models.Index(fields=["month", "region"], name="idx_refsummary_month_region"),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%b %Y} {self.region} {self.referral_type}: {self.referral_count}"
+
+
+class TaskSummary(models.Model):
+    """Monthly counts of tasks completed (by complete date) per region and task type: the number completed,
+    the number completed after the due date, and their total stop days.
+    Refreshed by refresh_summaries(); a null region counts tasks on referrals having no region.
+    """
+
+    month = models.DateField(help_text="The first day of the month.")
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True)
+    task_type = models.ForeignKey(TaskType, on_delete=models.CASCADE)
+    completed_count = models.PositiveIntegerField(default=0)
+    overdue_count = models.PositiveIntegerField(default=0)
+    stop_time_total = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["month", "region", "task_type"]
+        verbose_name_plural = "task summaries"
+        indexes = [
+            models.Index(fields=["month", "region"], name="idx_tasksummary_month_region"),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%b %Y} {self.region} {self.task_type}: {self.completed_count}"
+
+
+class SummaryRefresh(models.Model):
+    """A refresh of the summary tables. Incremental refreshes recalculate the months of objects modified
+    since the watermark of the latest refresh.
+    """
+
+    watermark = models.DateTimeField(help_text="Objects modified before this time are included in the refresh.")
+    full = models.BooleanField(default=False)
+    months = models.PositiveIntegerField(default=0, help_text="The number of months recalculated.")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created"]
+
+    def __str__(self):
+        return f"{self.created:%d %b %Y %H:%M} ({'full' if self.full else 'incremental'})"
@@ -0,0 +1,58 @@
+import logging
+from tempfile import TemporaryFile
+
+from celery import shared_task
+from django.core.files import File
+from django.utils import timezone
+from referral.models import Location
+from referral.utils import is_model_or_string
+from reports.utils import (
+    get_location_export_queryset,
+    get_report_filename,
+    get_report_queryset,
+    report_complete_email,
+    write_location_export,
+    write_report_workbook,
+)
+
+LOGGER = logging.getLogger("prs")
+
+
+@shared_task
+def generate_report(pk):
+    """Generate the spreadsheet (or GeoPackage) for a queued Report, save it to storage and email the requesting user.
+    For a scheduled report snapshot, previous snapshots of the same ReportDefinition are then deleted.
+    """
+    from reports.models import Report
+
+    report = Report.objects.get(pk=pk)
+    report.status = Report.STATUS_RUNNING
+    report.save(update_fields=["status"])
+
+    try:
+        model = is_model_or_string(report.model)
+        with TemporaryFile() as output:
+            if report.format == Report.FORMAT_GPKG:
+                locations = get_location_export_queryset(dict(report.query))
+                report.row_count = write_location_export(locations, output)
+                filename = get_report_filename(Location, "gpkg")
+            else:
+                queryset = get_report_queryset(model, dict(report.query))
+                report.row_count = write_report_workbook(model, queryset, output)
+                filename = get_report_filename(model)
+            output.seek(0)
+            report.file.save(filename, File(output), save=False)
+        report.status = Report.STATUS_COMPLETE
+    except Exception:
+        LOGGER.exception(f"Error generating report {pk}")
+        report.status = Report.STATUS_FAILED
+
+    report.completed = timezone.now()
+    report.save()
+    if report.definition and report.status == Report.STATUS_COMPLETE:
+        for previous in Report.objects.filter(definition=report.definition, created__lt=report.created):
+            previous.file.delete(save=False)
+            previous.delete()
+    if report.user:
+        report_complete_email(report)
+    return f"Generated report {pk} ({report.status})"
@@ -1,5 +1,17 @@
+import csv
+import json
+from io import StringIO
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from mixer.backend.django import mixer
+from referral.models import Clearance, Location, Referral, Region, Task
 from referral.test_models import PrsTestCase
+from reports.models import Report, ReportDefinition
+from reports.tasks import generate_report
+from reports.utils import refresh_summaries
 
 
 class PublishViewTest(PrsTestCase):
@@ -16,3 +28,188 @@ class PublishViewTest(PrsTestCase):
             self.client.login(username=user, password="pass")
             response = self.client.get(url)
             self.assertEqual(response.status_code, 200)
+
+    def test_download(self):
+        """Test that reports are streamed to the client as XLSX workbooks"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        for model in ["referral", "task", "clearance"]:
+            response = self.client.get(url, {"model": model})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            # XLSX files are zip archives.
+            self.assertTrue(b"".join(response.streaming_content).startswith(b"PK"))
+
+    @override_settings(REPORT_SYNC_MAX_ROWS=1)
+    def test_download_csv(self):
+        """Test that CSV reports are streamed, regardless of size"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        response = self.client.get(url, {"model": "referral", "format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][0], "Referral ID")
+        self.assertEqual(len(rows) - 1, Referral.objects.current().count())
+
+    def test_download_query_count(self):
+        """Test that the number of queries for a report doesn't scale with the row count"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        for model in [Referral, Task, Clearance]:
+            obj = model.objects.current().first()
+            with CaptureQueriesContext(connection) as single:
+                response = self.client.get(url, {"model": model._meta.model_name, "format": "csv", "pk": obj.pk})
+                b"".join(response.streaming_content)
+            with CaptureQueriesContext(connection) as full:
+                response = self.client.get(url, {"model": model._meta.model_name, "format": "csv"})
+                b"".join(response.streaming_content)
+            self.assertEqual(len(single), len(full))
+
+    def test_download_async(self):
+        """Test that a report can be queued, generated by a task and downloaded by the requesting user"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(url, {"model": "referral", "async": ""})
+        self.assertEqual(len(callbacks), 1)
+        report = Report.objects.get(user__username="normaluser")
+        self.assertRedirects(response, report.get_absolute_url())
+        self.assertEqual(report.status, Report.STATUS_QUEUED)
+        generate_report(report.pk)
+        report.refresh_from_db()
+        self.assertEqual(report.status, Report.STATUS_COMPLETE)
+        self.assertEqual(report.row_count, Referral.objects.current().count())
+        status = self.client.get(report.get_absolute_url(), {"json": ""}).json()
+        self.assertEqual(status["download_url"], report.get_download_url())
+        response = self.client.get(report.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        # Other users can't view or download the report.
+        self.client.login(username="poweruser", password="pass")
+        response = self.client.get(report.get_absolute_url())
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(report.get_download_url())
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(REPORT_SYNC_MAX_ROWS=1)
+    def test_download_large_report_queued(self):
+        """Test that a report containing more than REPORT_SYNC_MAX_ROWS objects is queued"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        response = self.client.get(url, {"model": "task"})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Report.objects.filter(model="task", status=Report.STATUS_QUEUED).exists())
+
+    def test_download_invalid_filters(self):
+        """Test that invalid filter query parameters return a 400 response, and aren't queued"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        for params in [{"foo": "bar"}, {"referral_date__gte": "foo"}]:
+            for extra in [{}, {"format": "csv"}, {"async": ""}, {"format": "gpkg"}, {"format": "geojsonl"}]:
+                response = self.client.get(url, {"model": "referral", **params, **extra})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Report.objects.exists())
+
+    def assign_regions(self):
+        """Assigns regions to the dated referrals (the first in two regions, plus a deleted region) and returns
+        a tuple (referral in two regions, expected referral count per region name).
+        """
+        region1, region2 = Region.objects.current()[:2]
+        deleted_region = mixer.blend(Region)
+        deleted_region.delete()
+        referrals = list(Referral.objects.current().filter(referral_date__isnull=False))
+        referrals[0].regions.set([region1, region2, deleted_region])
+        for referral in referrals[1:]:
+            referral.regions.set([region1])
+        return referrals[0], {region1.name: len(referrals), region2.name: 1}
+
+    def get_region_counts(self, rows):
+        """Returns the summed referral count per region name from the summary JSON rows"""
+        counts = {}
+        for row in rows:
+            counts[row["region"]] = counts.get(row["region"], 0) + row["count"]
+        return counts
+
+    def test_summary(self):
+        """Test that the summary page and JSON endpoint return the refreshed summary rows"""
+        _, expected = self.assign_regions()
+        refresh = refresh_summaries()
+        self.assertTrue(refresh.full)
+        url = reverse("reports_summary")
+        self.client.login(username="normaluser", password="pass")
+        response = self.client.get(url, {"month__gte": "2000-01-01"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, {"month__gte": "2000-01-01", "json": ""})
+        self.assertEqual(response.status_code, 200)
+        # A referral is counted once in each of its current regions; deleted regions are ignored.
+        self.assertEqual(self.get_region_counts(response.json()["referrals"]), expected)
+        response = self.client.get(url, {"month__gte": "foo"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_incremental_refresh(self):
+        """Test that an incremental refresh recalculates the months of modified referrals"""
+        referral, expected = self.assign_regions()
+        refresh_summaries()
+        referral.delete()
+        with override_settings(API_CHANGES_SETTLE_SECONDS=0):
+            refresh = refresh_summaries()
+        self.assertFalse(refresh.full)
+        self.assertGreaterEqual(refresh.months, 1)
+        url = reverse("reports_summary")
+        self.client.login(username="normaluser", password="pass")
+        response = self.client.get(url, {"month__gte": "2000-01-01", "json": ""})
+        self.assertEqual(response.status_code, 200)
+        # The deleted referral is no longer counted in either of its regions.
+        expected = {name: count - 1 for name, count in expected.items() if count > 1}
+        self.assertEqual(self.get_region_counts(response.json()["referrals"]), expected)
+
+    def test_scheduled_report(self):
+        """Test that scheduled report snapshots are listed on the reports page and downloadable by any user"""
+        definition = ReportDefinition.objects.create(name="Current referrals", model="referral")
+        for i in range(2):
+            report = Report.objects.create(definition=definition, model=definition.model, query=definition.query)
+            generate_report(report.pk)
+        # Only the latest snapshot is retained.
+        self.assertEqual(definition.reports.get(), report)
+        self.client.login(username="normaluser", password="pass")
+        response = self.client.get(reverse("reports"))
+        self.assertContains(response, report.get_download_url())
+        response = self.client.get(report.get_download_url())
+        self.assertEqual(response.status_code, 200)
+
+    def test_report_definition_clean(self):
+        """Test that a report definition having invalid filter parameters fails validation"""
+        definition = ReportDefinition(name="Invalid", model="referral", query={"foo": "bar"})
+        self.assertRaises(ValidationError, definition.full_clean)
+        definition.query = {"region__id": 1}
+        definition.full_clean()
+
+    def test_download_locations(self):
+        """Test the bulk export of filtered referral locations as GeoPackage and newline-delimited GeoJSON"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        locations = Location.objects.current().filter(poly__isnull=False)
+        response = self.client.get(url, {"model": "referral", "format": "geojsonl"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        features = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(features), locations.count())
+        response = self.client.get(url, {"model": "referral", "format": "gpkg"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"SQLite format 3"))
+        # Only referral locations can be exported.
+        response = self.client.get(url, {"model": "task", "format": "gpkg"})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(REPORT_SYNC_MAX_ROWS=0)
+    def test_download_locations_queued(self):
+        """Test that a large GeoPackage export is queued and generated by a task"""
+        url = reverse("reports_download")
+        self.client.login(username="normaluser", password="pass")
+        response = self.client.get(url, {"model": "referral", "format": "gpkg"})
+        self.assertEqual(response.status_code, 302)
+        report = Report.objects.get(format=Report.FORMAT_GPKG)
+        generate_report(report.pk)
+        report.refresh_from_db()
+        self.assertEqual(report.status, Report.STATUS_COMPLETE)
+        self.assertEqual(report.row_count, Location.objects.current().filter(poly__isnull=False).count())
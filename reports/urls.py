@@ -1,8 +1,11 @@
 from django.contrib.auth.decorators import login_required
 from django.urls import path
-from reports.views import DownloadView, ReportView
+from reports.views import DownloadView, ReportDetail, ReportDownload, ReportView, SummaryView
 
 urlpatterns = [
     path("", login_required(ReportView.as_view()), name="reports"),
     path("download/", login_required(DownloadView.as_view()), name="reports_download"),
+    path("summary/", login_required(SummaryView.as_view()), name="reports_summary"),
+    path("<int:pk>/", login_required(ReportDetail.as_view()), name="report_detail"),
+    path("<int:pk>/download/", login_required(ReportDownload.as_view()), name="report_download"),
 ]
@@ -0,0 +1,487 @@
+import csv
+import os
+import shutil
+from datetime import date, datetime, timedelta
+from itertools import chain
+from tempfile import TemporaryDirectory
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+import xlsxwriter
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Count, F, Q, QuerySet, Sum
+from django.db.models.base import ModelBase
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+from referral.models import Clearance, Location, Referral, Task, TaskType
+from referral.utils import get_location_export_rows, write_locations_gpkg
+from reports.models import ReferralSummary, SummaryRefresh, TaskSummary
+from taggit.models import Tag
+
+
+def get_report_filters(model: ModelBase, query_params: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Translates the passed-in dict of query parameters (as used by the reports page filters) into queryset
+    filter arguments for the passed-in model type. Returns a tuple (filters, tag ID), as the tag filter
+    is applied separately.
+    """
+    query_params = dict(query_params)
+    # Special case: region -> regions.
+    region = query_params.pop("region__id", None)
+    if region:
+        if model._meta.model_name == "referral":
+            query_params["regions__id__in"] = [region]
+        elif model._meta.model_name == "task":
+            query_params["referral__regions__id__in"] = [region]
+        elif model._meta.model_name == "clearance":
+            query_params["condition__referral__regions__id__in"] = [region]
+    # Special case: for clearances, follow dates through to linked task.
+    if model._meta.model_name == "clearance":
+        state = query_params.pop("state__id", None)
+        if state:
+            query_params["task__state__pk"] = state
+        referring_org = query_params.pop("referring_org__id", None)
+        if referring_org:
+            query_params["task__referral__referring_org__pk"] = referring_org
+        start = query_params.pop("start_date__gte", None)
+        if start:
+            query_params["task__start_date__gte"] = start
+        end = query_params.pop("start_date__lte", None)
+        if end:
+            query_params["task__start_date__lte"] = end
+    # Special case: remove tag PKs from the query params.
+    tag = query_params.pop("tag__id", None)
+    return query_params, tag
+
+
+def get_report_queryset(model: ModelBase, query_params: Dict[str, Any]) -> QuerySet:
+    """Returns a queryset of objects of the passed-in model type for a report, filtered according to the
+    passed-in dict of query parameters (as used by the reports page filters).
+    """
+    query_params, tag = get_report_filters(model, query_params)
+    if tag:
+        tags = Tag.objects.filter(pk=tag)
+    else:
+        tags = None
+
+    # Many-to-many names are aggregated in the database, so that each report is a single query (rather than
+    # one per row). Aggregates are annotated before filtering, so that filters on the same relations don't
+    # constrain them.
+    if model == Referral:
+        # Filter referral objects according to the parameters.
+        queryset = (
+            Referral.objects.current()
+            .select_related(
+                "type",
+                "referring_org",
+                "lga",
+            )
+            .annotate(
+                dop_trigger_names=ArrayAgg("dop_triggers__name", distinct=True, filter=Q(dop_triggers__isnull=False)),
+                tag_names=ArrayAgg("tags__name", distinct=True, filter=Q(tags__isnull=False)),
+            )
+            .filter(**query_params)
+        )
+        if tags:  # Optional: filter by tags.
+            queryset = queryset.filter(tags__in=tags).distinct()
+    elif model == Clearance:
+        # Filter clearance objects according to the parameters.
+        queryset = (
+            Clearance.objects.current()
+            .select_related(
+                "condition__referral",
+                "condition__category",
+                "task__assigned_user",
+                "task__state",
+            )
+            .filter(**query_params)
+        )
+    elif model == Task:
+        # Filter task objects according to the parameters.
+        queryset = (
+            Task.objects.current()
+            .select_related(
+                "type",
+                "referral",
+                "assigned_user",
+                "state",
+                "referral__referring_org",
+                "referral__type",
+                "referral__lga",
+            )
+            .annotate(
+                dop_trigger_names=ArrayAgg("referral__dop_triggers__name", distinct=True, filter=Q(referral__dop_triggers__isnull=False)),
+            )
+            .filter(**query_params)
+        )
+        # Business rule: filter out 'Condition clearance' task types.
+        cr = TaskType.objects.get_cached(name="Conditions clearance request")
+        queryset = queryset.exclude(type=cr)
+    else:
+        raise ValueError(f"Invalid report model: {model}")
+
+    return queryset
+
+
+def get_location_export_queryset(query_params: Dict[str, Any]) -> QuerySet:
+    """Returns a queryset of the current Locations of referrals matching the passed-in dict of query
+    parameters (as used by the reports page referral filters).
+    """
+    query_params, tag = get_report_filters(Referral, query_params)
+    referrals = Referral.objects.current().filter(**query_params)
+    if tag:
+        referrals = referrals.filter(tags__pk=tag)
+    return Location.objects.current().filter(referral__in=referrals.values("pk"))
+
+
+def write_location_export(locations: QuerySet, output: BinaryIO) -> int:
+    """Writes a GeoPackage of the passed-in Locations queryset to the output file object, and returns the
+    number of features written. The GeoPackage (an SQLite database) is built in a temporary file on disk,
+    then copied to the output in chunks.
+    """
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "prs_locations.gpkg")
+        count = write_locations_gpkg(path, get_location_export_rows(locations))
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, output)
+    return count
+
+
+def get_report_filename(model: ModelBase, extension: str = "xlsx") -> str:
+    """Returns a timestamped filename for a report of the passed-in model type."""
+    name = {Referral: "referrals", Clearance: "clearance_requests", Task: "tasks", Location: "locations"}[model]
+    return f"prs_{name}_{date.today().isoformat()}_{datetime.now().strftime('%H%M')}.{extension}"
+
+
+REPORT_HEADERS = {
+    Referral: [
+        "Referral ID",
+        "Region(s)",
+        "Referrer",
+        "Type",
+        "Reference",
+        "Received",
+        "Description",
+        "Address",
+        "Triggers",
+        "Tags",
+        "File no.",
+        "LGA",
+    ],
+    Clearance: [
+        "Referral ID",
+        "Region(s)",
+        "Reference",
+        "Condition no.",
+        "Approved condition",
+        "Category",
+        "Task description",
+        "Deposited plan no.",
+        "Assigned user",
+        "Status",
+        "Start date",
+        "Due date",
+        "Complete date",
+        "Stop date",
+        "Restart date",
+        "Total stop days",
+    ],
+    Task: [
+        "Task ID",
+        "Region(s)",
+        "Referral ID",
+        "Referred by",
+        "Referral type",
+        "Reference",
+        "Referral received",
+        "Task type",
+        "Task status",
+        "Assigned user",
+        "Task start",
+        "Task due",
+        "Task complete",
+        "Stop date",
+        "Restart date",
+        "Total stop days",
+        "File no.",
+        "DoP triggers",
+        "Referral description",
+        "Referral address",
+        "LGA",
+    ],
+}
+# Spreadsheet column widths for each report type.
+REPORT_COLUMN_WIDTHS = {
+    Referral: [("A:A", 10), ("B:B", 12), ("C:C", 38), ("D:D", 22), ("E:F", 12), ("G:I", 45), ("J:J", 15), ("K:K", 12), ("L:L", 30)],
+    Clearance: [("A:A", 9), ("B:D", 12), ("E:E", 45), ("G:G", 45), ("H:J", 18), ("K:P", 10)],
+    Task: [
+        ("A:A", 9),
+        ("B:B", 12),
+        ("C:C", 9),
+        ("D:E", 35),
+        ("F:F", 20),
+        ("G:G", 14),
+        ("H:J", 20),
+        ("K:P", 11),
+        ("Q:Q", 25),
+        ("R:U", 45),
+    ],
+}
+REPORT_SHEET_NAMES = {Referral: "Referrals", Clearance: "Clearances", Task: "Tasks"}
+
+
+def join_names(names: Optional[List[str]]) -> str:
+    """Returns a sorted, comma-separated string of the passed-in aggregated names (which may be None)."""
+    return ", ".join(sorted(names or []))
+
+
+def get_report_row(obj) -> List[Any]:
+    """Returns the list of report column values for the passed-in Referral, Clearance or Task object,
+    from a queryset returned by get_report_queryset().
+    """
+    if isinstance(obj, Referral):
+        return [
+            obj.pk,
+            obj.regions_str,
+            obj.referring_org.name,
+            obj.type.name,
+            obj.reference,
+            obj.referral_date,
+            obj.description,
+            obj.address,
+            join_names(obj.dop_trigger_names),
+            join_names(obj.tag_names),
+            obj.file_no,
+            obj.lga.name if obj.lga else "",
+        ]
+    elif isinstance(obj, Clearance):
+        return [
+            obj.condition.referral.pk,
+            obj.condition.referral.regions_str,
+            obj.condition.referral.reference,
+            obj.condition.identifier,
+            obj.condition.condition,
+            obj.condition.category.name if obj.condition.category else "",
+            obj.task.description,
+            obj.deposited_plan,
+            obj.task.assigned_user.get_full_name(),
+            obj.task.state.name,
+            obj.task.start_date,
+            obj.task.due_date,
+            obj.task.complete_date,
+            obj.task.stop_date,
+            obj.task.restart_date,
+            obj.task.stop_time,
+        ]
+    elif isinstance(obj, Task):
+        return [
+            obj.pk,
+            obj.referral.regions_str,
+            obj.referral.pk,
+            obj.referral.referring_org.name,
+            obj.referral.type.name,
+            obj.referral.reference,
+            obj.referral.referral_date,
+            obj.type.name,
+            obj.state.name,
+            obj.assigned_user.get_full_name(),
+            obj.start_date,
+            obj.due_date,
+            obj.complete_date,
+            obj.stop_date,
+            obj.restart_date,
+            obj.stop_time,
+            obj.referral.file_no,
+            join_names(obj.dop_trigger_names),
+            obj.referral.description,
+            obj.referral.address,
+            obj.referral.lga.name if obj.referral.lga else "",
+        ]
+    raise ValueError(f"Invalid report object: {obj}")
+
+
+def write_report_workbook(model: ModelBase, queryset: QuerySet, output: BinaryIO) -> int:
+    """Writes a spreadsheet report of the passed-in queryset to the output file object,
+    and returns the number of objects written. Rows must be written in order (constant memory mode).
+    """
+    # Generate a blank Excel workbook. In constant memory mode, each row is flushed to a temporary file once
+    # the next row is written, so that memory use doesn't scale with the number of rows.
+    workbook = xlsxwriter.Workbook(
+        output,
+        options={
+            "constant_memory": True,
+            "default_date_format": "dd-mmm-yyyy",
+            "remove_timezone": True,
+        },
+    )
+    # Add a worksheet, set column widths and write the column headers.
+    ws = workbook.add_worksheet(REPORT_SHEET_NAMES[model])
+    for cols, width in REPORT_COLUMN_WIDTHS[model]:
+        ws.set_column(cols, width=width)
+    ws.write_row(row=0, col=0, data=REPORT_HEADERS[model])
+    row = 1
+    # Fetch objects (and any prefetched relations) from the database in chunks, rather than all at once.
+    for obj in queryset.iterator(chunk_size=settings.REPORT_CHUNK_SIZE):
+        ws.write_row(row=row, col=0, data=get_report_row(obj))
+        row += 1
+
+    workbook.close()
+    return row - 1
+
+
+class Echo:
+    """A file-like object which returns the value written to it, rather than storing it.
+    Used to write CSV rows to a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_report_csv(model: ModelBase, queryset: QuerySet) -> Iterator[str]:
+    """Generator that yields a CSV report of the passed-in queryset, one row at a time.
+    On PostgreSQL, iterator() uses a server-side cursor so that rows are streamed from the database as well.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(REPORT_HEADERS[model])
+    for obj in queryset.iterator(chunk_size=settings.REPORT_CHUNK_SIZE):
+        yield writer.writerow(get_report_row(obj))
+
+
+def report_complete_email(report) -> None:
+    """Send an email to the user who requested the passed-in Report, with a link to the report."""
+    if not report.user.email:
+        return
+    subject = "PRS report ready"
+    from_email = settings.APPLICATION_ALERTS_EMAIL
+    to_email = [report.user.email]
+    report_url = settings.SITE_URL + report.get_absolute_url()
+    if report.status == report.STATUS_COMPLETE:
+        text_content = f"""This is an automated message to let you know that the PRS {report.get_model_display()} report
+            you requested is ready to download at this URL:\n{report_url}\n"""
+        html_content = f"""<p>This is an automated message to let you know that the PRS {report.get_model_display()} report
+            you requested is ready to download <a href="{report_url}">here</a>.</p>"""
+    else:
+        subject = "PRS report failed"
+        text_content = f"""This is an automated message to let you know that the PRS {report.get_model_display()} report
+            you requested could not be generated. Please try again, or contact the system administrator.\n"""
+        html_content = f"""<p>This is an automated message to let you know that the PRS {report.get_model_display()} report
+            you requested could not be generated. Please try again, or contact the system administrator.</p>"""
+    text_content += "This is an automatically-generated email - please do not reply.\n"
+    html_content += "<p>This is an automatically-generated email - please do not reply.</p>"
+    msg = EmailMultiAlternatives(subject, text_content, from_email, to_email)
+    msg.attach_alternative(html_content, "text/html")
+    # Email should fail gracefully - ie no Exception raised on failure.
+    msg.send(fail_silently=True)
+
+
+def rebuild_referral_summary(months: Optional[Set[date]] = None) -> None:
+    """Recalculates ReferralSummary rows for the passed-in set of months (default: all months).
+    A referral is counted once in each of its current regions, or once with no region if it has none.
+    """
+    referrals = Referral.objects.current().filter(referral_date__isnull=False).annotate(month=TruncMonth("referral_date"))
+    summaries = ReferralSummary.objects.all()
+    if months is not None:
+        referrals = referrals.filter(month__in=months)
+        summaries = summaries.filter(month__in=months)
+    # The grouping by region reuses the join to current regions from the filter.
+    region_rows = (
+        referrals.filter(regions__effective_to__isnull=True)
+        .order_by()
+        .values("month", "regions", "type")
+        .annotate(referral_count=Count("pk", distinct=True))
+    )
+    no_region_rows = (
+        referrals.exclude(regions__effective_to__isnull=True)
+        .order_by()
+        .values("month", "type")
+        .annotate(referral_count=Count("pk", distinct=True))
+    )
+
+    summaries.delete()
+    ReferralSummary.objects.bulk_create(
+        [
+            ReferralSummary(
+                month=row["month"],
+                region_id=row.get("regions"),
+                referral_type_id=row["type"],
+                referral_count=row["referral_count"],
+            )
+            for row in chain(region_rows, no_region_rows)
+        ],
+        batch_size=1000,
+    )
+
+
+def rebuild_task_summary(months: Optional[Set[date]] = None) -> None:
+    """Recalculates TaskSummary rows for the passed-in set of months (default: all months).
+    A task is counted once in each of its referral's current regions, or once with no region if it has none.
+    """
+    tasks = Task.objects.current().filter(complete_date__isnull=False).annotate(month=TruncMonth("complete_date"))
+    summaries = TaskSummary.objects.all()
+    if months is not None:
+        tasks = tasks.filter(month__in=months)
+        summaries = summaries.filter(month__in=months)
+    counts = {
+        "completed_count": Count("pk", distinct=True),
+        "overdue_count": Count("pk", distinct=True, filter=Q(complete_date__gt=F("due_date"))),
+        "stop_time_total": Coalesce(Sum("stop_time"), 0),
+    }
+    # The grouping by region reuses the join to current regions from the filter.
+    region_rows = (
+        tasks.filter(referral__regions__effective_to__isnull=True)
+        .order_by()
+        .values("month", "referral__regions", "type")
+        .annotate(**counts)
+    )
+    no_region_rows = tasks.exclude(referral__regions__effective_to__isnull=True).order_by().values("month", "type").annotate(**counts)
+
+    summaries.delete()
+    TaskSummary.objects.bulk_create(
+        [
+            TaskSummary(
+                month=row["month"],
+                region_id=row.get("referral__regions"),
+                task_type_id=row["type"],
+                completed_count=row["completed_count"],
+                overdue_count=row["overdue_count"],
+                stop_time_total=row["stop_time_total"],
+            )
+            for row in chain(region_rows, no_region_rows)
+        ],
+        batch_size=1000,
+    )
+
+
+def refresh_summaries(full: bool = False):
+    """Refreshes the reporting summary tables, and returns the SummaryRefresh object recording the refresh.
+    An incremental refresh recalculates only the months of referrals and tasks modified since the latest
+    refresh (including deleted objects). A change which moves an object into a different month leaves its
+    previous month stale until the next full refresh, so a full refresh is also run whenever the latest full
+    refresh is older than REPORT_SUMMARY_FULL_REFRESH_HOURS.
+    """
+    # Exclude very recent changes, to allow concurrent transactions to commit (they are included next time).
+    watermark = timezone.now() - timedelta(seconds=settings.API_CHANGES_SETTLE_SECONDS)
+    latest = SummaryRefresh.objects.first()
+    latest_full = SummaryRefresh.objects.filter(full=True).first()
+    if not latest_full or latest_full.created < timezone.now() - timedelta(hours=settings.REPORT_SUMMARY_FULL_REFRESH_HOURS):
+        full = True
+
+    with transaction.atomic():
+        if full:
+            rebuild_referral_summary()
+            rebuild_task_summary()
+            months = len(set(ReferralSummary.objects.dates("month", "month")) | set(TaskSummary.objects.dates("month", "month")))
+        else:
+            since = latest.watermark
+            referrals = Referral.objects.filter(modified__gte=since, referral_date__isnull=False)
+            referral_months = set(referrals.dates("referral_date", "month"))
+            tasks = Task.objects.filter(Q(modified__gte=since) | Q(referral__modified__gte=since), complete_date__isnull=False)
+            task_months = set(tasks.dates("complete_date", "month"))
+            if referral_months:
+                rebuild_referral_summary(referral_months)
+            if task_months:
+                rebuild_task_summary(task_months)
+            months = len(referral_months | task_months)
+        return SummaryRefresh.objects.create(watermark=watermark, full=full, months=months)
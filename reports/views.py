@@ -1,13 +1,26 @@
-from datetime import date, datetime
+import os
+from datetime import date
+from tempfile import SpooledTemporaryFile
 
-import xlsxwriter
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.core.exceptions import FieldError, ValidationError
+from django.db.models import Prefetch, Q, Sum
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect
 from django.urls import reverse
-from django.views.generic import TemplateView
-from referral.models import Clearance, Referral, Task, TaskType
-from referral.utils import breadcrumbs_li, is_model_or_string, prs_user
-from taggit.models import Tag
+from django.views.generic import DetailView, TemplateView, View
+from referral.models import Location, Referral
+from referral.utils import breadcrumbs_li, get_location_export_rows, is_model_or_string, prs_user, stream_locations_geojsonl
+from reports.models import ReferralSummary, Report, ReportDefinition, SummaryRefresh, TaskSummary
+from reports.tasks import generate_report
+from reports.utils import (
+    get_location_export_queryset,
+    get_report_filename,
+    get_report_queryset,
+    stream_report_csv,
+    write_location_export,
+    write_report_workbook,
+)
 
 
 class ReportView(TemplateView):
@@ -22,11 +35,21 @@ class ReportView(TemplateView):
         context["breadcrumb_trail"] = breadcrumbs_li(links)
         context["no_sidebar"] = True
         context["is_prs_user"] = prs_user(self.request)
+        # Scheduled report snapshots, with the latest complete snapshot of each.
+        context["scheduled_reports"] = ReportDefinition.objects.filter(active=True).prefetch_related(
+            Prefetch("reports", queryset=Report.objects.filter(status=Report.STATUS_COMPLETE), to_attr="snapshots")
+        )
         return context
 
 
 class DownloadView(TemplateView):
-    """A basic view to return a spreadsheet of PRS objects."""
+    """A basic view to return a spreadsheet of PRS objects (XLSX, or CSV with ``format=csv``).
+    XLSX reports containing more than REPORT_SYNC_MAX_ROWS objects (or requested with an ``async`` query
+    parameter) are queued to be generated by a Celery task instead, and the user is redirected to the
+    report status page.
+    The locations of the filtered referrals may also be exported as a GeoPackage (``format=gpkg``, queued
+    in the same way) or as newline-delimited GeoJSON (``format=geojsonl``, streamed).
+    """
 
     def dispatch(self, request, *args, **kwargs):
         # kwargs must include a Model class, or a string.
@@ -39,305 +62,216 @@ class DownloadView(TemplateView):
         # Get any query parameters to filter the data.
         query_params = dict(request.GET.items())
         # Get the required model type from the query params.
-        model = is_model_or_string(query_params.pop("model"))
-        # Special case: region -> regions.
-        region = query_params.pop("region__id", None)
-        if region:
-            if model._meta.model_name == "referral":
-                query_params["regions__id__in"] = [region]
-            elif model._meta.model_name == "task":
-                query_params["referral__regions__id__in"] = [region]
-            elif model._meta.model_name == "clearance":
-                query_params["condition__referral__regions__id__in"] = [region]
-        # Special case: for clearances, follow dates through to linked task.
-        if model._meta.model_name == "clearance":
-            state = query_params.pop("state__id", None)
-            if state:
-                query_params["task__state__pk"] = state
-            referring_org = query_params.pop("referring_org__id", None)
-            if referring_org:
-                query_params["task__referral__referring_org__pk"] = referring_org
-            start = query_params.pop("start_date__gte", None)
-            if start:
-                query_params["task__start_date__gte"] = start
-            end = query_params.pop("start_date__lte", None)
-            if end:
-                query_params["task__start_date__lte"] = end
-        # Special case: remove tag PKs from the query params.
-        tag = query_params.pop("tag__id", None)
-        if tag:
-            tags = Tag.objects.filter(pk=tag)
-        else:
-            tags = None
-
-        # Generate a HTTPResponse object to write to.
-        response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        # Generate a blank Excel workbook.
-        workbook = xlsxwriter.Workbook(
-            response,
-            options={
-                "in_memory": True,
-                "default_date_format": "dd-mmm-yyyy",
-                "remove_timezone": True,
-            },
+        model = is_model_or_string(query_params.pop("model", ""))
+        if model is None:
+            return HttpResponseBadRequest("Bad request")
+        queue = query_params.pop("async", None) is not None
+        file_format = query_params.pop("format", "xlsx")
+        if file_format in ["gpkg", "geojsonl"]:
+            if model != Referral:
+                return HttpResponseBadRequest("Bad request")
+            return self.get_location_export(query_params, file_format, queue)
+        try:
+            queryset = get_report_queryset(model, query_params)
+        except (FieldError, ValidationError, ValueError):  # Invalid filter query parameters.
+            return HttpResponseBadRequest("Bad request")
+
+        # CSV reports are streamed row by row, and so aren't limited in size.
+        if file_format == "csv":
+            response = StreamingHttpResponse(stream_report_csv(model, queryset), content_type="text/csv")
+            response["Content-Disposition"] = f'attachment; filename="{get_report_filename(model, "csv")}"'
+            return response
+
+        # Queue large reports to be generated asynchronously.
+        if queue or queryset.count() > settings.REPORT_SYNC_MAX_ROWS:
+            report = Report.objects.create(user=request.user, model=model._meta.model_name, query=query_params)
+            generate_report.delay_on_commit(report.pk)
+            return redirect(report.get_absolute_url())
+
+        # Write the workbook to a spooled temporary file (held in memory up to REPORT_SPOOL_MAX_SIZE bytes,
+        # then on disk), then stream it to the client.
+        output = SpooledTemporaryFile(max_size=settings.REPORT_SPOOL_MAX_SIZE)
+        write_report_workbook(model, queryset, output)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=get_report_filename(model),
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
 
-        if model == Referral:
-            response["Content-Disposition"] = (
-                f"attachment; filename=prs_referrals_{date.today().isoformat()}_{datetime.now().strftime('%H%M')}.xlsx"
-            )
-            # Filter referral objects according to the parameters.
-            referrals = (
-                Referral.objects.current()
-                .select_related(
-                    "type",
-                    "referring_org",
-                    "lga",
-                )
-                .filter(**query_params)
-            )
-            if tags:  # Optional: filter by tags.
-                referrals = referrals.filter(tags__in=tags).distinct()
-
-            # Short circuit: disallow a report containing >10000 objects.
-            if referrals.count() > 10000:
-                return HttpResponseBadRequest("Report too large, apply additional filters")
-
-            # Add a worksheet.
-            ws = workbook.add_worksheet("Referrals")
-            # Write the column headers to the new worksheet.
-            row = 0
-            ws.write_row(
-                row=row,
-                col=0,
-                data=[
-                    "Referral ID",
-                    "Region(s)",
-                    "Referrer",
-                    "Type",
-                    "Reference",
-                    "Received",
-                    "Description",
-                    "Address",
-                    "Triggers",
-                    "Tags",
-                    "File no.",
-                    "LGA",
-                ],
-            )
-            row += 1
-            # Write the referral values to the worksheet.
-            for r in referrals:
-                ws.write_row(
-                    row=row,
-                    col=0,
-                    data=[
-                        r.pk,
-                        r.regions_str,
-                        r.referring_org.name,
-                        r.type.name,
-                        r.reference,
-                        r.referral_date,
-                        r.description,
-                        r.address,
-                        ", ".join([t.name for t in r.dop_triggers.all()]),
-                        ", ".join([t.name for t in r.tags.all()]),
-                        r.file_no,
-                        r.lga.name if r.lga else "",
-                    ],
-                )
-                row += 1
-
-            # Set column widths.
-            ws.set_column("A:A", width=10)
-            ws.set_column("B:B", width=12)
-            ws.set_column("C:C", width=38)
-            ws.set_column("D:D", width=22)
-            ws.set_column("E:F", width=12)
-            ws.set_column("G:I", width=45)
-            ws.set_column("J:J", width=15)
-            ws.set_column("K:K", width=12)
-            ws.set_column("L:L", width=30)
-
-        elif model == Clearance:
-            response["Content-Disposition"] = (
-                f"attachment; filename=prs_clearance_requests_{date.today().isoformat()}_{datetime.now().strftime('%H%M')}.xlsx"
-            )
-            # Filter clearance objects according to the parameters.
-            clearances = (
-                Clearance.objects.current()
-                .select_related(
-                    "condition",
-                    "task",
-                )
-                .filter(**query_params)
-            )
+    def get_location_export(self, query_params, file_format, queue):
+        """Returns a spatial export of the locations of referrals matching the passed-in query parameters."""
+        try:
+            locations = get_location_export_queryset(query_params)
+        except (FieldError, ValidationError, ValueError):  # Invalid filter query parameters.
+            return HttpResponseBadRequest("Bad request")
+
+        # Newline-delimited GeoJSON is streamed feature by feature, and so isn't limited in size.
+        if file_format == "geojsonl":
+            rows = get_location_export_rows(locations)
+            response = StreamingHttpResponse(stream_locations_geojsonl(rows), content_type="application/x-ndjson")
+            response["Content-Disposition"] = f'attachment; filename="{get_report_filename(Location, "geojsonl")}"'
+            return response
 
-            # Short circuit: disallow a report containing >10000 objects.
-            if clearances.count() > 10000:
-                return HttpResponseBadRequest("Report too large, apply additional filters")
-
-            # Add a worksheet.
-            ws = workbook.add_worksheet("Clearances")
-            # Write the column headers to the new worksheet.
-            row = 0
-            ws.write_row(
-                row=row,
-                col=0,
-                data=[
-                    "Referral ID",
-                    "Region(s)",
-                    "Reference",
-                    "Condition no.",
-                    "Approved condition",
-                    "Category",
-                    "Task description",
-                    "Deposited plan no.",
-                    "Assigned user",
-                    "Status",
-                    "Start date",
-                    "Due date",
-                    "Complete date",
-                    "Stop date",
-                    "Restart date",
-                    "Total stop days",
-                ],
+        # Queue large GeoPackage exports to be generated asynchronously.
+        if queue or locations.filter(poly__isnull=False).count() > settings.REPORT_SYNC_MAX_ROWS:
+            report = Report.objects.create(user=self.request.user, model="referral", query=query_params, format=Report.FORMAT_GPKG)
+            generate_report.delay_on_commit(report.pk)
+            return redirect(report.get_absolute_url())
+
+        output = SpooledTemporaryFile(max_size=settings.REPORT_SPOOL_MAX_SIZE)
+        write_location_export(locations, output)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=get_report_filename(Location, "gpkg"),
+            content_type="application/x-sqlite3",
+        )
+
+
+class ReportDetail(DetailView):
+    """Status page for a queued report, with a download link once the report is complete.
+    A request containing a ``json`` query parameter returns the report status as JSON (for polling).
+    """
+
+    template_name = "reports/report_detail.html"
+    http_method_names = ["get", "head", "options"]
+
+    def get_queryset(self):
+        # Users may only view their own reports.
+        return Report.objects.filter(user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        if "json" in request.GET:
+            report = self.get_object()
+            return JsonResponse(
+                {
+                    "id": report.pk,
+                    "status": report.status,
+                    "row_count": report.row_count,
+                    "download_url": report.get_download_url() if report.status == Report.STATUS_COMPLETE else None,
+                }
             )
-            row += 1
-
-            # Write the clearance values to the worksheet.
-            for c in clearances:
-                ws.write_row(
-                    row=row,
-                    col=0,
-                    data=[
-                        c.condition.referral.pk,
-                        c.condition.referral.regions_str,
-                        c.condition.referral.reference,
-                        c.condition.identifier,
-                        c.condition.condition,
-                        c.condition.category.name if c.condition.category else "",
-                        c.task.description,
-                        c.deposited_plan,
-                        c.task.assigned_user.get_full_name(),
-                        c.task.state.name,
-                        c.task.start_date,
-                        c.task.due_date,
-                        c.task.complete_date,
-                        c.task.stop_date,
-                        c.task.restart_date,
-                        c.task.stop_time,
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        title = f"Report {self.object.pk}"
+        context["page_title"] = " | ".join([settings.APPLICATION_ACRONYM, title])
+        links = [(reverse("site_home"), "Home"), (reverse("reports"), "Reports"), (None, title)]
+        context["breadcrumb_trail"] = breadcrumbs_li(links)
+        context["no_sidebar"] = True
+        return context
+
+
+class ReportDownload(View):
+    """Return the spreadsheet file for a completed report (the user's own, or a scheduled report snapshot)."""
+
+    http_method_names = ["get"]
+
+    def get(self, request, pk):
+        reports = Report.objects.filter(Q(user=request.user) | Q(definition__isnull=False), status=Report.STATUS_COMPLETE)
+        report = reports.filter(pk=pk).first()
+        if not report or not report.file:
+            raise Http404("Report not found")
+        return FileResponse(report.file.open("rb"), as_attachment=True, filename=os.path.basename(report.file.name))
+
+
+class SummaryView(TemplateView):
+    """Summary page of precomputed reporting aggregates: referrals received per region per month, tasks
+    completed on time versus overdue per region, and average stop days per task type.
+    A request containing a ``json`` query parameter returns the summary rows as JSON.
+    Optional query parameters: region__id, month__gte and month__lte (YYYY-MM-DD; default: the last 12 months).
+    """
+
+    template_name = "reports/summary.html"
+    http_method_names = ["get", "head", "options"]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.referrals, self.tasks = self.get_summaries()
+        except ValueError:
+            return HttpResponseBadRequest("Bad request")
+
+        if "json" in request.GET:
+            refresh = SummaryRefresh.objects.first()
+            return JsonResponse(
+                {
+                    "refreshed": refresh.created if refresh else None,
+                    "referrals": [
+                        {
+                            "month": row.month.strftime("%Y-%m"),
+                            "region": row.region.name if row.region else None,
+                            "referral_type": row.referral_type.name,
+                            "count": row.referral_count,
+                        }
+                        for row in self.referrals.select_related("region", "referral_type")
+                    ],
+                    "tasks": [
+                        {
+                            "month": row.month.strftime("%Y-%m"),
+                            "region": row.region.name if row.region else None,
+                            "task_type": row.task_type.name,
+                            "completed": row.completed_count,
+                            "on_time": row.completed_count - row.overdue_count,
+                            "overdue": row.overdue_count,
+                            "stop_time_total": row.stop_time_total,
+                        }
+                        for row in self.tasks.select_related("region", "task_type")
                     ],
-                )
-                row += 1
-
-            # Set column widths.
-            ws.set_column("A:A", 9)
-            ws.set_column("B:D", 12)
-            ws.set_column("E:E", 45)
-            ws.set_column("G:G", 45)
-            ws.set_column("H:J", 18)
-            ws.set_column("K:P", 10)
-
-        elif model == Task:
-            response["Content-Disposition"] = (
-                f"attachment; filename=prs_tasks_{date.today().isoformat()}_{datetime.now().strftime('%H%M')}.xlsx"
+                }
             )
+        return super().get(request, *args, **kwargs)
 
-            # Filter task objects according to the parameters.
-            tasks = (
-                Task.objects.current()
-                .select_related(
-                    "type",
-                    "referral",
-                    "assigned_user",
-                    "state",
-                )
-                .filter(**query_params)
-            )
-            # Business rule: filter out 'Condition clearance' task types.
-            cr = TaskType.objects.get(name="Conditions clearance request")
-            tasks = tasks.exclude(type=cr)
-
-            # Short circuit: disallow a report containing >10000 objects.
-            if tasks.count() > 10000:
-                return HttpResponseBadRequest("Report too large, apply additional filters")
-
-            # Add a worksheet.
-            ws = workbook.add_worksheet("Tasks")
-            # Write the column headers to the new worksheet.
-            row = 0
-            ws.write_row(
-                row=row,
-                col=0,
-                data=[
-                    "Task ID",
-                    "Region(s)",
-                    "Referral ID",
-                    "Referred by",
-                    "Referral type",
-                    "Reference",
-                    "Referral received",
-                    "Task type",
-                    "Task status",
-                    "Assigned user",
-                    "Task start",
-                    "Task due",
-                    "Task complete",
-                    "Stop date",
-                    "Restart date",
-                    "Total stop days",
-                    "File no.",
-                    "DoP triggers",
-                    "Referral description",
-                    "Referral address",
-                    "LGA",
-                ],
-            )
-            row += 1
-
-            # Write the task values to the worksheet.
-            for t in tasks:
-                ws.write_row(
-                    row=row,
-                    col=0,
-                    data=[
-                        t.pk,
-                        t.referral.regions_str,
-                        t.referral.pk,
-                        t.referral.referring_org.name,
-                        t.referral.type.name,
-                        t.referral.reference,
-                        t.referral.referral_date,
-                        t.type.name,
-                        t.state.name,
-                        t.assigned_user.get_full_name(),
-                        t.start_date,
-                        t.due_date,
-                        t.complete_date,
-                        t.stop_date,
-                        t.restart_date,
-                        t.stop_time,
-                        t.referral.file_no,
-                        ", ".join([i.name for i in t.referral.dop_triggers.all()]),
-                        t.referral.description,
-                        t.referral.address,
-                        t.referral.lga.name if t.referral.lga else "",
-                    ],
-                )
-                row += 1
-
-            # Set column widths.
-            ws.set_column("A:A", 9)
-            ws.set_column("B:B", 12)
-            ws.set_column("C:C", 9)
-            ws.set_column("D:E", 35)
-            ws.set_column("F:F", 20)
-            ws.set_column("G:G", 14)
-            ws.set_column("H:J", 20)
-            ws.set_column("K:P", 11)
-            ws.set_column("Q:Q", 25)
-            ws.set_column("R:U", 45)
-
-        workbook.close()
-        return response
+    def get_summaries(self):
+        """Returns querysets of ReferralSummary and TaskSummary rows, filtered by the request query parameters.
+        Raises ValueError for an invalid parameter.
+        """
+        # Default to the last 12 months (including the current month).
+        today = date.today()
+        year, month = divmod(today.year * 12 + today.month - 1 - 11, 12)
+        start = date(year, month + 1, 1)
+        if self.request.GET.get("month__gte"):
+            start = date.fromisoformat(self.request.GET["month__gte"])
+        filters = {"month__gte": start.replace(day=1)}
+        if self.request.GET.get("month__lte"):
+            filters["month__lte"] = date.fromisoformat(self.request.GET["month__lte"])
+        if self.request.GET.get("region__id"):
+            filters["region__pk"] = int(self.request.GET["region__id"])
+        return ReferralSummary.objects.filter(**filters), TaskSummary.objects.filter(**filters)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["page_title"] = " | ".join([settings.APPLICATION_ACRONYM, "Reports", "Summary"])
+        links = [(reverse("site_home"), "Home"), (reverse("reports"), "Reports"), (None, "Summary")]
+        context["breadcrumb_trail"] = breadcrumbs_li(links)
+        context["no_sidebar"] = True
+        context["refresh"] = SummaryRefresh.objects.first()
+
+        # Referrals received per region (rows) per month (columns).
+        months = sorted(set(self.referrals.values_list("month", flat=True)))
+        counts = {}
+        for row in self.referrals.order_by().values("region__name", "month").annotate(count=Sum("referral_count")):
+            counts.setdefault(row["region__name"] or "No region", {})[row["month"]] = row["count"]
+        context["referral_months"] = months
+        context["referral_rows"] = [(region, [counts[region].get(month, 0) for month in months]) for region in sorted(counts)]
+
+        # Tasks completed on time versus overdue, per region.
+        context["task_rows"] = [
+            (row["region__name"] or "No region", row["completed"] - row["overdue"], row["overdue"])
+            for row in self.tasks.order_by("region__name")
+            .values("region__name")
+            .annotate(completed=Sum("completed_count"), overdue=Sum("overdue_count"))
+        ]
+
+        # Average stop days, per task type.
+        context["stop_time_rows"] = [
+            (row["task_type__name"], row["completed"], row["stop_time"] / row["completed"])
+            for row in self.tasks.order_by("task_type__name")
+            .values("task_type__name")
+            .annotate(completed=Sum("completed_count"), stop_time=Sum("stop_time_total"))
+            if row["completed"]
+        ]
+        return context